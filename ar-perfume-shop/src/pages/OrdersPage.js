@@ -25,6 +25,15 @@ const ORDER_TABS = {
   HISTORY: "HISTORY",
 };
 
+// tab -> ?status= filter sent to the API
+const TAB_STATUS = {
+  [ORDER_TABS.TO_PAY]: "TO_PAY",
+  [ORDER_TABS.TO_SHIP]: "TO_SHIP",
+  [ORDER_TABS.TO_RECEIVE]: "TO_RECEIVE",
+  [ORDER_TABS.TO_RATE]: "TO_RATE",
+  [ORDER_TABS.HISTORY]: "COMPLETED,CANCELLED",
+};
+
 const TABS = [
   { key: ORDER_TABS.TO_PAY, label: "To Pay", icon: IoCardOutline },
   { key: ORDER_TABS.TO_SHIP, label: "To Ship", icon: IoCubeOutline },
@@ -44,8 +53,11 @@ export default function OrdersPage() {
   const [tab, setTab] = useState(searchParams.get("tab") || ORDER_TABS.TO_PAY);
 
   const [orders, setOrders] = useState([]);
+  const [nextUrl, setNextUrl] = useState(null);
+  const [counts, setCounts] = useState({});
   const [confirm, setConfirm] = useState({ open: false });
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   const navigate = useNavigate();
 
@@ -60,11 +72,17 @@ export default function OrdersPage() {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [tab]);
 
+  // ✅ server filters by tab + keyset pages (no full history download)
   const loadOrders = async () => {
     setLoading(true);
     try {
-      const res = await http.get("orders/");
-      setOrders(res.data || []);
+      const [res, countsRes] = await Promise.all([
+        http.get("orders/", { params: { status: TAB_STATUS[tab] } }),
+        http.get("orders/counts/"),
+      ]);
+      setOrders(res.data?.results || []);
+      setNextUrl(res.data?.next || null);
+      setCounts(countsRes.data || {});
     } catch (err) {
       console.error("Error loading orders:", err?.response || err);
       const status = err?.response?.status;
@@ -77,18 +95,30 @@ export default function OrdersPage() {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextUrl || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const res = await http.get(nextUrl);
+      setOrders((prev) => [...prev, ...(res.data?.results || [])]);
+      setNextUrl(res.data?.next || null);
+    } catch (err) {
+      console.error("Error loading more orders:", err?.response || err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const changeTab = (next) => {
     if (next === tab) return;
     setTab(next);
     setSearchParams({ tab: next }, { replace: true });
   };
 
+  // list is already filtered server-side; keep the guard for stale rows after an action
   const filtered = useMemo(() => {
-    return orders.filter((o) =>
-      tab === ORDER_TABS.HISTORY
-        ? ["CANCELLED", "COMPLETED"].includes(o.status)
-        : o.status === tab
-    );
+    const allowed = TAB_STATUS[tab].split(",");
+    return orders.filter((o) => allowed.includes(o.status));
   }, [orders, tab]);
 
   // Confirm modal helpers
@@ -199,6 +229,11 @@ export default function OrdersPage() {
                 >
                   <Icon className="text-xl" />
                   <span>{t.label}</span>
+                  {counts[t.key] > 0 && (
+                    <span className="ml-1 min-w-[1.5rem] px-1.5 py-0.5 rounded-full text-xs bg-black/20 text-center">
+                      {counts[t.key]}
+                    </span>
+                  )}
 
                   {isActive && (
                     <motion.div
@@ -266,6 +301,19 @@ export default function OrdersPage() {
             </motion.div>
           )}
 
+          {/* Load more (cursor pages) */}
+          {!loading && nextUrl && (
+            <div className="flex justify-center mt-10">
+              <button
+                onClick={loadMore}
+                disabled={loadingMore}
+                className="px-6 py-3 rounded-xl border border-luxury-gold/40 text-luxury-gold hover:bg-luxury-gold/10 transition disabled:opacity-50"
+              >
+                {loadingMore ? "Loading..." : "Load more"}
+              </button>
+            </div>
+          )}
+
           <ConfirmModal
             open={confirm.open}
             title={confirm.title}
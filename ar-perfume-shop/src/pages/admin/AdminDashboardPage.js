@@ -2,6 +2,19 @@ import { useEffect, useState } from "react";
 import { Link } from "react-router-dom";
 import http from "../../lib/http";
 
+// change over the trend window (first vs last daily snapshot)
+function TrendDelta({ points }) {
+  if (!points || points.length < 2) return null;
+  const diff = points[points.length - 1].count - points[0].count;
+  const color = diff > 0 ? "text-green-400" : diff < 0 ? "text-red-400" : "opacity-60";
+  return (
+    <p className={`text-xs mt-1 ${color}`}>
+      {diff > 0 ? "+" : ""}
+      {diff} in {points.length} days
+    </p>
+  );
+}
+
 export default function AdminDashboardPage() {
   const [stats, setStats] = useState({
     users: 0,
@@ -60,6 +73,7 @@ export default function AdminDashboardPage() {
           <div className="bg-white/10 p-6 rounded-xl text-center shadow-lg">
             <h2 className="text-4xl font-bold">{stats.users}</h2>
             <p className="opacity-70">Users</p>
+            <TrendDelta points={stats.trends?.users} />
             <Link
               to="/admin/users"
               className="mt-4 inline-block px-4 py-2 bg-sky-600 rounded-lg hover:bg-sky-700 font-semibold transition"
@@ -72,6 +86,7 @@ export default function AdminDashboardPage() {
           <div className="bg-white/10 p-6 rounded-xl text-center shadow-lg">
             <h2 className="text-4xl font-bold">{stats.products}</h2>
             <p className="opacity-70">Products</p>
+            <TrendDelta points={stats.trends?.products} />
             <Link
               to="/admin/products"
               className="mt-4 inline-block px-4 py-2 bg-green-600 rounded-lg hover:bg-green-700 font-semibold transition"
@@ -84,6 +99,7 @@ export default function AdminDashboardPage() {
           <div className="bg-white/10 p-6 rounded-xl text-center shadow-lg">
             <h2 className="text-4xl font-bold">{stats.orders}</h2>
             <p className="opacity-70">Orders</p>
+            <TrendDelta points={stats.trends?.orders} />
             <Link
               to="/admin/orders"
               className="mt-4 inline-block px-4 py-2 bg-purple-600 rounded-lg hover:bg-purple-700 font-semibold transition"
@@ -96,6 +112,7 @@ export default function AdminDashboardPage() {
           <div className="bg-white/10 p-6 rounded-xl text-center shadow-lg">
             <h2 className="text-4xl font-bold">{stats.payments}</h2>
             <p className="opacity-70">Payments</p>
+            <TrendDelta points={stats.trends?.payments} />
             <Link
               to="/admin/payments"
               className="mt-4 inline-block px-4 py-2 bg-red-600 rounded-lg hover:bg-red-700 font-semibold transition"
@@ -108,6 +125,7 @@ export default function AdminDashboardPage() {
           <div className="bg-white/10 p-6 rounded-xl text-center shadow-lg">
             <h2 className="text-4xl font-bold">{stats.quizzes}</h2>
             <p className="opacity-70">Quizzes</p>
+            <TrendDelta points={stats.trends?.quizzes} />
             <Link
               to="/admin/quiz-management"
               className="mt-4 inline-block px-4 py-2 bg-yellow-600 rounded-lg hover:bg-yellow-700 font-semibold transition"
@@ -120,6 +138,7 @@ export default function AdminDashboardPage() {
           <div className="bg-white/10 p-6 rounded-xl text-center shadow-lg">
             <h2 className="text-4xl font-bold">{stats.scentPersonas}</h2>
             <p className="opacity-70">Scent Personas</p>
+            <TrendDelta points={stats.trends?.scentPersonas} />
             <Link
               to="/admin/scent-personas"
               className="mt-4 inline-block px-4 py-2 bg-pink-600 rounded-lg hover:bg-pink-700 font-semibold transition"
@@ -132,6 +151,7 @@ export default function AdminDashboardPage() {
           <div className="bg-white/10 p-6 rounded-xl text-center shadow-lg">
             <h2 className="text-4xl font-bold">{stats.ar}</h2>
             <p className="opacity-70">AR Experiences</p>
+            <TrendDelta points={stats.trends?.ar} />
             <Link
               to="/admin/ar-management"
               className="mt-4 inline-block px-4 py-2 bg-indigo-600 rounded-lg hover:bg-indigo-700 font-semibold transition"
@@ -144,6 +164,7 @@ export default function AdminDashboardPage() {
           <div className="bg-white/10 p-6 rounded-xl text-center shadow-lg">
             <h2 className="text-4xl font-bold">{stats.reviews}</h2>
             <p className="opacity-70">User Reviews</p>
+            <TrendDelta points={stats.trends?.reviews} />
             <Link
               to="/admin/reviews"
               className="mt-4 inline-block px-4 py-2 bg-amber-600 rounded-lg hover:bg-amber-700 font-semibold transition"
@@ -156,6 +177,7 @@ export default function AdminDashboardPage() {
           <div className="bg-white/10 p-6 rounded-xl text-center shadow-lg">
             <h2 className="text-4xl font-bold">{stats.retailers}</h2>
             <p className="opacity-70">Retailers</p>
+            <TrendDelta points={stats.trends?.retailers} />
             <Link
               to="/admin/retailers"
               className="mt-4 inline-block px-4 py-2 bg-teal-600 rounded-lg hover:bg-teal-700 font-semibold transition"
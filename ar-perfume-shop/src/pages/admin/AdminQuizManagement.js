@@ -399,6 +399,35 @@ export default function AdminQuizManagement() {
                       {formatAudienceLabel(selectedQuiz.audience)}
                     </span>
                   </div>
+                  <label className="text-xs text-gray-300">Scoring</label>
+                  <div className="flex gap-2">
+                    <select
+                      className="flex-1 px-3 py-2 rounded-lg bg-white/90 text-gray-900 text-sm outline-none"
+                      defaultValue={selectedQuiz.scoring || "TOP_CATEGORY"}
+                      onChange={(e) =>
+                        updateQuizField(selectedQuiz.id, {
+                          scoring: e.target.value,
+                        })
+                      }
+                    >
+                      <option value="TOP_CATEGORY">Top category (all products)</option>
+                      <option value="WEIGHTED">Weighted (ranked top K)</option>
+                    </select>
+                    <input
+                      type="number"
+                      min={1}
+                      max={100}
+                      title="Top K (weighted scoring)"
+                      className="w-20 px-3 py-2 rounded-lg bg-white/10 text-white text-sm outline-none focus:ring-2 focus:ring-sky-400"
+                      defaultValue={selectedQuiz.top_k ?? 12}
+                      onBlur={(e) =>
+                        Number(e.target.value) !== selectedQuiz.top_k &&
+                        updateQuizField(selectedQuiz.id, {
+                          top_k: Number(e.target.value),
+                        })
+                      }
+                    />
+                  </div>
                 </div>
 
                 {/* Allowed products */}
@@ -151,6 +151,34 @@ else:
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": BASE_DIR / "db.sqlite3",
+            # file, not shared-cache memory: the threaded tests need real
+            # locking with a busy timeout ("table is locked" otherwise)
+            "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
+            # no row locks here (select_for_update is a no-op): take the write
+            # lock at BEGIN so transactions queue instead of failing to upgrade
+            "OPTIONS": {"transaction_mode": "IMMEDIATE"},
+        }
+    }
+
+
+# ───────────────────────────────────────────────────────────────
+# Cache
+# ───────────────────────────────────────────────────────────────
+# Shared cache when REDIS_URL is set (all gunicorn workers see the same data),
+# otherwise per-process memory cache for local dev.
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
         }
     }
 
@@ -242,6 +270,16 @@ AWS_QUERYSTRING_AUTH = False
 AWS_S3_FILE_OVERWRITE = False
 AWS_S3_VERIFY = True
 
+# Rendered receipt PDFs: private R2 bucket when configured, local disk otherwise.
+STORAGES["receipts"] = (
+    {"BACKEND": "backend.r2_storage.R2Storage"}
+    if R2_BUCKET_NAME
+    else {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {"location": str(BASE_DIR / "private_media")},
+    }
+)
+
 
 # File upload limits
 DATA_UPLOAD_MAX_MEMORY_SIZE = 52428800  # 50MB
@@ -279,6 +317,8 @@ SIMPLE_JWT = {
 # ───────────────────────────────────────────────────────────────
 CORS_ALLOW_ALL_ORIGINS = DEBUG
 CORS_ALLOWED_ORIGINS = [] if DEBUG else env_list("CORS_ALLOWED_ORIGINS", "")
+# let the admin UI read invoice-export progress ids
+CORS_EXPOSE_HEADERS = ["X-Export-Id", "X-Total-Count"]
 
 
 # ───────────────────────────────────────────────────────────────
@@ -320,6 +360,76 @@ EMAIL_BACKEND = os.getenv(
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
 
 
+# ───────────────────────────────────────────────────────────────
+# Cart
+# ───────────────────────────────────────────────────────────────
+# Guest carts live only in the cache (keyed by a signed cart token).
+GUEST_CART_TTL = int(os.getenv("GUEST_CART_TTL", str(7 * 24 * 3600)))  # seconds
+GUEST_CART_MAX_LINES = int(os.getenv("GUEST_CART_MAX_LINES", "50"))
+
+# Checkout stock holds, and how long an unpaid TO_PAY order may keep its stock.
+# Expired holds / stale orders are cleaned up by `manage.py sweep_reservations`.
+STOCK_HOLD_MINUTES = int(os.getenv("STOCK_HOLD_MINUTES", "15"))
+UNPAID_ORDER_MINUTES = int(os.getenv("UNPAID_ORDER_MINUTES", "60"))
+
+# `Idempotency-Key` header on order creation / checkout / pay:
+# how long a stored response is replayed, and how long a duplicate waits
+# for the first request to finish.
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+IDEMPOTENCY_WAIT_SECONDS = int(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+
+
+# ───────────────────────────────────────────────────────────────
+# Receipts
+# ───────────────────────────────────────────────────────────────
+# Receipt PDFs are re-rendered in a small background thread pool after
+# order / payment changes; set RECEIPT_PRERENDER=False to render on demand only.
+RECEIPT_PRERENDER = os.getenv("RECEIPT_PRERENDER", "True") == "True"
+RECEIPT_WORKERS = int(os.getenv("RECEIPT_WORKERS", "2"))
+
+# reportlab is CPU-bound pure Python: render in a per-worker process pool so it
+# doesn't hold the GIL of gunicorn's gthread workers. 0 = render in-process.
+# RECEIPT_RENDER_CONCURRENCY caps renders running/queued per web worker;
+# a download waits RECEIPT_RENDER_WAIT_SECONDS for a slot, then gets a 503.
+RECEIPT_RENDER_PROCESSES = int(os.getenv("RECEIPT_RENDER_PROCESSES", "1"))
+RECEIPT_RENDER_CONCURRENCY = int(os.getenv("RECEIPT_RENDER_CONCURRENCY", "4"))
+RECEIPT_RENDER_WAIT_SECONDS = int(os.getenv("RECEIPT_RENDER_WAIT_SECONDS", "5"))
+RECEIPT_RENDER_TIMEOUT = int(os.getenv("RECEIPT_RENDER_TIMEOUT", "30"))
+
+# Worker pool for /admin/orders/invoices.zip (fetching stored PDFs / rendering missing ones).
+INVOICE_EXPORT_WORKERS = int(os.getenv("INVOICE_EXPORT_WORKERS", "4"))
+
+
+# ───────────────────────────────────────────────────────────────
+# Payment gateway webhooks
+# ───────────────────────────────────────────────────────────────
+# POST /api/payments/webhook/ is signed with HMAC-SHA256 over "<t>.<body>"
+# (header X-Gateway-Signature: t=<unix>,v1=<hex>). Empty secret = endpoint off.
+PAYMENT_WEBHOOK_SECRET = os.getenv("PAYMENT_WEBHOOK_SECRET", "")
+PAYMENT_WEBHOOK_TOLERANCE = int(os.getenv("PAYMENT_WEBHOOK_TOLERANCE", "300"))  # seconds
+# True: /orders/<id>/pay/ only records the chosen method (PENDING); the
+# gateway's webhook decides success / failure.
+PAYMENT_WEBHOOK_ONLY = os.getenv("PAYMENT_WEBHOOK_ONLY", "False") == "True"
+PAYMENT_EVENT_BATCH_SIZE = int(os.getenv("PAYMENT_EVENT_BATCH_SIZE", "500"))
+# Apply stored events in a background thread of the web worker right after
+# they arrive. False: run `manage.py process_payment_events --loop` instead.
+PAYMENT_EVENTS_AUTO_APPLY = os.getenv("PAYMENT_EVENTS_AUTO_APPLY", "True") == "True"
+
+
+# ───────────────────────────────────────────────────────────────
+# Quiz scoring engine
+# ───────────────────────────────────────────────────────────────
+# Compiled quizzes are rebuilt on quiz/answer/product/persona changes; this
+# bounds staleness for changes that skip signals (stock moved at checkout).
+QUIZ_ENGINE_TTL = int(os.getenv("QUIZ_ENGINE_TTL", "300"))  # seconds
+# Serialized public quiz documents are versioned (admin writes bump the
+# version), so this only limits how long unused versions linger in the cache.
+QUIZ_DOCUMENT_TTL = int(os.getenv("QUIZ_DOCUMENT_TTL", "86400"))  # seconds
+# Quiz funnel: a taker "converts" by buying a recommended product within this
+# many days (rollups from `manage.py rollup_quiz_funnel`).
+QUIZ_CONVERSION_DAYS = int(os.getenv("QUIZ_CONVERSION_DAYS", "7"))
+
+
 # ───────────────────────────────────────────────────────────────
 # Default
 # ───────────────────────────────────────────────────────────────
@@ -6,7 +6,7 @@ from .models import (
     Cart, CartItem, Order, OrderItem, Payment,
     Quiz, QuizQuestion, QuizAnswer, QuizResult,
     Review, ProductMedia, ReviewMedia, SiteAbout, Retailer,
-    ScentPersona,
+    ScentPersona, StockReservation, IdempotencyKey, OrderEvent,
 )
 
 # ─── User Admin ───────────────────────────
@@ -86,18 +86,37 @@ class CartAdmin(admin.ModelAdmin):
     inlines = [CartItemInline]
 
 
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ("user", "product", "quantity", "expires_at", "created_at")
+    list_filter = ("expires_at",)
+    search_fields = ("user__username", "product__name")
+
+
 # ─── Orders & Payments ────────────────────
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
 
 
+class OrderEventInline(admin.TabularInline):
+    model = OrderEvent
+    extra = 0
+    can_delete = False
+    readonly_fields = ("action", "from_status", "to_status", "actor", "note", "created_at")
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ("id", "user", "status", "total", "created_at")
     list_filter = ("status", "created_at")
     search_fields = ("id", "user__username", "user__email")
-    inlines = [OrderItemInline]
+    inlines = [OrderItemInline, OrderEventInline]
+    # status only moves through order_flow transitions (stock, payment, events)
+    readonly_fields = ("status",)
 
 
 @admin.register(Payment)
@@ -106,6 +125,12 @@ class PaymentAdmin(admin.ModelAdmin):
     list_filter = ("method", "status")
 
 
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ("user", "key", "status_code", "created_at")
+    search_fields = ("user__username", "key")
+
+
 # ─── Quiz ─────────────────────────────────
 @admin.register(Quiz)
 class QuizAdmin(admin.ModelAdmin):
@@ -131,6 +156,12 @@ class QuizResultAdmin(admin.ModelAdmin):
     list_display = ("id", "user", "quiz", "recommended_category", "created_at")
     list_filter = ("recommended_category", "created_at")
     search_fields = ("user__username", "quiz__title")
+    readonly_fields = ("recommended_products_list",)
+
+    def recommended_products_list(self, obj):
+        # built from product_ids only when a result is opened
+        return ", ".join(p.name for p in obj.recommended_products) or "-"
+    recommended_products_list.short_description = "Recommended products"
 
 @admin.register(ScentPersona)
 class ScentPersonaAdmin(admin.ModelAdmin):
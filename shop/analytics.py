@@ -0,0 +1,175 @@
+# shop/analytics.py
+"""
+Sales rollups: revenue / orders / units per day, per product, category,
+target and payment method, in SalesRollup.
+
+An order counts as a sale while its status is in SALE_STATUSES (paid, or
+COD and accepted), on the day it was placed. order_flow adds it (+1) when it
+enters that set and takes it back out (-1) when it leaves, so the charts
+never scan Order / OrderItem. `rebuild_sales_rollups` recomputes any range
+from scratch with a few GROUP BY queries.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import CharField, Count, DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Cast, Coalesce, TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import OrderItem, Payment, Product, SalesRollup
+from .upserts import add_upsert
+
+CENTS = Decimal("0.01")
+
+SALE_STATUSES = {"TO_SHIP", "TO_RECEIVE", "TO_RATE", "COMPLETED"}
+
+# dimension -> OrderItem lookup giving the key ("" for the daily total)
+DIMENSIONS = {
+    "total": Value(""),
+    "product": Cast("product_id", output_field=CharField(max_length=100)),
+    "category": F("product__category"),
+    "target": F("product__target"),
+    "payment_method": Coalesce(F("order__payment__method"), Value("NONE")),
+}
+
+GROUPS = {
+    "day": F("day"),
+    "week": TruncWeek("day"),
+    "month": TruncMonth("day"),
+}
+
+
+def counts_as_sale(status):
+    return status in SALE_STATUSES
+
+
+# ─── Aggregation ─────────────────────────────────
+def aggregate_sales(items):
+    """
+    (day, dimension, key, orders, units, revenue) rows for an OrderItem
+    queryset: one GROUP BY day, key query per dimension.
+    """
+    line_total = ExpressionWrapper(
+        F("quantity") * F("price"), output_field=DecimalField(max_digits=14, decimal_places=2)
+    )
+    items = items.annotate(day=TruncDate("order__created_at"))
+    for dimension, key in DIMENSIONS.items():
+        rows = (
+            items.annotate(key=key)
+            .values("day", "key")
+            .annotate(
+                n_orders=Count("order_id", distinct=True),
+                n_units=Sum("quantity"),
+                amount=Sum(line_total),
+            )
+            .order_by()
+        )
+        for row in rows:
+            yield row["day"], dimension, row["key"] or "", row["n_orders"], row["n_units"], row["amount"]
+
+
+def record_sales(order_ids, sign=1):
+    """
+    Add (sign=1) or remove (sign=-1) these orders' contribution to the
+    rollups: one aggregate read + ONE upsert. Runs inside the caller's
+    transaction, so it commits or rolls back with the status change.
+    """
+    order_ids = list(order_ids)
+    if not order_ids:
+        return
+    add_upsert(
+        SalesRollup, ["day", "dimension", "key"], ["orders", "units", "revenue"],
+        [
+            (day, dimension, key, sign * orders, sign * units, sign * revenue)
+            for day, dimension, key, orders, units, revenue in aggregate_sales(
+                OrderItem.objects.filter(order_id__in=order_ids)
+            )
+        ],
+    )
+
+
+def rebuild_sales(date_from=None, date_to=None):
+    """
+    Recompute the rollups for [date_from, date_to] (open ends = everything)
+    from the orders themselves. Call inside a transaction.
+    Returns the number of rollup rows written.
+    """
+    rollups = SalesRollup.objects.all()
+    items = OrderItem.objects.filter(order__status__in=SALE_STATUSES)
+    if date_from:
+        rollups = rollups.filter(day__gte=date_from)
+        items = items.filter(order__created_at__date__gte=date_from)
+    if date_to:
+        rollups = rollups.filter(day__lte=date_to)
+        items = items.filter(order__created_at__date__lte=date_to)
+
+    rollups.delete()
+    created = SalesRollup.objects.bulk_create(
+        (
+            SalesRollup(day=day, dimension=dimension, key=key, orders=orders, units=units, revenue=revenue)
+            for day, dimension, key, orders, units, revenue in aggregate_sales(items)
+        ),
+        batch_size=1000,
+    )
+    return len(created)
+
+
+# ─── Reads ───────────────────────────────────────
+def _labels(dimension, keys):
+    if dimension == "product":
+        ids = [int(k) for k in keys if k.isdigit()]
+        names = dict(Product.objects.filter(id__in=ids).values_list("id", "name"))
+        return {k: names.get(int(k), f"Product {k}") for k in keys if k.isdigit()}
+    if dimension == "target":
+        return dict(Product.TARGET_CHOICES)
+    if dimension == "payment_method":
+        return {**dict(Payment.METHOD_CHOICES), "NONE": "No payment"}
+    return {}
+
+
+def sales_series(date_from, date_to, group="day", dimension="total", limit=None):
+    """
+    Chart data straight from the rollups:
+    {"series": [{period, key, label, orders, units, revenue}], "totals": {..}}
+    `limit` keeps only the top-N keys by revenue over the range.
+    """
+    rollups = SalesRollup.objects.filter(dimension=dimension, day__gte=date_from, day__lte=date_to)
+
+    if limit:
+        keys = list(
+            rollups.values("key").annotate(amount=Sum("revenue"))
+            .order_by("-amount", "key").values_list("key", flat=True)[:limit]
+        )
+        rollups = rollups.filter(key__in=keys)
+
+    rows = list(
+        rollups.annotate(period=GROUPS[group])
+        .values("period", "key")
+        .annotate(n_orders=Sum("orders"), n_units=Sum("units"), amount=Sum("revenue"))
+        .order_by("period", "key")
+    )
+    labels = _labels(dimension, {r["key"] for r in rows})
+
+    series, totals = [], {"orders": 0, "units": 0, "revenue": Decimal("0.00")}
+    for r in rows:
+        if not (r["n_orders"] or r["n_units"] or r["amount"]):
+            continue  # everything in this bucket was cancelled again
+        period, amount = r["period"], (r["amount"] or Decimal("0")).quantize(CENTS)
+        series.append({
+            "period": period.date() if hasattr(period, "date") else period,
+            "key": r["key"],
+            "label": labels.get(r["key"], r["key"]),
+            "orders": r["n_orders"],
+            "units": r["n_units"],
+            "revenue": amount,
+        })
+        totals["orders"] += r["n_orders"]
+        totals["units"] += r["n_units"]
+        totals["revenue"] += amount
+
+    return {"series": series, "totals": totals}
+
+
+def default_range(days=30):
+    today = timezone.now().date()
+    return today - timedelta(days=days - 1), today
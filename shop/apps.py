@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        from .categories import connect_signals as connect_category_signals
+        from .counters import connect_signals
+        from .quiz_engine import connect_signals as connect_quiz_signals
+
+        connect_signals()
+        connect_quiz_signals()
+        connect_category_signals()
@@ -0,0 +1,346 @@
+# shop/cart_service.py
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F
+from rest_framework import serializers
+
+from .models import Cart, CartItem, Product
+from .upserts import add_upsert_sql
+
+CENTS = Decimal("0.01")
+
+
+def _money(value):
+    return str(Decimal(value).quantize(CENTS))
+
+
+def _file_url(file_field, request=None):
+    if not file_field:
+        return None
+    return request.build_absolute_uri(file_field.url) if request else file_field.url
+
+
+def cart_items_queryset(user):
+    """
+    All cart lines of `user` with their product in ONE query.
+    `line_total` is computed by the database (quantity * price).
+    """
+    return (
+        CartItem.objects
+        .filter(cart__user=user)
+        .select_related("product")
+        .only(
+            "id", "cart_id", "quantity",
+            "product__id", "product__name", "product__price",
+            "product__stock", "product__card_image",
+        )
+        .annotate(
+            line_total=ExpressionWrapper(
+                F("quantity") * F("product__price"),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            )
+        )
+        .order_by("id")
+    )
+
+
+def stock_warning(quantity, stock):
+    """Return a warning dict when the wanted quantity can't be fulfilled, else None."""
+    if stock <= 0:
+        return {"code": "OUT_OF_STOCK", "available": 0}
+    if quantity > stock:
+        return {"code": "INSUFFICIENT_STOCK", "available": stock}
+    return None
+
+
+def _summary_payload(lines, request=None, cart_id=None):
+    """
+    lines: iterable of (item_id, product, quantity, line_total).
+    Subtotal, item count and stock warnings are computed in one pass.
+    """
+    items = []
+    warnings = []
+    subtotal = Decimal("0.00")
+    item_count = 0
+
+    for item_id, product, quantity, line_total in lines:
+        warning = stock_warning(quantity, product.stock)
+
+        items.append({
+            "id": item_id,
+            "quantity": quantity,
+            "line_total": _money(line_total),
+            "warning": warning,
+            "product": {
+                "id": product.id,
+                "name": product.name,
+                "price": str(product.price),
+                "stock": product.stock,
+                "card_image": _file_url(product.card_image, request),
+            },
+        })
+        if warning:
+            warnings.append({"item_id": item_id, "product_id": product.id, **warning})
+
+        subtotal += line_total
+        item_count += quantity
+
+    return {
+        "cart_id": cart_id,
+        "items": items,
+        "item_count": item_count,
+        "subtotal": _money(subtotal),
+        "total": _money(subtotal),
+        "warnings": warnings,
+    }
+
+
+def build_cart_summary(user, request=None):
+    """
+    Compact cart payload for the frontend (hit on every page via CartContext).
+    Single query for cart + items + products.
+    """
+    rows = list(cart_items_queryset(user))
+    return _summary_payload(
+        ((item.id, item.product, item.quantity, item.line_total) for item in rows),
+        request,
+        cart_id=rows[0].cart_id if rows else None,
+    )
+
+
+def _add_to_cart_sql():
+    item = connection.ops.quote_name(CartItem._meta.db_table)
+    product = connection.ops.quote_name(Product._meta.db_table)
+    return add_upsert_sql(
+        CartItem, ["cart_id", "product_id"], ["quantity"],
+        select=f"SELECT %s, p.id, %s FROM {product} p WHERE p.id = %s AND p.stock >= %s",
+        where=f"""{item}.quantity + excluded.quantity <= (
+            SELECT stock FROM {product} WHERE id = excluded.product_id
+        )""",
+        returning="id, quantity",
+    )
+
+
+def add_to_cart(user, product, qty):
+    """
+    Race-free add-to-cart.
+
+    A single INSERT ... ON CONFLICT DO UPDATE creates the line or increments
+    it atomically (no read-modify-write), and only if the new quantity still
+    fits in stock. No row back means the stock bound rejected it.
+    """
+    cart, _ = Cart.objects.get_or_create(user=user)
+
+    with connection.cursor() as cursor:
+        cursor.execute(_add_to_cart_sql(), [cart.id, qty, product.id, qty])
+        row = cursor.fetchone()
+
+    if row is None:
+        stock = Product.objects.filter(id=product.id).values_list("stock", flat=True).first() or 0
+        raise serializers.ValidationError({"quantity": f"Only {stock} left in stock."})
+
+    item_id, quantity = row
+    return CartItem(id=item_id, cart=cart, product=product, quantity=quantity)
+
+
+def _load_products(product_ids):
+    """All products touched by a batch in ONE query; unknown ids are a 400."""
+    products = (
+        Product.objects
+        .only("id", "name", "price", "stock", "card_image")
+        .in_bulk(product_ids)
+    )
+    missing = sorted(set(product_ids) - products.keys())
+    if missing:
+        raise serializers.ValidationError(
+            {"operations": [f"Product {pid} does not exist." for pid in missing]}
+        )
+    return products
+
+
+def _resolve_quantities(operations, current, products, clamp_to_stock=False):
+    """
+    Replay operations (in order) on top of `current` {product_id: qty}.
+    Returns the wanted {product_id: qty}; 0 means "remove the line".
+    Over-stock lines raise, or are clamped to stock when merging.
+    """
+    wanted = dict(current)
+    for op in operations:
+        pid = op["product_id"]
+        if op["op"] == "add":
+            wanted[pid] = wanted.get(pid, 0) + op["quantity"]
+        elif op["op"] == "set":
+            wanted[pid] = op["quantity"]
+        else:
+            wanted[pid] = 0
+
+    if clamp_to_stock:
+        return {pid: min(qty, products[pid].stock) for pid, qty in wanted.items()}
+
+    errors = [
+        f"Only {products[pid].stock} left in stock for {products[pid].name}."
+        for pid, qty in wanted.items()
+        if pid in products and qty > products[pid].stock
+    ]
+    if errors:
+        raise serializers.ValidationError({"operations": errors})
+    return wanted
+
+
+def apply_cart_operations(user, operations, clamp_to_stock=False):
+    """
+    Apply a list of validated add/set/remove operations to the user's cart
+    in ONE transaction, holding the cart row lock:
+      - one query for all affected products (bulk stock check)
+      - one query for the existing cart lines
+      - one bulk upsert + a single DELETE for the writes
+    Operations are applied in order, so "set 2, add 1" ends at 3.
+    """
+    product_ids = {op["product_id"] for op in operations}
+
+    with transaction.atomic():
+        # the cart row is the lock: concurrent batches on one cart run one
+        # after the other, so each resolves against the lines the last wrote
+        cart, _ = Cart.objects.select_for_update().get_or_create(user=user)
+        products = _load_products(product_ids)
+
+        existing = {
+            item.product_id: item
+            for item in CartItem.objects.filter(cart=cart, product_id__in=product_ids)
+        }
+        wanted = _resolve_quantities(
+            operations,
+            {pid: item.quantity for pid, item in existing.items()},
+            products,
+            clamp_to_stock=clamp_to_stock,
+        )
+
+        to_upsert, to_delete = [], []
+        for pid, qty in wanted.items():
+            item = existing.get(pid)
+            if qty <= 0:
+                if item:
+                    to_delete.append(item.id)
+            elif item is None or item.quantity != qty:
+                to_upsert.append(CartItem(cart=cart, product_id=pid, quantity=qty))
+
+        if to_upsert:
+            # one INSERT ... ON CONFLICT (cart, product) DO UPDATE for new + changed lines
+            CartItem.objects.bulk_create(
+                to_upsert,
+                update_conflicts=True,
+                unique_fields=["cart", "product"],
+                update_fields=["quantity"],
+            )
+        if to_delete:
+            CartItem.objects.filter(id__in=to_delete).delete()
+
+    return cart
+
+
+# ─── Guest carts (cache only, no DB writes) ───────────────
+GUEST_CART_SALT = "shop.guest-cart"
+
+
+def guest_cart_token(request):
+    """Token from `X-Cart-Token` header or `cart_token` body field."""
+    token = request.headers.get("X-Cart-Token")
+    if not token and hasattr(request, "data"):
+        try:
+            token = request.data.get("cart_token")
+        except AttributeError:
+            token = None
+    return token or None
+
+
+def new_guest_cart_token():
+    return signing.Signer(salt=GUEST_CART_SALT).sign(uuid.uuid4().hex)
+
+
+def _guest_cart_key(token):
+    """Cache key for a signed token, or None if the signature is bad."""
+    if not token:
+        return None
+    try:
+        cart_id = signing.Signer(salt=GUEST_CART_SALT).unsign(token)
+    except signing.BadSignature:
+        return None
+    return f"guest_cart:{cart_id}"
+
+
+def load_guest_cart(token):
+    """{product_id: qty} stored for this token (empty if unknown/expired/forged)."""
+    key = _guest_cart_key(token)
+    if not key:
+        return {}
+    return {int(pid): qty for pid, qty in (cache.get(key) or {}).items()}
+
+
+def save_guest_cart(token, lines):
+    key = _guest_cart_key(token)
+    if not key:
+        return
+    lines = {pid: qty for pid, qty in lines.items() if qty > 0}
+    if not lines:
+        cache.delete(key)
+        return
+    cache.set(key, lines, settings.GUEST_CART_TTL)
+
+
+def apply_guest_cart_operations(token, operations):
+    """Same semantics as apply_cart_operations, but stored in the cache."""
+    current = load_guest_cart(token)
+    products = _load_products({op["product_id"] for op in operations})
+    wanted = _resolve_quantities(operations, current, products)
+
+    lines = {pid: qty for pid, qty in wanted.items() if qty > 0}
+    if len(lines) > settings.GUEST_CART_MAX_LINES:
+        raise serializers.ValidationError(
+            {"operations": [f"A cart can hold at most {settings.GUEST_CART_MAX_LINES} products."]}
+        )
+    save_guest_cart(token, lines)
+    return lines
+
+
+def build_guest_cart_summary(token, request=None):
+    lines = load_guest_cart(token)
+    products = (
+        Product.objects
+        .only("id", "name", "price", "stock", "card_image")
+        .in_bulk(lines.keys())
+    )
+    payload = _summary_payload(
+        (
+            (pid, products[pid], qty, products[pid].price * qty)
+            for pid, qty in lines.items()
+            if pid in products
+        ),
+        request,
+    )
+    payload["cart_token"] = token
+    return payload
+
+
+def merge_guest_cart(user, token):
+    """
+    Fold a guest cart into the user's Cart on login/signup.
+    Quantities are added and clamped to stock; the guest cart is then dropped.
+    """
+    lines = load_guest_cart(token)
+    if not lines:
+        return None
+
+    existing = set(Product.objects.filter(id__in=lines.keys()).values_list("id", flat=True))
+    operations = [
+        {"op": "add", "product_id": pid, "quantity": qty}
+        for pid, qty in lines.items()
+        if pid in existing
+    ]
+    cart = apply_cart_operations(user, operations, clamp_to_stock=True) if operations else None
+    save_guest_cart(token, {})
+    return cart
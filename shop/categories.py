@@ -0,0 +1,89 @@
+# shop/categories.py
+"""
+Product category registry.
+
+The distinct Product.category values feed the QuizAnswer / ScentPersona
+choices (model validation, admin forms, serializers) and /admin/categories/.
+They are kept per process and re-read only when the version token in the
+shared cache moves (any Product save/delete bumps it, on commit). The token itself is
+looked at no more than every CHECK_SECONDS, so evaluating the choices
+normally costs no query and no cache round trip.
+"""
+import logging
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.db.models.signals import post_delete, post_save
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "categories:version"
+CHECK_SECONDS = 5
+FALLBACK = ("Fresh", "Bold")  # no product table yet (fresh database, migrations)
+
+_lock = threading.Lock()
+_categories = None
+_version = None
+_checked_at = 0.0
+
+
+def _shared_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _new_version():
+    global _categories
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+    with _lock:
+        _categories = None
+
+
+def bump_categories(*args, **kwargs):
+    """
+    Signal receiver (and plain helper): re-read categories on next use,
+    everywhere, once the current transaction commits (a re-read before the
+    commit would cache the old list under the new version).
+    """
+    transaction.on_commit(_new_version)
+
+
+def connect_signals():
+    post_save.connect(bump_categories, sender=Product, dispatch_uid="categories_product_save")
+    post_delete.connect(bump_categories, sender=Product, dispatch_uid="categories_product_delete")
+
+
+def get_categories():
+    """Sorted tuple of the distinct non-empty Product.category values."""
+    global _categories, _version, _checked_at
+    now = time.monotonic()
+    with _lock:
+        categories, version, checked_at = _categories, _version, _checked_at
+    if categories is not None and now - checked_at < CHECK_SECONDS:
+        return categories
+
+    shared = _shared_version()
+    if categories is None or shared != version:
+        try:
+            with transaction.atomic():  # savepoint: a failure mustn't break the caller's transaction
+                categories = tuple(sorted(
+                    c for c in Product.objects.order_by().values_list("category", flat=True).distinct() if c
+                ))
+        except DatabaseError as e:
+            logger.info("Category registry fallback: %s", e)
+            return FALLBACK
+    with _lock:
+        _categories, _version, _checked_at = categories, shared, now
+    return categories
+
+
+def category_choices():
+    return [(c, c) for c in get_categories()]
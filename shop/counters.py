@@ -0,0 +1,188 @@
+# shop/counters.py
+"""
+Admin dashboard numbers without COUNT(*).
+
+- EntityCount: one counter per dashboard entity, moved by post_save(created)
+  / post_delete signals (connected in ShopConfig.ready) inside the same
+  transaction as the insert/delete. Each bump hits a random shard row.
+- EntityCountSnapshot: hourly copies of the counters (`snapshot_counts`),
+  read back as 30-day trend lines.
+- dashboard_stats(): served from the shared cache, stale-while-revalidate:
+  a stale entry is returned at once while one worker refreshes it in the
+  background.
+
+Writes that skip signals (bulk_create, raw SQL) must call bump_counts()
+themselves; `snapshot_counts --recount` resets the counters from the tables.
+"""
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .models import (
+    ARExperience, EntityCount, EntityCountSnapshot, Order, Payment, Product,
+    Quiz, Retailer, Review, ScentPersona, User,
+)
+from .upserts import add_upsert
+
+logger = logging.getLogger(__name__)
+
+# dashboard key -> model (keys are what the admin dashboard already reads)
+COUNTED = {
+    "users": User,
+    "products": Product,
+    "orders": Order,
+    "payments": Payment,
+    "quizzes": Quiz,
+    "scentPersonas": ScentPersona,
+    "ar": ARExperience,
+    "reviews": Review,
+    "retailers": Retailer,
+}
+_NAMES = {model: name for name, model in COUNTED.items()}
+
+SHARDS = 8
+TREND_DAYS = 30
+
+CACHE_KEY = "admin_dashboard_stats_v2"
+LOCK_KEY = "admin_dashboard_stats_v2:refresh"
+FRESH_SECONDS = 30
+STALE_SECONDS = 15 * 60
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dashboard")
+
+
+# ─── Counters ────────────────────────────────────
+def bump_counts(deltas):
+    """Apply {name: +/-n} with ONE upsert (random shard per name)."""
+    add_upsert(
+        EntityCount, ["name", "shard"], ["count"],
+        [(name, random.randrange(SHARDS), n) for name, n in deltas.items() if n],
+    )
+
+
+def _on_save(sender, instance, created, **kwargs):
+    if created:
+        bump_counts({_NAMES[sender]: 1})
+
+
+def _on_delete(sender, instance, **kwargs):
+    bump_counts({_NAMES[sender]: -1})
+
+
+def connect_signals():
+    for model in COUNTED.values():
+        post_save.connect(_on_save, sender=model, dispatch_uid=f"entity_count_save_{model.__name__}")
+        post_delete.connect(_on_delete, sender=model, dispatch_uid=f"entity_count_delete_{model.__name__}")
+
+
+def current_counts():
+    """{name: n} for every counted entity: one GROUP BY over <= 9 * SHARDS rows."""
+    counts = dict.fromkeys(COUNTED, 0)
+    for name, n in EntityCount.objects.values("name").annotate(n=Sum("count")).values_list("name", "n"):
+        if name in counts:
+            counts[name] = max(n or 0, 0)
+    return counts
+
+
+def _estimate(model):
+    """Planner row estimate (Postgres only): instant on huge tables, roughly right."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return max(row[0], 0) if row else None
+
+
+def recount(estimate=False):
+    """
+    Reset the counters from the tables themselves (exact COUNT(*), or the
+    planner's estimate on Postgres with estimate=True). Returns {name: n}.
+    """
+    counts = {}
+    for name, model in COUNTED.items():
+        n = _estimate(model) if estimate and connection.vendor == "postgresql" else None
+        counts[name] = model.objects.count() if n is None else n
+
+    with transaction.atomic():
+        EntityCount.objects.filter(name__in=counts).delete()
+        EntityCount.objects.bulk_create([EntityCount(name=name, shard=0, count=n) for name, n in counts.items()])
+    return counts
+
+
+# ─── Snapshots ───────────────────────────────────
+def _this_hour():
+    return timezone.now().replace(minute=0, second=0, microsecond=0)
+
+
+def take_snapshot(keep_days=90):
+    """Copy the counters into this hour's snapshot rows (upsert); prune old ones."""
+    taken_at = _this_hour()
+    EntityCountSnapshot.objects.bulk_create(
+        [EntityCountSnapshot(name=name, taken_at=taken_at, count=n) for name, n in current_counts().items()],
+        update_conflicts=True,
+        unique_fields=["name", "taken_at"],
+        update_fields=["count"],
+    )
+    EntityCountSnapshot.objects.filter(taken_at__lt=taken_at - timedelta(days=keep_days)).delete()
+    return taken_at
+
+
+def trends(days=TREND_DAYS):
+    """{name: [{"date", "count"}]}: the day's last snapshot, oldest first."""
+    since = _this_hour() - timedelta(days=days - 1)
+    since = since.replace(hour=0)
+    last = {}
+    rows = (
+        EntityCountSnapshot.objects.filter(taken_at__gte=since)
+        .order_by("taken_at")
+        .values_list("name", "taken_at", "count")
+    )
+    for name, taken_at, n in rows:
+        last.setdefault(name, {})[taken_at.date()] = n  # later hours overwrite earlier ones
+    return {
+        name: [{"date": day, "count": n} for day, n in last.get(name, {}).items()]
+        for name in COUNTED
+    }
+
+
+# ─── Dashboard (stale-while-revalidate) ──────────
+def _build():
+    if not EntityCountSnapshot.objects.filter(taken_at=_this_hour()).exists():
+        take_snapshot()  # keeps trends going even if the cron job isn't set up
+    data = {**current_counts(), "trends": trends(), "as_of": timezone.now()}
+    cache.set(CACHE_KEY, {"data": data, "fresh_until": time.time() + FRESH_SECONDS}, STALE_SECONDS)
+    return data
+
+
+def _refresh_in_background():
+    close_old_connections()
+    try:
+        _build()
+    except Exception:
+        logger.exception("Dashboard stats refresh failed")
+    finally:
+        cache.delete(LOCK_KEY)
+        close_old_connections()
+
+
+def dashboard_stats():
+    """
+    Cached dashboard payload. Fresh: returned as is. Stale: returned as is and
+    ONE worker (cache.add lock) rebuilds it in the background. Missing: built inline.
+    """
+    entry = cache.get(CACHE_KEY)
+    if entry is None:
+        return _build()
+    if entry["fresh_until"] < time.time() and cache.add(LOCK_KEY, 1, FRESH_SECONDS):
+        _executor.submit(_refresh_in_background)
+    return entry["data"]
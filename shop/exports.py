@@ -0,0 +1,205 @@
+# shop/exports.py
+"""
+Streaming admin exports: /admin/export/<entity>.csv | .ndjson
+
+Rows come from `.values()` + `.iterator(chunk_size)` (a server-side cursor
+on Postgres), and are written out one by one, so memory stays flat and the
+first bytes go out before the last row is read.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_date
+from rest_framework import serializers
+
+from .models import Order, Payment, Review, User
+
+CHUNK_SIZE = 2000
+FLUSH_BYTES = 64 * 1024
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+# entity -> queryset, (column, ORM lookup) pairs, {query param: (lookup, kind)}
+EXPORTS = {
+    "orders": {
+        "queryset": lambda: Order.objects.all(),
+        "columns": [
+            ("id", "id"),
+            ("created_at", "created_at"),
+            ("status", "status"),
+            ("total", "total"),
+            ("user_id", "user_id"),
+            ("username", "user__username"),
+            ("email", "user__email"),
+            ("fullname", "fullname"),
+            ("phone", "phone"),
+            ("line1", "line1"),
+            ("line2", "line2"),
+            ("postcode", "postcode"),
+            ("city", "city"),
+            ("state", "state"),
+            ("country", "country"),
+            ("payment_method", "payment__method"),
+            ("payment_status", "payment__status"),
+            ("transaction_id", "payment__transaction_id"),
+        ],
+        "filters": {
+            "from": ("created_at__date__gte", "date"),
+            "to": ("created_at__date__lte", "date"),
+            "status": ("status__in", "list"),
+            "user": ("user_id", "int"),
+        },
+    },
+    "payments": {
+        "queryset": lambda: Payment.objects.all(),
+        "columns": [
+            ("id", "id"),
+            ("created_at", "created_at"),
+            ("order_id", "order_id"),
+            ("username", "order__user__username"),
+            ("method", "method"),
+            ("amount", "amount"),
+            ("status", "status"),
+            ("transaction_id", "transaction_id"),
+        ],
+        "filters": {
+            "from": ("created_at__date__gte", "date"),
+            "to": ("created_at__date__lte", "date"),
+            "status": ("status__in", "list"),
+            "method": ("method__in", "list"),
+        },
+    },
+    "users": {
+        "queryset": lambda: User.objects.all(),
+        "columns": [
+            ("id", "id"),
+            ("username", "username"),
+            ("email", "email"),
+            ("first_name", "first_name"),
+            ("last_name", "last_name"),
+            ("role", "role"),
+            ("phone", "phone"),
+            ("city", "city"),
+            ("state", "state"),
+            ("country", "country"),
+            ("is_active", "is_active"),
+            ("is_staff", "is_staff"),
+            ("date_joined", "date_joined"),
+            ("last_login", "last_login"),
+        ],
+        "filters": {
+            "from": ("date_joined__date__gte", "date"),
+            "to": ("date_joined__date__lte", "date"),
+            "role": ("role__in", "list"),
+            "is_active": ("is_active", "bool"),
+        },
+    },
+    "reviews": {
+        "queryset": lambda: Review.objects.all(),
+        "columns": [
+            ("id", "id"),
+            ("created_at", "created_at"),
+            ("product_id", "product_id"),
+            ("product", "product__name"),
+            ("username", "user__username"),
+            ("rating", "rating"),
+            ("comment", "comment"),
+        ],
+        "filters": {
+            "from": ("created_at__date__gte", "date"),
+            "to": ("created_at__date__lte", "date"),
+            "rating": ("rating__in", "int_list"),
+            "product": ("product_id", "int"),
+        },
+    },
+}
+
+
+def _parse(name, raw, kind):
+    try:
+        if kind == "date":
+            value = parse_date(raw)
+            if value is None:
+                raise ValueError
+            return value
+        if kind == "int":
+            return int(raw)
+        if kind == "int_list":
+            return [int(v) for v in raw.split(",") if v.strip()]
+        if kind == "bool":
+            if raw.lower() not in ("true", "false", "1", "0"):
+                raise ValueError
+            return raw.lower() in ("true", "1")
+        return [v.strip() for v in raw.split(",") if v.strip()]
+    except ValueError:
+        raise serializers.ValidationError({name: f"Invalid value: {raw}"})
+
+
+def export_rows(entity, params):
+    """
+    (column names, lazy iterator of row lists) for `entity`, filtered by the
+    query params declared in EXPORTS.
+    """
+    spec = EXPORTS[entity]
+    lookups = {}
+    for name, (lookup, kind) in spec["filters"].items():
+        raw = params.get(name)
+        if raw:
+            lookups[lookup] = _parse(name, raw, kind)
+
+    names = [col for col, _ in spec["columns"]]
+    paths = [path for _, path in spec["columns"]]
+    qs = spec["queryset"]().filter(**lookups).order_by("id").values(*paths)
+    rows = ([row[path] for path in paths] for row in qs.iterator(chunk_size=CHUNK_SIZE))
+    return names, rows
+
+
+class _Echo:
+    """csv.writer target that hands the formatted line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def _cell(value):
+    """Neutralise spreadsheet formulas in user-supplied text (=, +, -, @)."""
+    if isinstance(value, str) and value[:1] in ("=", "+", "-", "@"):
+        return "'" + value
+    return value
+
+
+def stream_csv(names, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(names)
+    for row in rows:
+        yield writer.writerow([_cell(v) for v in row])
+
+
+def stream_ndjson(names, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+def _buffered(lines):
+    """Send the first line at once (download starts), then ~64 KB pieces."""
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is not None:
+        yield first
+    buf, size = [], 0
+    for line in lines:
+        buf.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield "".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf)
+
+
+def stream_export(fmt, names, rows):
+    lines = stream_csv(names, rows) if fmt == "csv" else stream_ndjson(names, rows)
+    return _buffered(lines)
@@ -0,0 +1,137 @@
+# shop/idempotency.py
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+
+
+def _fingerprint(request):
+    data = request.data
+    if hasattr(data, "lists"):
+        data = dict(data.lists())
+    raw = json.dumps(
+        [request.method, request.path, data], sort_keys=True, default=str
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _expired_before():
+    return timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+
+
+def _claim(user, key, fingerprint):
+    """
+    Insert the key as "in progress". Returns (row, created).
+    The insert commits immediately so concurrent duplicates see it.
+    """
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, key=key, request_fingerprint=fingerprint
+            ), True
+    except IntegrityError:
+        row = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if row is None:
+            # finished + deleted between our insert and read: try once more
+            return _claim(user, key, fingerprint)
+        if row.created_at < _expired_before():
+            row.delete()
+            return _claim(user, key, fingerprint)
+        return row, False
+
+
+def _wait_for_result(row):
+    """Poll until the first request stores its response (or we give up)."""
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while row is not None and row.status_code is None and time.monotonic() < deadline:
+        time.sleep(0.1)
+        row = IdempotencyKey.objects.filter(id=row.id).first()
+    return row
+
+
+def _replay(row):
+    return Response(
+        row.response_body,
+        status=row.status_code,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+def idempotent(view_method):
+    """
+    Make a DRF view method safe to retry when the client sends `Idempotency-Key`.
+
+    - first request runs, its status + body are stored for IDEMPOTENCY_KEY_TTL_HOURS
+    - replays get the stored response without re-executing
+    - concurrent duplicates wait for the first to finish, then replay
+    - same key with a different request body/path -> 422
+    - exceptions / 5xx drop the key so the client can retry for real
+    Requests without the header (or anonymous) behave as before.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+
+        if len(key) > 255:
+            return Response({"error": f"{HEADER} is too long."}, status=400)
+
+        fingerprint = _fingerprint(request)
+        row, created = _claim(request.user, key, fingerprint)
+
+        if not created:
+            if row.request_fingerprint != fingerprint:
+                return Response(
+                    {"error": f"{HEADER} was already used for a different request."},
+                    status=422,
+                )
+            row = _wait_for_result(row)
+            if row is None:
+                return Response({"error": "Original request failed, please retry."}, status=409)
+            if row.status_code is None:
+                return Response({"error": "Original request is still in progress."}, status=409)
+            return _replay(row)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            row.delete()
+            raise
+
+        if response.status_code >= 500:
+            row.delete()
+            return response
+
+        row.status_code = response.status_code
+        row.response_body = response.data
+        row.save(update_fields=["status_code", "response_body"])
+        return response
+
+    return wrapper
+
+
+def purge_expired_keys(batch_size=1000):
+    """Delete keys past their TTL in id batches. Returns count."""
+    cutoff = _expired_before()
+    removed = 0
+    while True:
+        ids = list(
+            IdempotencyKey.objects
+            .filter(created_at__lt=cutoff)
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return removed
+        removed += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
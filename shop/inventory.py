@@ -0,0 +1,164 @@
+# shop/inventory.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Sum, Value, When
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import OrderItem, Product, StockReservation
+
+
+# ─── Stock helpers ───────────────────────────────
+def _per_product(quantities):
+    """CASE id WHEN a THEN qa WHEN b THEN qb .. ELSE 0 END"""
+    return Case(
+        *[When(id=pid, then=Value(qty)) for pid, qty in quantities.items()],
+        default=Value(0),
+        output_field=PositiveIntegerField(),
+    )
+
+
+def restock(quantities):
+    """
+    Give stock back for {product_id: qty} with ONE UPDATE:
+    UPDATE product SET stock = stock + CASE id WHEN .. THEN .. END WHERE id IN (..)
+    """
+    quantities = {pid: qty for pid, qty in quantities.items() if qty}
+    if not quantities:
+        return
+    Product.objects.filter(id__in=quantities).update(stock=F("stock") + _per_product(quantities))
+
+
+def lock_products(product_ids, fields=("id", "name", "price", "stock")):
+    """
+    {product_id: Product} in ONE query, rows locked (SELECT ... FOR UPDATE)
+    in id order so concurrent checkouts always lock in the same sequence.
+    """
+    products = (
+        Product.objects
+        .select_for_update()
+        .filter(id__in=product_ids)
+        .only(*fields)
+        .order_by("id")
+    )
+    return {p.id: p for p in products}
+
+
+def decrement_stock(quantities):
+    """
+    Take {product_id: qty} out of stock with ONE conditional UPDATE:
+    stock = stock - CASE .. END WHERE (id=a AND stock>=qa) OR (id=b AND stock>=qb) ..
+    Returns False if any row lacked stock (caller must roll back).
+    """
+    quantities = {pid: qty for pid, qty in quantities.items() if qty}
+    if not quantities:
+        return True
+    enough = Q()
+    for pid, qty in quantities.items():
+        enough |= Q(id=pid, stock__gte=qty)
+    updated = Product.objects.filter(enough).update(stock=F("stock") - _per_product(quantities))
+    return updated == len(quantities)
+
+
+def order_quantities(order_ids):
+    """{product_id: total qty} over the items of the given orders (one GROUP BY)."""
+    rows = (
+        OrderItem.objects
+        .filter(order_id__in=order_ids)
+        .values("product_id")
+        .annotate(qty=Sum("quantity"))
+    )
+    return {row["product_id"]: row["qty"] for row in rows}
+
+
+# ─── Reservations (checkout holds) ───────────────
+def active_holds():
+    return StockReservation.objects.filter(expires_at__gt=timezone.now())
+
+
+def held_quantities(product_ids, exclude_user=None):
+    """{product_id: qty held by active reservations} in one aggregate query."""
+    qs = active_holds().filter(product_id__in=product_ids)
+    if exclude_user is not None:
+        qs = qs.exclude(user=exclude_user)
+    rows = qs.values("product_id").annotate(qty=Sum("quantity"))
+    return {row["product_id"]: row["qty"] for row in rows}
+
+
+def available_stock(products, exclude_user=None):
+    """
+    {product_id: stock that can still be sold} = stock - holds of OTHER users.
+    `products` is an iterable of Product instances (already loaded).
+    """
+    products = list(products)
+    held = held_quantities([p.id for p in products], exclude_user=exclude_user)
+    return {p.id: max(p.stock - held.get(p.id, 0), 0) for p in products}
+
+
+def reserve(user, quantities, minutes=None):
+    """
+    Hold {product_id: qty} for `user` for `minutes` (default STOCK_HOLD_MINUTES).
+
+    Product rows are locked in id order so competing shoppers queue up instead
+    of overselling; the user's holds are then written with one bulk upsert
+    (re-reserving replaces the quantity and extends the expiry).
+    """
+    minutes = minutes or settings.STOCK_HOLD_MINUTES
+    expires_at = timezone.now() + timedelta(minutes=minutes)
+
+    with transaction.atomic():
+        products = lock_products(quantities, fields=("id", "name", "stock"))
+        missing = sorted(set(quantities) - products.keys())
+        if missing:
+            raise serializers.ValidationError(
+                {"items": [f"Product {pid} does not exist." for pid in missing]}
+            )
+
+        available = available_stock(products.values(), exclude_user=user)
+        errors = [
+            f"Only {available[p.id]} available for {p.name}."
+            for p in products.values()
+            if quantities[p.id] > available[p.id]
+        ]
+        if errors:
+            raise serializers.ValidationError({"items": errors})
+
+        StockReservation.objects.bulk_create(
+            [
+                StockReservation(user=user, product_id=pid, quantity=qty, expires_at=expires_at)
+                for pid, qty in quantities.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["user", "product"],
+            update_fields=["quantity", "expires_at"],
+        )
+
+    return expires_at
+
+
+def release(user, product_ids=None):
+    """Drop the user's holds (all, or only for `product_ids`)."""
+    qs = StockReservation.objects.filter(user=user)
+    if product_ids is not None:
+        qs = qs.filter(product_id__in=product_ids)
+    qs.delete()
+
+
+# ─── Sweeper ─────────────────────────────────────
+def sweep_expired_holds(batch_size=1000):
+    """Delete expired holds in id batches (short transactions). Returns count."""
+    now = timezone.now()
+    removed = 0
+    while True:
+        ids = list(
+            StockReservation.objects
+            .filter(expires_at__lte=now)
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return removed
+        removed += StockReservation.objects.filter(id__in=ids).delete()[0]
+
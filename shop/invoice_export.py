@@ -0,0 +1,163 @@
+# shop/invoice_export.py
+"""
+Month-end invoice bundles: a ZIP of receipt PDFs streamed while it is built.
+
+- orders are read in id-keyset chunks (never the whole range in memory)
+- PDFs come from the receipts storage when the version already exists,
+  otherwise they're rendered (and stored) by a bounded worker pool
+- each finished PDF is written to the ZIP and flushed to the client
+  immediately; only the small central directory stays in memory
+- progress is kept in the cache under the export id
+"""
+import logging
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from .models import Order, OrderItem
+from .receipts import ensure_receipt, receipt_storage
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.INVOICE_EXPORT_WORKERS, thread_name_prefix="invoice-export"
+)
+
+CHUNK_SIZE = 500
+PROGRESS_TTL = 3600
+
+
+class _Sink:
+    """Write-only file object for ZipFile; hands out what was written so far."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+# ─── Progress ───────────────────────────────────
+def new_export_id():
+    return uuid.uuid4().hex
+
+
+def _progress_key(export_id):
+    return f"invoice_export:{export_id}"
+
+
+def get_progress(export_id):
+    return cache.get(_progress_key(export_id))
+
+
+def _set_progress(export_id, **state):
+    cache.set(_progress_key(export_id), state, PROGRESS_TTL)
+
+
+# ─── Orders ─────────────────────────────────────
+def export_queryset(date_from=None, date_to=None, statuses=None):
+    qs = Order.objects.all()
+    if date_from:
+        qs = qs.filter(created_at__date__gte=date_from)
+    if date_to:
+        qs = qs.filter(created_at__date__lte=date_to)
+    if statuses:
+        qs = qs.filter(status__in=statuses)
+    return qs
+
+
+def _chunks(qs):
+    """Orders with everything the PDF needs, CHUNK_SIZE at a time (id keyset)."""
+    qs = (
+        qs.select_related("payment")
+        .prefetch_related(
+            Prefetch("items", queryset=OrderItem.objects.select_related("product").only(
+                "id", "order_id", "quantity", "price", "product__id", "product__name",
+            ))
+        )
+        .order_by("id")
+    )
+    last_id = 0
+    while True:
+        chunk = list(qs.filter(id__gt=last_id)[:CHUNK_SIZE])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].id
+
+
+def _pdf_bytes(order):
+    """Stored PDF for this version (rendered + stored first if missing). Runs in a worker."""
+    path, _ = ensure_receipt(order)
+    with receipt_storage().open(path, "rb") as fh:
+        return fh.read()
+
+
+def _entry_name(order):
+    return f"{order.created_at:%Y-%m}/order_{order.id}.pdf"
+
+
+# ─── Stream ─────────────────────────────────────
+def stream_invoices_zip(qs, export_id, total):
+    """
+    Generator of ZIP bytes. At most INVOICE_EXPORT_WORKERS * 2 PDFs are in
+    flight (and in memory) at any time; each one is flushed as soon as it's done.
+    """
+    window = settings.INVOICE_EXPORT_WORKERS * 2
+    sink = _Sink()
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED)  # PDFs are already compressed
+    done, failed = 0, []
+    pending = {}
+
+    def finish(futures):
+        nonlocal done
+        for future in futures:
+            order = pending.pop(future)
+            try:
+                archive.writestr(_entry_name(order), future.result())
+            except Exception:
+                logger.exception("Invoice export: order %s failed", order.id)
+                failed.append(order.id)
+            done += 1
+        if done % 50 == 0 or not pending:
+            _set_progress(export_id, total=total, done=done, failed=len(failed), finished=False)
+
+    _set_progress(export_id, total=total, done=0, failed=0, finished=False)
+    try:
+        for chunk in _chunks(qs):
+            for order in chunk:
+                while len(pending) >= window:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    finish(finished)
+                    yield sink.drain()
+                pending[_executor.submit(_pdf_bytes, order)] = order
+
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            finish(finished)
+            yield sink.drain()
+
+        if failed:
+            archive.writestr(
+                "errors.txt",
+                "Could not generate invoices for orders:\n" + "\n".join(map(str, failed)) + "\n",
+            )
+        archive.close()  # central directory
+        yield sink.drain()
+        _set_progress(export_id, total=total, done=done, failed=len(failed), finished=True)
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,35 @@
+"""Pieces shared by the shop management commands."""
+import time
+from abc import ABC, abstractmethod
+
+from django.core.management.base import BaseCommand
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of `samples` (0.0 for none)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class LoopCommand(BaseCommand, ABC):
+    """
+    A periodic job: run_once() once (cron), or with --loop SECONDS again
+    every SECONDS (a small worker process).
+    """
+    loop_help = "Keep running, every SECONDS."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", type=int, default=0, metavar="SECONDS", help=self.loop_help)
+
+    def handle(self, *args, **opts):
+        while True:
+            self.run_once(opts)
+            if not opts["loop"]:
+                return
+            time.sleep(opts["loop"])
+
+    @abstractmethod
+    def run_once(self, opts):
+        """One pass of the job; `opts` are the parsed command options."""
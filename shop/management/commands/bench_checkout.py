@@ -0,0 +1,162 @@
+import logging
+import os
+import secrets
+import statistics
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.db.models import Sum
+from django.test import Client, override_settings
+
+from shop.counters import bump_counts
+from shop.management.base import percentile
+from shop.models import Order, OrderItem, Product
+
+ADDRESS = {
+    "fullname": "Checkout Bench", "phone": "000", "line1": "1 Bench Road",
+    "postcode": "00000", "city": "Bench", "state": "Bench", "country": "MY",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Checkout under contention: --threads buyers POST /api/orders/ for the same "
+        "few products at once until each has made --checkouts attempts. Reports "
+        "accepted orders/s and latency, then checks that stock never went below "
+        "zero and that stock + units sold adds up to what was there. "
+        "Cleans up after itself unless --keep. Only runs against a test database "
+        "(name starting with test_) unless --yes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--checkouts", type=int, default=25, help="Attempts per thread.")
+        parser.add_argument("--products", type=int, default=3, help="Products in every order.")
+        parser.add_argument("--stock", type=int, default=150, help="Starting stock of each product.")
+        parser.add_argument("--quantity", type=int, default=1, help="Units of each product per order.")
+        parser.add_argument("--keep", action="store_true", help="Keep the bench users, products and orders.")
+        parser.add_argument("--yes", action="store_true", help="Run against a database not named test_*.")
+
+    def handle(self, *args, **opts):
+        name = os.path.basename(str(connection.settings_dict["NAME"]))
+        if not name.startswith("test_") and not opts["yes"]:
+            raise CommandError(
+                f"{name!r} is not a test database: bench users, products and orders would be "
+                "created and deleted in it. Pass --yes to do that anyway."
+            )
+
+        run = secrets.token_hex(4)
+        users = self._create_users(run, opts["threads"])
+        products = Product.objects.bulk_create([
+            Product(
+                name=f"bench-{run}-{i}", category="Bench", price=Decimal("10.00"),
+                stock=opts["stock"], description="checkout bench",
+            )
+            for i in range(opts["products"])
+        ])
+        # bulk_create sends no signals: keep the counters right by hand
+        bump_counts({"users": len(users), "products": len(products)})
+        self.stdout.write(
+            f"[bench] run {run}: {opts['threads']} threads x {opts['checkouts']} checkouts of "
+            f"{len(products)} products ({opts['quantity']} each, stock {opts['stock']})"
+        )
+
+        overrides = {
+            "RECEIPT_PRERENDER": False,
+            "ALLOWED_HOSTS": [*settings.ALLOWED_HOSTS, "testserver"],
+        }
+        request_log = logging.getLogger("django.request")
+        level = request_log.level
+        request_log.setLevel(logging.ERROR)  # sold-out 400s are expected, one warning each
+        try:
+            with override_settings(**overrides):
+                elapsed, latencies, statuses = self._checkout(users, products, opts)
+            oversold = self._report(products, opts, elapsed, latencies, statuses)
+        finally:
+            request_log.setLevel(level)
+            if not opts["keep"]:
+                self._cleanup(users, products)
+        if oversold:
+            raise CommandError("Stock went wrong under contention (see above).")
+
+    # ─── setup ───────────────────────────────────
+    def _create_users(self, run, n):
+        User = get_user_model()
+        return User.objects.bulk_create([
+            User(username=f"checkout-bench-{run}-{i}", email=f"checkout-bench-{run}-{i}@example.invalid")
+            for i in range(n)
+        ])
+
+    # ─── phases ──────────────────────────────────
+    def _checkout(self, users, products, opts):
+        body = {
+            **ADDRESS, "payment_method": "COD",
+            "items": [{"product_id": p.id, "quantity": opts["quantity"]} for p in products],
+        }
+        latencies, statuses = [], Counter()
+        lock = threading.Lock()
+        barrier = threading.Barrier(len(users))
+
+        def buyer(user):
+            client = Client()
+            client.force_login(user)
+            local, codes = [], Counter()
+            barrier.wait()
+            for _ in range(opts["checkouts"]):
+                started = time.perf_counter()
+                response = client.post("/api/orders/", body, content_type="application/json")
+                local.append((time.perf_counter() - started) * 1000)
+                codes[response.status_code] += 1
+            with lock:
+                latencies.extend(local)
+                statuses.update(codes)
+            close_old_connections()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=buyer, args=(u,)) for u in users]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - started, latencies, statuses
+
+    def _report(self, products, opts, elapsed, latencies, statuses):
+        accepted = statuses[201]
+        self.stdout.write(
+            f"[bench] {sum(statuses.values())} attempts in {elapsed:.2f}s: {accepted} orders "
+            f"({accepted / max(elapsed, 1e-9):.1f} orders/s) "
+            f"p50={percentile(latencies, 50):.1f}ms p99={percentile(latencies, 99):.1f}ms "
+            f"mean={statistics.fmean(latencies) if latencies else 0:.1f}ms status={dict(statuses)}"
+        )
+
+        sold = dict(
+            OrderItem.objects.filter(product__in=products)
+            .values_list("product_id").annotate(n=Sum("quantity")).order_by()
+        )
+        expected_orders = min(opts["threads"] * opts["checkouts"], opts["stock"] // opts["quantity"])
+        wrong = False
+        for product in Product.objects.filter(id__in=[p.id for p in products]).order_by("id"):
+            units = sold.get(product.id, 0)
+            ok = product.stock >= 0 and product.stock + units == opts["stock"]
+            wrong |= not ok
+            self.stdout.write(
+                f"[bench] check {product.name}: stock={product.stock} sold={units}"
+                + ("" if ok else "  <-- OVERSOLD / MISMATCH")
+            )
+        if accepted != expected_orders:
+            wrong = True
+            self.stdout.write(f"[bench] check: {accepted} orders accepted, expected {expected_orders}  <-- MISMATCH")
+        return wrong
+
+    def _cleanup(self, users, products):
+        # queryset delete sends per-row signals: counters / rollups go back down by themselves
+        Order.objects.filter(user__in=users).delete()
+        Product.objects.filter(id__in=[p.id for p in products]).delete()
+        get_user_model().objects.filter(id__in=[u.id for u in users]).delete()
+        self.stdout.write("[bench] cleaned up")
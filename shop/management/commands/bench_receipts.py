@@ -0,0 +1,88 @@
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import Client, override_settings
+
+from shop.management.base import percentile
+from shop.models import Order
+from shop.receipts import render_receipt_pdf
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency of a normal endpoint (default /api/products/) while "
+        "receipt PDFs render in other threads: no PDFs vs in-process reportlab "
+        "vs the renderer process pool. Mimics one gunicorn gthread worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="/api/products/")
+        parser.add_argument("--seconds", type=float, default=10)
+        parser.add_argument("--request-threads", type=int, default=4)
+        parser.add_argument("--pdf-threads", type=int, default=2)
+        parser.add_argument("--order", type=int, default=None, help="Order id to render (default: latest).")
+
+    def handle(self, *args, **opts):
+        order = (
+            Order.objects.filter(id=opts["order"]) if opts["order"] else Order.objects.order_by("-id")
+        ).select_related("payment").prefetch_related("items__product").first()
+        if order is None:
+            raise CommandError("Need at least one order to render.")
+
+        processes = settings.RECEIPT_RENDER_PROCESSES or 1
+        scenarios = [
+            ("no PDFs", 0, None),
+            ("in-process reportlab", opts["pdf_threads"], 0),
+            (f"process pool ({processes})", opts["pdf_threads"], processes),
+        ]
+
+        self.stdout.write(
+            f"{opts['url']} with {opts['request_threads']} request threads, "
+            f"{opts['seconds']:.0f}s per scenario"
+        )
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            render_receipt_pdf(order)  # warm-up (spawns the pool)
+            for label, pdf_threads, mode in scenarios:
+                overrides = {} if mode is None else {"RECEIPT_RENDER_PROCESSES": mode}
+                with override_settings(**overrides):
+                    latencies, rendered = self._run(order, opts, pdf_threads)
+                self.stdout.write(
+                    f"{label:<26} requests={len(latencies):<6} pdfs={rendered:<5} "
+                    f"p50={percentile(latencies, 50):7.1f}ms "
+                    f"p99={percentile(latencies, 99):7.1f}ms "
+                    f"mean={statistics.fmean(latencies) if latencies else 0:7.1f}ms"
+                )
+
+    def _run(self, order, opts, pdf_threads):
+        stop = time.monotonic() + opts["seconds"]
+        latencies, rendered = [], [0]
+        lock = threading.Lock()
+
+        def requester():
+            client = Client()
+            local = []
+            while time.monotonic() < stop:
+                started = time.perf_counter()
+                client.get(opts["url"])
+                local.append((time.perf_counter() - started) * 1000)
+            with lock:
+                latencies.extend(local)
+            close_old_connections()
+
+        def renderer():
+            while time.monotonic() < stop:
+                render_receipt_pdf(order)
+                with lock:
+                    rendered[0] += 1
+
+        threads = [threading.Thread(target=requester) for _ in range(opts["request_threads"])]
+        threads += [threading.Thread(target=renderer) for _ in range(pdf_threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return latencies, rendered[0]
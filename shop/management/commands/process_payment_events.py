@@ -0,0 +1,20 @@
+from shop.management.base import LoopCommand
+from shop.payment_events import process_payment_events
+
+
+class Command(LoopCommand):
+    help = (
+        "Apply stored payment gateway webhook events (PaymentEvent rows not yet "
+        "processed) in batches. Needed when PAYMENT_EVENTS_AUTO_APPLY=False; "
+        "safe to run next to the web workers (rows are claimed with SKIP LOCKED)."
+    )
+    loop_help = "Keep running, polling every SECONDS."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        super().add_arguments(parser)
+
+    def run_once(self, opts):
+        done = process_payment_events(batch_size=opts["batch_size"])
+        if done or not opts["loop"]:
+            self.stdout.write(f"[payment-events] applied {done} events")
@@ -0,0 +1,57 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils.dateparse import parse_date
+
+from shop.analytics import rebuild_sales
+from shop.models import Order
+
+
+def _month_ranges(start, end):
+    """[start, end] cut at month boundaries."""
+    while start <= end:
+        next_month = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+        yield start, min(end, next_month - timedelta(days=1))
+        start = next_month
+
+
+def _date(value, name):
+    parsed = parse_date(value) if value else None
+    if value and parsed is None:
+        raise CommandError(f"--{name}: expected YYYY-MM-DD, got {value!r}")
+    return parsed
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the SalesRollup tables from orders/items with set-based "
+        "GROUP BY queries, one month per transaction. Use for the initial "
+        "backfill or to repair a date range (default: every order)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", help="First day (YYYY-MM-DD).")
+        parser.add_argument("--to", dest="date_to", help="Last day (YYYY-MM-DD).")
+
+    def handle(self, *args, **opts):
+        date_from = _date(opts["date_from"], "from")
+        date_to = _date(opts["date_to"], "to")
+
+        bounds = Order.objects.aggregate(first=Min("created_at"), last=Max("created_at"))
+        if bounds["first"] is None and not (date_from and date_to):
+            self.stdout.write("[rollups] no orders")
+            return
+        date_from = date_from or bounds["first"].date()
+        date_to = date_to or bounds["last"].date()
+        if date_from > date_to:
+            raise CommandError("--from must be on or before --to")
+
+        written = 0
+        for start, end in _month_ranges(date_from, date_to):
+            with transaction.atomic():
+                rows = rebuild_sales(start, end)
+            written += rows
+            self.stdout.write(f"[rollups] {start:%Y-%m}: {rows} rows")
+        self.stdout.write(f"[rollups] rebuilt {date_from} .. {date_to}: {written} rows")
@@ -0,0 +1,27 @@
+from shop.management.base import LoopCommand
+from shop.quiz_analytics import CHUNK_SIZE, process_quiz_funnel, reset_quiz_funnel
+
+
+class Command(LoopCommand):
+    help = (
+        "Fold new quiz results into the QuizFunnelRollup tables (takers, answers, "
+        "categories) and count conversions for results whose window has closed. "
+        "Incremental from the stored watermarks; run from cron or with --loop. "
+        "--rebuild drops the rollups and starts again from the first result."
+    )
+    loop_help = "Keep running, folding every SECONDS."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+        parser.add_argument("--rebuild", action="store_true", help="Reset rollups and watermarks first.")
+        super().add_arguments(parser)
+
+    def handle(self, *args, **opts):
+        if opts["rebuild"]:
+            reset_quiz_funnel()
+            self.stdout.write("[quiz funnel] rollups reset")
+        super().handle(*args, **opts)
+
+    def run_once(self, opts):
+        counted, converted = process_quiz_funnel(chunk_size=opts["chunk_size"])
+        self.stdout.write(f"[quiz funnel] {counted} results counted, {converted} conversion windows closed")
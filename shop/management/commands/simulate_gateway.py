@@ -0,0 +1,175 @@
+import json
+import random
+import secrets
+import statistics
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import Client, override_settings
+
+from shop.counters import bump_counts
+from shop.management.base import percentile
+from shop.models import Order, PaymentEvent
+from shop.order_flow import bump_status_counts
+from shop.payment_events import FAILED, ONLINE_METHODS, SUCCEEDED, process_payment_events, sign
+
+SIM_USERNAME = "gateway-sim"
+
+
+class Command(BaseCommand):
+    help = (
+        "Local payment gateway: creates TO_PAY orders for a '%s' user, fires signed "
+        "webhook events at /api/payments/webhook/ (failed attempts, duplicates, "
+        "out-of-order delivery) from several threads, then applies them and "
+        "reports ingest and apply throughput. Cleans up after itself unless --keep." % SIM_USERNAME
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=1000)
+        parser.add_argument("--failures", type=float, default=0.3, help="Share of orders with a failed attempt first.")
+        parser.add_argument("--duplicates", type=float, default=0.2, help="Share of events delivered twice.")
+        parser.add_argument("--reorder", type=float, default=0.3, help="Share of events delivered out of order.")
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--per-request", type=int, default=1, help="Events per webhook request.")
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument("--keep", action="store_true", help="Keep the simulated orders and events.")
+
+    def handle(self, *args, **opts):
+        rng = random.Random(opts["seed"])
+        run = secrets.token_hex(4)
+        secret = settings.PAYMENT_WEBHOOK_SECRET or secrets.token_hex(16)
+
+        orders = self._create_orders(opts["orders"])
+        deliveries = self._events(orders, run, rng, opts)
+        unique = len({e["id"] for e in deliveries})
+        self.stdout.write(
+            f"[sim] run {run}: {len(orders)} orders, {len(deliveries)} deliveries "
+            f"({unique} unique events), {opts['threads']} threads"
+        )
+
+        overrides = {
+            "PAYMENT_WEBHOOK_SECRET": secret,
+            "PAYMENT_EVENTS_AUTO_APPLY": False,  # measure ingest and apply separately
+            "RECEIPT_PRERENDER": False,
+            "ALLOWED_HOSTS": [*settings.ALLOWED_HOSTS, "testserver"],
+        }
+        try:
+            with override_settings(**overrides):
+                self._ingest(deliveries, secret, opts)
+                self._apply(orders, run)
+        finally:
+            if not opts["keep"]:
+                self._cleanup(orders, run)
+
+    # ─── setup ───────────────────────────────────
+    def _create_orders(self, n):
+        user, _ = get_user_model().objects.get_or_create(
+            username=SIM_USERNAME, defaults={"email": f"{SIM_USERNAME}@example.invalid"}
+        )
+        orders = Order.objects.bulk_create(
+            [Order(user=user, status="TO_PAY", total=Decimal(10 + i % 90)) for i in range(n)],
+            batch_size=1000,
+        )
+        # bulk_create sends no signals: keep the counters right by hand
+        bump_status_counts({(user.id, "TO_PAY"): len(orders)})
+        bump_counts({"orders": len(orders)})
+        return orders
+
+    def _events(self, orders, run, rng, opts):
+        now = int(time.time())
+        events = []
+        for order in orders:
+            method = rng.choice(ONLINE_METHODS)
+            base = {"order_id": order.id, "amount": str(order.total), "method": method}
+            if rng.random() < opts["failures"]:
+                events.append({
+                    "id": f"sim_{run}_{order.id}_f", "type": FAILED, "created": now - 60,
+                    "data": {**base, "transaction_id": f"sim-{run}-{order.id}-1"},
+                })
+            events.append({
+                "id": f"sim_{run}_{order.id}_s", "type": SUCCEEDED, "created": now,
+                "data": {**base, "transaction_id": f"sim-{run}-{order.id}-2"},
+            })
+
+        deliveries = events + [e for e in events if rng.random() < opts["duplicates"]]
+        deliveries.sort(key=lambda e: (e["created"], e["id"]))
+        # move a share of deliveries to a random later position
+        for i in rng.sample(range(len(deliveries)), int(len(deliveries) * opts["reorder"])):
+            j = rng.randrange(i, len(deliveries))
+            deliveries[i], deliveries[j] = deliveries[j], deliveries[i]
+        return deliveries
+
+    # ─── phases ──────────────────────────────────
+    def _ingest(self, deliveries, secret, opts):
+        per_request = max(1, opts["per_request"])
+        bodies = [
+            json.dumps(deliveries[i] if per_request == 1 else {"events": deliveries[i:i + per_request]}).encode()
+            for i in range(0, len(deliveries), per_request)
+        ]
+        latencies, statuses = [], Counter()
+        lock = threading.Lock()
+        queue = iter(bodies)
+
+        def sender():
+            client = Client()
+            local, codes = [], Counter()
+            while True:
+                with lock:
+                    body = next(queue, None)
+                if body is None:
+                    break
+                started = time.perf_counter()
+                response = client.post(
+                    "/api/payments/webhook/", body, content_type="application/json",
+                    HTTP_X_GATEWAY_SIGNATURE=sign(body, secret),
+                )
+                local.append((time.perf_counter() - started) * 1000)
+                codes[response.status_code] += 1
+            with lock:
+                latencies.extend(local)
+                statuses.update(codes)
+            close_old_connections()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=sender) for _ in range(opts["threads"])]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"[sim] ingest: {len(bodies)} requests in {elapsed:.2f}s "
+            f"({len(deliveries) / elapsed:.0f} events/s) "
+            f"p50={percentile(latencies, 50):.1f}ms p99={percentile(latencies, 99):.1f}ms "
+            f"mean={statistics.fmean(latencies) if latencies else 0:.1f}ms status={dict(statuses)}"
+        )
+
+    def _apply(self, orders, run):
+        started = time.perf_counter()
+        applied = process_payment_events()
+        elapsed = time.perf_counter() - started
+
+        events = PaymentEvent.objects.filter(event_id__startswith=f"sim_{run}_")
+        results = Counter(events.values_list("result", flat=True))
+        paid = Order.objects.filter(id__in=[o.id for o in orders], status="TO_SHIP").count()
+        self.stdout.write(
+            f"[sim] apply: {applied} events in {elapsed:.2f}s ({applied / max(elapsed, 1e-9):.0f} events/s) "
+            f"results={dict(results)}"
+        )
+        self.stdout.write(
+            f"[sim] check: {events.count()} stored events, {paid}/{len(orders)} orders paid"
+            + ("" if paid == len(orders) else "  <-- MISMATCH")
+        )
+
+    def _cleanup(self, orders, run):
+        PaymentEvent.objects.filter(event_id__startswith=f"sim_{run}_").delete()
+        # queryset delete still sends per-row signals: counters / rollups stay right
+        Order.objects.filter(id__in=[o.id for o in orders]).delete()
+        self.stdout.write("[sim] cleaned up")
@@ -0,0 +1,30 @@
+from shop.counters import recount, take_snapshot
+from shop.management.base import LoopCommand
+
+
+class Command(LoopCommand):
+    help = (
+        "Copy the admin dashboard counters into this hour's snapshot (trend "
+        "lines). Run hourly from cron, or with --loop. --recount first resets "
+        "the counters from the tables (--estimate: Postgres planner estimates)."
+    )
+    loop_help = "Keep running, snapshotting every SECONDS."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recount", action="store_true", help="Reset counters from COUNT(*) first.")
+        parser.add_argument(
+            "--estimate", action="store_true",
+            help="With --recount on Postgres: use pg_class.reltuples instead of COUNT(*).",
+        )
+        parser.add_argument("--keep-days", type=int, default=90)
+        super().add_arguments(parser)
+
+    def handle(self, *args, **opts):
+        if opts["recount"]:
+            counts = recount(estimate=opts["estimate"])
+            self.stdout.write("[counts] reset: " + ", ".join(f"{k}={v}" for k, v in counts.items()))
+        super().handle(*args, **opts)
+
+    def run_once(self, opts):
+        taken_at = take_snapshot(keep_days=opts["keep_days"])
+        self.stdout.write(f"[counts] snapshot {taken_at:%Y-%m-%d %H:00}")
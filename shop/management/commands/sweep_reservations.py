@@ -0,0 +1,32 @@
+from shop.idempotency import purge_expired_keys
+from shop.inventory import sweep_expired_holds
+from shop.management.base import LoopCommand
+from shop.order_flow import cancel_stale_unpaid_orders
+
+
+class Command(LoopCommand):
+    help = (
+        "Release expired checkout stock holds and cancel stale unpaid (TO_PAY) orders, "
+        "giving their stock back; also purges expired idempotency keys. "
+        "Run from cron, or with --loop as a small worker."
+    )
+    loop_help = "Keep running, sweeping every SECONDS."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--unpaid-minutes", type=int, default=None,
+            help="Cancel TO_PAY orders older than this (default: settings.UNPAID_ORDER_MINUTES).",
+        )
+        super().add_arguments(parser)
+
+    def run_once(self, opts):
+        holds = sweep_expired_holds(batch_size=opts["batch_size"])
+        orders = cancel_stale_unpaid_orders(
+            minutes=opts["unpaid_minutes"], batch_size=opts["batch_size"]
+        )
+        keys = purge_expired_keys(batch_size=opts["batch_size"])
+        self.stdout.write(
+            f"[sweep] released {holds} holds, cancelled {orders} unpaid orders, "
+            f"purged {keys} idempotency keys"
+        )
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.6 on 2026-10-19 18:34
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    """
+    Fold duplicate carts / cart lines into one before the unique
+    constraints are created (quantities of duplicate lines are summed).
+    """
+    Cart = apps.get_model("shop", "Cart")
+    CartItem = apps.get_model("shop", "CartItem")
+
+    dup_users = (
+        Cart.objects.values("user_id")
+        .annotate(n=Count("id"))
+        .filter(n__gt=1)
+        .values_list("user_id", flat=True)
+    )
+    for user_id in dup_users:
+        cart_ids = list(Cart.objects.filter(user_id=user_id).order_by("id").values_list("id", flat=True))
+        keep, extra = cart_ids[0], cart_ids[1:]
+        CartItem.objects.filter(cart_id__in=extra).update(cart_id=keep)
+        Cart.objects.filter(id__in=extra).delete()
+
+    dup_lines = (
+        CartItem.objects.values("cart_id", "product_id")
+        .annotate(n=Count("id"))
+        .filter(n__gt=1)
+    )
+    for row in dup_lines:
+        items = list(
+            CartItem.objects.filter(cart_id=row["cart_id"], product_id=row["product_id"]).order_by("id")
+        )
+        keep = items[0]
+        keep.quantity = sum(i.quantity for i in items)
+        keep.save(update_fields=["quantity"])
+        CartItem.objects.filter(id__in=[i.id for i in items[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0031_alter_arexperience_app_download_file_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+    ]
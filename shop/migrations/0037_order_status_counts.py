@@ -0,0 +1,49 @@
+# Generated by Django 5.2.6 on 2026-10-19 18:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_status_counts(apps, schema_editor):
+    """One GROUP BY over orders -> one bulk insert of counters."""
+    Order = apps.get_model("shop", "Order")
+    OrderStatusCount = apps.get_model("shop", "OrderStatusCount")
+    rows = Order.objects.values("user_id", "status").annotate(n=Count("id")).order_by()
+    OrderStatusCount.objects.bulk_create(
+        [OrderStatusCount(user_id=r["user_id"], status=r["status"], count=r["n"]) for r in rows],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0036_orderevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('TO_PAY', 'To Pay'), ('TO_SHIP', 'To Ship'), ('TO_RECEIVE', 'To Receive'), ('TO_RATE', 'To Rate'), ('COMPLETED', 'Completed'), ('CANCELLED', 'Cancelled')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status', 'created_at'], name='order_user_status_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='orderstatuscount',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_status_counts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='orderstatuscount',
+            constraint=models.UniqueConstraint(fields=('user', 'status'), name='uniq_order_status_count'),
+        ),
+        migrations.RunPython(backfill_status_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-19 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0037_order_status_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('dimension', models.CharField(choices=[('total', 'Total'), ('product', 'Product'), ('category', 'Category'), ('target', 'Target'), ('payment_method', 'Payment method')], max_length=20)),
+                ('key', models.CharField(blank=True, max_length=100)),
+                ('orders', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dimension', 'day'], name='salesrollup_dimension_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'dimension', 'key'), name='uniq_sales_rollup')],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:00
+
+from django.db import migrations, models
+
+COUNTED = {
+    "users": "User",
+    "products": "Product",
+    "orders": "Order",
+    "payments": "Payment",
+    "quizzes": "Quiz",
+    "scentPersonas": "ScentPersona",
+    "ar": "ARExperience",
+    "reviews": "Review",
+    "retailers": "Retailer",
+}
+
+
+def seed_counts(apps, schema_editor):
+    """Start the counters at the real row counts (signals keep them from here)."""
+    EntityCount = apps.get_model("shop", "EntityCount")
+    EntityCount.objects.bulk_create([
+        EntityCount(name=name, shard=0, count=apps.get_model("shop", model).objects.count())
+        for name, model in COUNTED.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0038_sales_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntityCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('name', 'shard'), name='uniq_entity_count_shard')],
+            },
+        ),
+        migrations.CreateModel(
+            name='EntityCountSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('taken_at', models.DateTimeField()),
+                ('count', models.BigIntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['taken_at'], name='entitycountsnap_taken_idx')],
+                'constraints': [models.UniqueConstraint(fields=('name', 'taken_at'), name='uniq_entity_count_snapshot')],
+            },
+        ),
+        migrations.RunPython(seed_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:03
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0039_entity_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=100, unique=True)),
+                ('type', models.CharField(max_length=50)),
+                ('order_ref', models.BigIntegerField(blank=True, null=True)),
+                ('occurred_at', models.DateTimeField()),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('result', models.CharField(blank=True, choices=[('applied', 'Applied'), ('ignored', 'Ignored'), ('superseded', 'Superseded'), ('rejected', 'Rejected')], max_length=20)),
+                ('detail', models.CharField(blank=True, max_length=255)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='paymentevent_pending_idx'), models.Index(fields=['order_ref', 'occurred_at'], name='paymentevent_order_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0040_payment_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('repair', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='RUNNING', max_length=10)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('scanned_orders', models.PositiveIntegerField(default=0)),
+                ('scanned_payments', models.PositiveIntegerField(default=0)),
+                ('issues_found', models.PositiveIntegerField(default=0)),
+                ('repaired', models.PositiveIntegerField(default=0)),
+                ('summary', models.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True)),
+                ('started_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReconciliationIssue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('amount_mismatch', 'Payment amount differs from order total'), ('success_on_unpaid', 'SUCCESS payment on a TO_PAY order'), ('unpaid_fulfilled', 'Order past TO_PAY without a successful online payment'), ('refund_due', 'SUCCESS payment on a cancelled order'), ('missing_payment', 'Order without a payment'), ('orphan_payment', 'Payment without an order')], max_length=30)),
+                ('order_ref', models.BigIntegerField(blank=True, null=True)),
+                ('payment_ref', models.BigIntegerField(blank=True, null=True)),
+                ('expected', models.CharField(blank=True, max_length=100)),
+                ('actual', models.CharField(blank=True, max_length=100)),
+                ('repaired', models.BooleanField(default=False)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='issues', to='shop.reconciliationrun')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['run', 'kind'], name='reconissue_run_kind_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0041_reconciliation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='scoring',
+            field=models.CharField(choices=[('TOP_CATEGORY', 'Top category (all its products)'), ('WEIGHTED', 'Weighted (ranked top K)')], default='TOP_CATEGORY', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='top_k',
+            field=models.PositiveSmallIntegerField(default=12, help_text='WEIGHTED scoring: how many ranked products to recommend.'),
+        ),
+        migrations.AddField(
+            model_name='quizanswer',
+            name='weights',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:12
+
+from django.db import migrations, models
+
+CHUNK_SIZE = 2000
+
+
+def compact_results(apps, schema_editor):
+    """Copy each result's M2M rows into product_ids (id order), chunk by chunk."""
+    QuizResult = apps.get_model("shop", "QuizResult")
+    Link = QuizResult.recommended_products.through
+    last_id = 0
+    while True:
+        results = list(QuizResult.objects.filter(id__gt=last_id).order_by("id")[:CHUNK_SIZE])
+        if not results:
+            return
+        ids = {}
+        for result_id, product_id in (
+            Link.objects.filter(quizresult_id__in=[r.id for r in results])
+            .order_by("quizresult_id", "product_id").values_list("quizresult_id", "product_id")
+        ):
+            ids.setdefault(result_id, []).append(product_id)
+        for r in results:
+            r.product_ids = ids.get(r.id, [])
+        QuizResult.objects.bulk_update(results, ["product_ids"])
+        last_id = results[-1].id
+
+
+def expand_results(apps, schema_editor):
+    QuizResult = apps.get_model("shop", "QuizResult")
+    Product = apps.get_model("shop", "Product")
+    Link = QuizResult.recommended_products.through
+    last_id = 0
+    while True:
+        results = list(QuizResult.objects.filter(id__gt=last_id).order_by("id")[:CHUNK_SIZE])
+        if not results:
+            return
+        wanted = {pid for r in results for pid in r.product_ids}
+        existing = set(Product.objects.filter(id__in=wanted).values_list("id", flat=True))  # skip deleted
+        Link.objects.bulk_create([
+            Link(quizresult_id=r.id, product_id=pid)
+            for r in results for pid in dict.fromkeys(r.product_ids) if pid in existing
+        ])
+        last_id = results[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0042_quiz_weighted_scoring'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizresult',
+            name='product_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(compact_results, expand_results),
+        migrations.RemoveField(
+            model_name='quizresult',
+            name='recommended_products',
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0043_quiz_result_product_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='quizresult',
+            name='answer_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.CreateModel(
+            name='QuizFunnelRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('metric', models.CharField(choices=[('takers', 'Takers'), ('answer', 'Answer picked'), ('category', 'Recommended category'), ('converted', 'Bought a recommendation')], max_length=20)),
+                ('key', models.CharField(blank=True, max_length=100)),
+                ('count', models.IntegerField(default=0)),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='funnel_rollups', to='shop.quiz')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'metric'], name='quizfunnel_day_metric_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'quiz', 'metric', 'key'), name='uniq_quiz_funnel_rollup')],
+            },
+        ),
+    ]
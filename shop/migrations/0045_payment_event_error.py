@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0044_quiz_funnel_rollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentevent',
+            name='result',
+            field=models.CharField(blank=True, choices=[('applied', 'Applied'), ('ignored', 'Ignored'), ('superseded', 'Superseded'), ('rejected', 'Rejected'), ('error', 'Error')], max_length=20),
+        ),
+    ]
@@ -1,9 +1,9 @@
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractUser
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, pre_delete
 from django.dispatch import receiver
 from django.utils import timezone
-from django.apps import apps
 from cloudinary_storage.storage import RawMediaCloudinaryStorage, MediaCloudinaryStorage
 from backend.r2_storage import R2Storage
 
@@ -145,12 +145,50 @@ class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="cart")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # one cart per user (concurrent get_or_create can't duplicate it)
+            models.UniqueConstraint(fields=["user"], name="uniq_cart_per_user"),
+        ]
+
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            # one line per product; add-to-cart upserts onto it
+            models.UniqueConstraint(fields=["cart", "product"], name="uniq_cartitem_product"),
+        ]
+
+
+# ─── Stock Reservation ────────────────────────────
+class StockReservation(models.Model):
+    """
+    Time-limited hold on stock while a shopper is in checkout.
+    Available stock = Product.stock - sum(active holds of other users).
+    Expired rows are ignored immediately and purged by `sweep_reservations`.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="stock_reservations")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reservations")
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "product"], name="uniq_reservation_user_product"),
+        ]
+        indexes = [
+            models.Index(fields=["product", "expires_at"], name="reservation_product_exp_idx"),
+            models.Index(fields=["expires_at"], name="reservation_expires_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user} holds {self.quantity} x {self.product} until {self.expires_at:%H:%M}"
+
 
 # ─── Order ────────────────────────────────────────
 class Order(models.Model):
@@ -178,6 +216,14 @@ class Order(models.Model):
     state = models.CharField(max_length=100, default="Unknown")
     country = models.CharField(max_length=100, default="Malaysia")
 
+    class Meta:
+        indexes = [
+            # stale TO_PAY sweep: status=... AND created_at < cutoff
+            models.Index(fields=["status", "created_at"], name="order_status_created_idx"),
+            # "My Orders" tabs: user=... AND status=... ORDER BY created_at DESC (keyset pages)
+            models.Index(fields=["user", "status", "created_at"], name="order_user_status_created_idx"),
+        ]
+
     def __str__(self):
         return f"Order {self.id} by {self.user.username}"
 
@@ -189,6 +235,91 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=8, decimal_places=2)
 
 
+class OrderEvent(models.Model):
+    """Append-only log of order status transitions (see shop/order_flow.py)."""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="events")
+    action = models.CharField(max_length=30)
+    from_status = models.CharField(max_length=20)
+    to_status = models.CharField(max_length=20)
+    actor = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["order", "created_at"], name="orderevent_order_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"Order {self.order_id}: {self.from_status} → {self.to_status} ({self.action})"
+
+
+class OrderStatusCount(models.Model):
+    """Per-user order count per status, kept in step by shop/order_flow.py."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="order_status_counts")
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "status"], name="uniq_order_status_count"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.status}: {self.count}"
+
+
+@receiver(post_delete, sender=Order)
+def decrement_order_status_count(sender, instance, **kwargs):
+    OrderStatusCount.objects.filter(
+        user_id=instance.user_id, status=instance.status, count__gt=0
+    ).update(count=models.F("count") - 1)
+
+
+class SalesRollup(models.Model):
+    """
+    Daily sales per dimension value, kept in step by shop/analytics.py.
+    dimension "total" has a single key "" per day.
+    """
+    DIMENSION_CHOICES = [
+        ("total", "Total"),
+        ("product", "Product"),
+        ("category", "Category"),
+        ("target", "Target"),
+        ("payment_method", "Payment method"),
+    ]
+
+    day = models.DateField()
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    key = models.CharField(max_length=100, blank=True)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "dimension", "key"], name="uniq_sales_rollup"),
+        ]
+        indexes = [
+            models.Index(fields=["dimension", "day"], name="salesrollup_dimension_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.dimension}={self.key}: {self.revenue}"
+
+
+@receiver(pre_delete, sender=Order)
+def remove_order_from_sales_rollups(sender, instance, **kwargs):
+    # pre_delete: the items/payment the rollup rows came from still exist here
+    from .analytics import counts_as_sale, record_sales
+
+    if counts_as_sale(instance.status):
+        record_sales([instance.id], -1)
+
+
 # ─── Payment ──────────────────────────────────────
 class Payment(models.Model):
     METHOD_CHOICES = [
@@ -233,6 +364,123 @@ class Payment(models.Model):
     def __str__(self):
         return f"Payment for Order {self.order_id} - {self.status}"
 
+
+class PaymentEvent(models.Model):
+    """
+    Raw payment gateway webhook events, append-only (shop/payment_events.py).
+    event_id is the gateway's id: the unique index drops redeliveries.
+    processed_at / result are filled in once by the batch applier.
+    """
+    RESULT_CHOICES = [
+        ("applied", "Applied"),
+        ("ignored", "Ignored"),
+        ("superseded", "Superseded"),
+        ("rejected", "Rejected"),
+        ("error", "Error"),
+    ]
+
+    event_id = models.CharField(max_length=100, unique=True)
+    type = models.CharField(max_length=50)
+    order_ref = models.BigIntegerField(null=True, blank=True)
+    occurred_at = models.DateTimeField()
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    processed_at = models.DateTimeField(null=True, blank=True)
+    result = models.CharField(max_length=20, choices=RESULT_CHOICES, blank=True)
+    detail = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [
+            # the applier's queue: unprocessed events, oldest first
+            models.Index(
+                fields=["id"], name="paymentevent_pending_idx",
+                condition=models.Q(processed_at__isnull=True),
+            ),
+            # latest applied event per order (out-of-order check)
+            models.Index(fields=["order_ref", "occurred_at"], name="paymentevent_order_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} {self.type} order={self.order_ref} ({self.result or 'pending'})"
+
+
+class ReconciliationRun(models.Model):
+    """One order/payment reconciliation pass (shop/reconciliation.py)."""
+    STATUS_CHOICES = [
+        ("RUNNING", "Running"),
+        ("DONE", "Done"),
+        ("FAILED", "Failed"),
+    ]
+
+    started_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    repair = models.BooleanField(default=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="RUNNING")
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    scanned_orders = models.PositiveIntegerField(default=0)
+    scanned_payments = models.PositiveIntegerField(default=0)
+    issues_found = models.PositiveIntegerField(default=0)
+    repaired = models.PositiveIntegerField(default=0)
+    summary = models.JSONField(default=dict, blank=True)  # {kind: count}
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ["-id"]
+
+    def __str__(self):
+        return f"Reconciliation #{self.id} ({self.status})"
+
+
+class ReconciliationIssue(models.Model):
+    KIND_CHOICES = [
+        ("amount_mismatch", "Payment amount differs from order total"),
+        ("success_on_unpaid", "SUCCESS payment on a TO_PAY order"),
+        ("unpaid_fulfilled", "Order past TO_PAY without a successful online payment"),
+        ("refund_due", "SUCCESS payment on a cancelled order"),
+        ("missing_payment", "Order without a payment"),
+        ("orphan_payment", "Payment without an order"),
+    ]
+
+    run = models.ForeignKey(ReconciliationRun, on_delete=models.CASCADE, related_name="issues")
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    # plain ids, not FKs: the report must survive (and describe) broken links
+    order_ref = models.BigIntegerField(null=True, blank=True)
+    payment_ref = models.BigIntegerField(null=True, blank=True)
+    expected = models.CharField(max_length=100, blank=True)
+    actual = models.CharField(max_length=100, blank=True)
+    repaired = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["run", "kind"], name="reconissue_run_kind_idx"),
+        ]
+
+    def __str__(self):
+        return f"#{self.run_id} {self.kind} order={self.order_ref} payment={self.payment_ref}"
+
+# ─── Idempotency ──────────────────────────────────
+class IdempotencyKey(models.Model):
+    """
+    Stored outcome of a request sent with an `Idempotency-Key` header.
+    status_code is NULL while the first request is still running.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="idempotency_keys")
+    key = models.CharField(max_length=255)
+    request_fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "key"], name="uniq_idempotency_user_key"),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.key} ({self.status_code or 'in progress'})"
+
 # ─── Quiz & Reviews ───────────────────────────────
 # shop/models.py
 
@@ -271,6 +519,17 @@ class Quiz(models.Model):
         help_text="If set, only these products can be recommended by this quiz."
     )
 
+    # How answers turn into recommendations (see shop/quiz_engine.py)
+    SCORING_CHOICES = [
+        ("TOP_CATEGORY", "Top category (all its products)"),
+        ("WEIGHTED", "Weighted (ranked top K)"),
+    ]
+    scoring = models.CharField(max_length=12, choices=SCORING_CHOICES, default="TOP_CATEGORY")
+    top_k = models.PositiveSmallIntegerField(
+        default=12,
+        help_text="WEIGHTED scoring: how many ranked products to recommend."
+    )
+
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -295,21 +554,12 @@ class QuizQuestion(models.Model):
 
 def get_category_choices():
     """
-    Dynamically fetch distinct product categories.
-    Safe even during migrations/startup.
+    Distinct product categories as choices, from the cached registry
+    (shop/categories.py): no query or introspection on the hot path.
     """
-    try:
-        from django.db import connection
+    from .categories import category_choices
 
-        if "shop_product" not in connection.introspection.table_names():
-            return [("Fresh", "Fresh"), ("Bold", "Bold")]
-
-        Product = apps.get_model("shop", "Product")
-        categories = Product.objects.values_list("category", flat=True).distinct()
-        return [(c, c) for c in categories if c]
-    except Exception as e:
-        print(f"[WARN] get_category_choices() fallback due to: {e}")
-        return [("Fresh", "Fresh"), ("Bold", "Bold")]
+    return category_choices()
 
 
 class QuizAnswer(models.Model):
@@ -325,6 +575,9 @@ class QuizAnswer(models.Model):
         default="Fresh"
     )
 
+    # WEIGHTED quizzes: {"Fresh": 2, "Woody": 1}; empty = {category: 1}
+    weights = models.JSONField(default=dict, blank=True)
+
     def __str__(self):
         return f"{self.question.text} → {self.answer_text}"
 
@@ -340,12 +593,64 @@ class QuizResult(models.Model):
         blank=True
     )
     recommended_category = models.CharField(max_length=100)
-    recommended_products = models.ManyToManyField(Product)
+    # recommended Product ids in ranked order (one column instead of an M2M row per product)
+    product_ids = models.JSONField(default=list, blank=True)
+    # selected QuizAnswer ids, sorted (funnel analytics)
+    answer_ids = models.JSONField(default=list, blank=True)
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
 
     def __str__(self):
         return f"{self.user.username if self.user else 'Unknown'} - {self.recommended_category}"
 
+    @property
+    def recommended_products(self):
+        """Recommended products in order, loaded on first access (deleted ones drop out)."""
+        if not hasattr(self, "_recommended_products"):
+            by_id = Product.objects.in_bulk(self.product_ids)
+            self._recommended_products = [by_id[i] for i in self.product_ids if i in by_id]
+        return self._recommended_products
+
+
+class QuizFunnelRollup(models.Model):
+    """
+    Daily quiz funnel counts per quiz, folded in by shop/quiz_analytics.py.
+    metric "takers" has the single key ""; "answer" is keyed by QuizAnswer id,
+    "category" and "converted" by the recommended category.
+    """
+    METRIC_CHOICES = [
+        ("takers", "Takers"),
+        ("answer", "Answer picked"),
+        ("category", "Recommended category"),
+        ("converted", "Bought a recommendation"),
+    ]
+
+    day = models.DateField()
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name="funnel_rollups")
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES)
+    key = models.CharField(max_length=100, blank=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "quiz", "metric", "key"], name="uniq_quiz_funnel_rollup"),
+        ]
+        indexes = [
+            models.Index(fields=["day", "metric"], name="quizfunnel_day_metric_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} quiz {self.quiz_id} {self.metric}={self.key}: {self.count}"
+
+
+class AnalyticsWatermark(models.Model):
+    """How far an incremental analytics job has got (e.g. last QuizResult id folded in)."""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
 
 class ScentPersona(models.Model):
     """
@@ -509,4 +814,41 @@ class Retailer(models.Model):
     def operating_hours_display(self):
         if self.is_open_24h:
             return "Open 24 Hours"
-        return f"{self.opening_time.strftime('%H:%M')} – {self.closing_time.strftime('%H:%M')}"
\ No newline at end of file
+        return f"{self.opening_time.strftime('%H:%M')} – {self.closing_time.strftime('%H:%M')}"
+
+# ─── Admin Dashboard Counters ─────────────────────
+class EntityCount(models.Model):
+    """
+    Row counts for the admin dashboard, moved by signals (shop/counters.py).
+    Each entity is spread over a few shard rows so concurrent inserts don't
+    queue on one hot row; the count is the sum of its shards.
+    """
+    name = models.CharField(max_length=50)
+    shard = models.PositiveSmallIntegerField(default=0)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["name", "shard"], name="uniq_entity_count_shard"),
+        ]
+
+    def __str__(self):
+        return f"{self.name}[{self.shard}]: {self.count}"
+
+
+class EntityCountSnapshot(models.Model):
+    """Hourly copy of the counters, for dashboard trend lines."""
+    name = models.CharField(max_length=50)
+    taken_at = models.DateTimeField()
+    count = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["name", "taken_at"], name="uniq_entity_count_snapshot"),
+        ]
+        indexes = [
+            models.Index(fields=["taken_at"], name="entitycountsnap_taken_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.name} @ {self.taken_at:%Y-%m-%d %H:00}: {self.count}"
@@ -0,0 +1,369 @@
+# shop/order_flow.py
+"""
+Order status transitions in one place.
+
+Every status change (customer actions, admin panel, payment admin, sweeper)
+goes through `apply_transition`, which:
+  - locks the orders, checks the transition is legal for each one
+  - runs the side effects set-based (restock = one CASE UPDATE, payment sync
+    = one UPDATE / bulk_update), and one status UPDATE per batch
+  - appends one OrderEvent per order
+  - moves the per-user OrderStatusCount counters with one upsert
+  - adds / removes orders from the SalesRollup tables as they become
+    (or stop being) sales
+  - queues the receipt PDFs for a background re-render
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .analytics import counts_as_sale, record_sales
+from .counters import bump_counts
+from .inventory import decrement_stock, order_quantities, restock
+from .models import Order, OrderEvent, OrderStatusCount, Payment
+from .receipts import schedule_receipts
+from .upserts import add_upsert
+
+STATUSES = [code for code, _ in Order.STATUS_CHOICES]
+
+# action -> (allowed source statuses, target status)
+TRANSITIONS = {
+    "pay": ({"TO_PAY"}, "TO_SHIP"),
+    "cancel": ({"TO_PAY", "TO_SHIP"}, "CANCELLED"),
+    "ship": ({"TO_SHIP"}, "TO_RECEIVE"),
+    "deliver": ({"TO_RECEIVE"}, "TO_RATE"),
+    "complete": ({"TO_RATE"}, "COMPLETED"),
+    # driven by an admin editing the Payment row (payment already updated)
+    "payment_confirmed": ({"TO_PAY"}, "TO_SHIP"),
+    "payment_reopened": ({"TO_SHIP", "TO_RECEIVE", "TO_RATE"}, "TO_PAY"),
+}
+
+ERRORS = {
+    "pay": "Order cannot be paid.",
+    "cancel": "Order cannot be cancelled.",
+    "ship": "Order cannot be shipped.",
+    "deliver": "Order cannot be delivered.",
+    "complete": "Order cannot be completed.",
+}
+
+# actions that are only used internally, never picked by hand
+INTERNAL_ACTIONS = {"payment_confirmed", "payment_reopened"}
+
+ADMIN_OVERRIDE = "admin_set"
+
+
+class TransitionError(Exception):
+    pass
+
+
+def _stamp(prefix, order_id):
+    return f"{prefix}-{timezone.now().strftime('%Y%m%d%H%M%S')}-{order_id}"
+
+
+def _payment_of(order):
+    try:
+        return order.payment
+    except Payment.DoesNotExist:
+        return None
+
+
+def lock_orders(order_ids):
+    """Orders (+ payment) locked in id order; `of` keeps the lock off the outer join."""
+    return list(
+        Order.objects
+        .select_for_update(of=("self",))
+        .select_related("payment")
+        .filter(id__in=order_ids)
+        .order_by("id")
+    )
+
+
+def _guard(action, order):
+    """Extra per-order preconditions. Returns an error message or None."""
+    if action == "ship":
+        payment = _payment_of(order)
+        if not payment:
+            return "No payment record."
+        if payment.method != "COD" and payment.status != "SUCCESS":
+            return "Payment not successful."
+    return None
+
+
+# ─── Per-user status counters ────────────────────
+def bump_status_counts(deltas):
+    """
+    Apply {(user_id, status): +/-n} to the counters with ONE
+    INSERT ... ON CONFLICT DO UPDATE SET count = count + excluded.count.
+    """
+    add_upsert(
+        OrderStatusCount, ["user_id", "status"], ["count"],
+        [(user_id, status, n) for (user_id, status), n in deltas.items() if n],
+    )
+
+
+def order_created(order):
+    """Bookkeeping for a freshly placed order (items + payment already saved)."""
+    bump_status_counts({(order.user_id, order.status): 1})
+    if counts_as_sale(order.status):
+        record_sales([order.id])
+    schedule_receipts([order.id])
+
+
+def status_counts(user):
+    """{status: n} for every status, from the counters (one indexed read)."""
+    counts = dict.fromkeys(STATUSES, 0)
+    for status, n in OrderStatusCount.objects.filter(user=user).values_list("status", "count"):
+        counts[status] = max(n, 0)
+    return counts
+
+
+# ─── Side effects ────────────────────────────────
+def _sync_payments_on_pay(orders, method=None, transaction_id=None, by_order=None):
+    """
+    Mark (or create) each order's payment SUCCESS.
+    by_order = {order_id: (method, transaction_id)} overrides per order (webhooks).
+    """
+    to_create, to_update = [], []
+    for order in orders:
+        m, txid = (by_order or {}).get(order.id, (method, transaction_id))
+        payment = _payment_of(order)
+        if payment is None:
+            payment = Payment(order=order, amount=order.total, method=m or "CARD")
+            to_create.append(payment)
+        else:
+            to_update.append(payment)
+        if m:
+            payment.method = m
+        payment.amount = order.total
+        if txid:
+            payment.transaction_id = txid
+        if not payment.transaction_id:
+            payment.transaction_id = _stamp("PAY", order.id)
+        payment.status = "SUCCESS"
+        order.payment = payment
+
+    if to_create:
+        Payment.objects.bulk_create(to_create)
+        bump_counts({"payments": len(to_create)})  # bulk_create sends no post_save
+    if to_update:
+        Payment.objects.bulk_update(to_update, ["method", "amount", "transaction_id", "status"])
+
+
+def _sync_payments_on_deliver(orders):
+    """COD becomes SUCCESS when delivered."""
+    changed = []
+    for order in orders:
+        payment = _payment_of(order)
+        if payment and payment.method == "COD" and payment.status != "SUCCESS":
+            payment.status = "SUCCESS"
+            if not payment.transaction_id:
+                payment.transaction_id = _stamp("COD", order.id)
+            changed.append(payment)
+    if changed:
+        Payment.objects.bulk_update(changed, ["status", "transaction_id"])
+
+
+def _cancel_payments(orders):
+    ids = [o.id for o in orders]
+    Payment.objects.filter(order_id__in=ids, status__in=["PENDING", "SUCCESS"]).update(status="CANCELLED")
+    for order in orders:
+        payment = _payment_of(order)
+        if payment and payment.status in ["PENDING", "SUCCESS"]:
+            payment.status = "CANCELLED"
+
+
+def _apply(orders, action, target, actor=None, note="", **payment_fields):
+    """Run side effects + status UPDATE + event log for already-locked, validated orders."""
+    ids = [o.id for o in orders]
+    sources = {o.id: o.status for o in orders}
+
+    leaving_cancelled = [o.id for o in orders if o.status == "CANCELLED" and target != "CANCELLED"]
+    entering_cancelled = [o for o in orders if o.status != "CANCELLED" and target == "CANCELLED"]
+    was_sale = {o.id for o in orders if counts_as_sale(o.status)}
+
+    # taken out with the payment method they were counted under
+    if was_sale and not counts_as_sale(target):
+        record_sales(was_sale, -1)
+
+    if leaving_cancelled and not decrement_stock(order_quantities(leaving_cancelled)):
+        raise TransitionError("Not enough stock to reopen this order.")
+    if entering_cancelled:
+        restock(order_quantities([o.id for o in entering_cancelled]))
+        _cancel_payments(entering_cancelled)
+
+    if action == "pay":
+        _sync_payments_on_pay(orders, **payment_fields)
+    elif action == "deliver":
+        _sync_payments_on_deliver(orders)
+
+    if counts_as_sale(target):
+        record_sales(set(ids) - was_sale)
+
+    Order.objects.filter(id__in=ids).update(status=target)
+
+    deltas = Counter()
+    for order in orders:
+        deltas[(order.user_id, order.status)] -= 1
+        deltas[(order.user_id, target)] += 1
+    bump_status_counts(deltas)
+
+    OrderEvent.objects.bulk_create([
+        OrderEvent(
+            order_id=oid, action=action, from_status=sources[oid],
+            to_status=target, actor=actor, note=note,
+        )
+        for oid in ids
+    ])
+    for order in orders:
+        order.status = target
+
+    schedule_receipts(ids)
+
+
+# ─── Public API ──────────────────────────────────
+def apply_transition(order_ids, action, actor=None, note="", **payment_fields):
+    """
+    Run `action` on many orders in ONE transaction.
+    Orders whose status doesn't allow it are skipped, not fatal.
+    Returns (updated_orders, {order_id: reason}).
+    """
+    if action not in TRANSITIONS:
+        raise TransitionError(f"Unknown action: {action}")
+    sources, target = TRANSITIONS[action]
+
+    with transaction.atomic():
+        orders = lock_orders(order_ids)
+        skipped = {oid: "Order not found." for oid in set(order_ids) - {o.id for o in orders}}
+
+        ready = []
+        for order in orders:
+            if order.status not in sources:
+                skipped[order.id] = ERRORS.get(action, f"Order cannot go from {order.status} to {target}.")
+            elif (reason := _guard(action, order)):
+                skipped[order.id] = reason
+            else:
+                ready.append(order)
+
+        if ready:
+            _apply(ready, action, target, actor=actor, note=note, **payment_fields)
+
+    return ready, skipped
+
+
+def _sync_instance(order, fresh):
+    """Copy status/payment onto the caller's instance (keeps its prefetches)."""
+    order.status = fresh.status
+    payment = _payment_of(fresh)
+    if payment is not None:
+        order.payment = payment
+    return order
+
+
+def transition(order, action, actor=None, note="", **payment_fields):
+    """Single-order wrapper: returns the updated order or raises TransitionError."""
+    updated, skipped = apply_transition([order.id], action, actor=actor, note=note, **payment_fields)
+    if skipped:
+        raise TransitionError(skipped[order.id])
+    return _sync_instance(order, updated[0])
+
+
+def action_for(from_status, to_status):
+    """The declared action taking `from_status` to `to_status`, if any."""
+    for action, (sources, target) in TRANSITIONS.items():
+        if action not in INTERNAL_ACTIONS and from_status in sources and target == to_status:
+            return action
+    return None
+
+
+def set_status(order, new_status, actor=None):
+    """
+    Admin "move this order to X".
+    Declared transitions run their normal side effects; anything else is an
+    override that only keeps stock/payment consistent across CANCELLED.
+    """
+    if new_status not in STATUSES:
+        raise TransitionError("Invalid status")
+    if order.status == new_status:
+        return order
+
+    action = action_for(order.status, new_status)
+    if action:
+        return transition(order, action, actor=actor)
+
+    with transaction.atomic():
+        locked = lock_orders([order.id])
+        if not locked:
+            raise TransitionError("Order not found.")
+        _apply(locked, ADMIN_OVERRIDE, new_status, actor=actor, note="override")
+    return _sync_instance(order, locked[0])
+
+
+def _record_attempt(order, method, transaction_id, actor, payment_status, action):
+    """
+    Payment attempt that doesn't move the order: update payment, log event.
+    The order is locked and re-read first: a pay or webhook that settled it
+    since the caller looked must keep its payment (TransitionError).
+    """
+    with transaction.atomic():
+        locked = lock_orders([order.id])
+        if not locked or locked[0].status != "TO_PAY":
+            raise TransitionError(ERRORS["pay"])
+        order = locked[0]
+        payment = _payment_of(order)
+        if payment is None:
+            payment = Payment(order=order, status="PENDING")
+        payment.method = method
+        payment.amount = order.total
+        if transaction_id:
+            payment.transaction_id = transaction_id
+        payment.status = payment_status
+        payment.save()
+        order.payment = payment
+
+        OrderEvent.objects.create(
+            order=order, action=action, from_status=order.status,
+            to_status=order.status, actor=actor,
+        )
+        schedule_receipts([order.id])
+    return order
+
+
+def record_payment_failure(order, method, transaction_id=None, actor=None):
+    """Failed payment attempt: payment FAILED, order stays TO_PAY, logged."""
+    return _record_attempt(order, method, transaction_id, actor, "FAILED", "pay_failed")
+
+
+def record_payment_started(order, method, transaction_id=None, actor=None):
+    """Payment handed to the gateway: PENDING until its webhook says otherwise."""
+    return _record_attempt(order, method, transaction_id, actor, "PENDING", "pay_started")
+
+
+# ─── Sweeper ─────────────────────────────────────
+def cancel_stale_unpaid_orders(minutes=None, batch_size=200):
+    """
+    Cancel TO_PAY orders older than `minutes` (default UNPAID_ORDER_MINUTES)
+    in batches through the same "cancel" transition (restock, payment sync,
+    event log). Rows locked by a live request are skipped, not waited on.
+    Returns the number of cancelled orders.
+    """
+    minutes = minutes or settings.UNPAID_ORDER_MINUTES
+    cutoff = timezone.now() - timedelta(minutes=minutes)
+    cancelled = 0
+
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Order.objects
+                .select_for_update(skip_locked=True)
+                .filter(status="TO_PAY", created_at__lt=cutoff)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                return cancelled
+
+            updated, _ = apply_transition(ids, "cancel", note="unpaid timeout")
+            cancelled += len(updated)
@@ -0,0 +1,291 @@
+# shop/payment_events.py
+"""
+Payment gateway webhooks.
+
+    gateway --POST--> /payments/webhook/  (signature checked)
+        -> PaymentEvent rows, INSERT ... ON CONFLICT DO NOTHING on event_id
+           (redeliveries are dropped by the unique index), 200 right away
+        -> after commit, a background thread applies pending events in
+           batches through order_flow (one "pay" transition per batch)
+
+Event shape:
+    {"id": "evt_..", "type": "payment.succeeded" | "payment.failed",
+     "created": <unix seconds>,
+     "data": {"order_id": 12, "amount": "110.00", "method": "CARD",
+              "transaction_id": "ch_.."}}
+
+Ordering rules (gateways redeliver and reorder):
+  - a success wins over any failure for the same order
+  - a failure older than the last applied event of its order is ignored
+"""
+import hashlib
+import hmac
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Order, PaymentEvent
+from .order_flow import apply_transition, lock_orders, record_payment_failure
+
+logger = logging.getLogger(__name__)
+
+SUCCEEDED = "payment.succeeded"
+FAILED = "payment.failed"
+ONLINE_METHODS = ("CARD", "FPX", "E_WALLET")
+MAX_EVENTS_PER_REQUEST = 1000
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="payment-events")
+_queued = threading.Lock()  # held while a run is queued but hasn't started
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+# ─── Signatures ──────────────────────────────────
+def sign(body, secret, timestamp=None):
+    """X-Gateway-Signature header value for `body` (bytes)."""
+    timestamp = int(time.time() if timestamp is None else timestamp)
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify_signature(body, header, secret, tolerance):
+    """True if any v1 signature in the header matches and t is within tolerance."""
+    parts = defaultdict(list)
+    for item in (header or "").split(","):
+        key, _, value = item.strip().partition("=")
+        parts[key].append(value)
+    try:
+        timestamp = int(parts["t"][0])
+    except (IndexError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    expected = sign(body, secret, timestamp).split("v1=", 1)[1]
+    return any(hmac.compare_digest(expected, candidate) for candidate in parts["v1"])
+
+
+# ─── Ingest ──────────────────────────────────────
+def _occurred_at(created):
+    moment = datetime.fromtimestamp(int(created), tz=dt_timezone.utc)
+    return moment if settings.USE_TZ else timezone.make_naive(moment)
+
+
+def parse_event(raw):
+    """Gateway JSON -> unsaved PaymentEvent. Raises InvalidEvent."""
+    try:
+        event_id = str(raw["id"])
+        data = raw.get("data") or {}
+        order_ref = data.get("order_id")
+        event = PaymentEvent(
+            event_id=event_id,
+            type=str(raw["type"]),
+            order_ref=int(order_ref) if order_ref is not None else None,
+            occurred_at=_occurred_at(raw["created"]),
+            payload=raw,
+        )
+    except (KeyError, TypeError, ValueError, AttributeError, OverflowError):
+        raise InvalidEvent("Malformed event.")
+    if not event_id or len(event_id) > 100:
+        raise InvalidEvent("Bad event id.")
+    return event
+
+
+def ingest(raw_events):
+    """
+    Store events; redeliveries are dropped by the unique event_id index.
+    Returns (stored, duplicates). Processing is queued for after commit.
+    """
+    events = {}
+    for raw in raw_events:
+        event = parse_event(raw)
+        events.setdefault(event.event_id, event)  # duplicates inside one request
+
+    known = set(
+        PaymentEvent.objects.filter(event_id__in=list(events)).values_list("event_id", flat=True)
+    )
+    fresh = [e for eid, e in events.items() if eid not in known]
+    PaymentEvent.objects.bulk_create(fresh, ignore_conflicts=True)  # races: still one row per id
+
+    if fresh:
+        schedule_processing()
+    return len(fresh), len(raw_events) - len(fresh)
+
+
+# ─── Apply ───────────────────────────────────────
+def _data(event):
+    return event.payload.get("data") or {}
+
+
+def _latest_applied(order_ids):
+    return dict(
+        PaymentEvent.objects.filter(order_ref__in=order_ids, result="applied")
+        .values("order_ref")
+        .annotate(at=Max("occurred_at"))
+        .order_by()
+        .values_list("order_ref", "at")
+    )
+
+
+def _check_success(event, order):
+    """Reason a success can't be applied to this order, or None."""
+    data = _data(event)
+    if data.get("method") not in ONLINE_METHODS:
+        return "rejected", f"Unsupported method {data.get('method')!r}."
+    try:
+        amount = Decimal(str(data.get("amount")))
+    except InvalidOperation:
+        return "rejected", "Bad amount."
+    if amount != order.total:
+        return "rejected", f"Amount {amount} does not match order total {order.total}."
+    if order.status == "CANCELLED":
+        return "ignored", "Order is cancelled; payment needs a refund."
+    if order.status != "TO_PAY":
+        return "ignored", "Order already paid."
+    return None
+
+
+def _apply_batch(events):
+    outcome = {}
+    by_order = defaultdict(list)
+    for event in events:
+        if event.type not in (SUCCEEDED, FAILED):
+            outcome[event.id] = ("ignored", f"Unhandled type {event.type}.")
+        elif event.order_ref is None:
+            outcome[event.id] = ("rejected", "No order id.")
+        else:
+            by_order[event.order_ref].append(event)
+
+    orders = Order.objects.select_related("payment").in_bulk(list(by_order))
+    last_applied = _latest_applied(list(by_order))
+
+    to_pay, failures = {}, []
+    for order_id, evs in by_order.items():
+        evs.sort(key=lambda e: (e.occurred_at, e.id))
+        successes = [e for e in evs if e.type == SUCCEEDED]
+        winner = successes[-1] if successes else evs[-1]
+        for e in evs:
+            if e is not winner:
+                outcome[e.id] = ("superseded", f"Event {winner.event_id} decides this order.")
+
+        order = orders.get(order_id)
+        if order is None:
+            outcome[winner.id] = ("rejected", "Unknown order.")
+        elif winner.type == SUCCEEDED:
+            problem = _check_success(winner, order)
+            if problem:
+                outcome[winner.id] = problem
+            else:
+                to_pay[order_id] = winner
+        elif last_applied.get(order_id) and winner.occurred_at < last_applied[order_id]:
+            outcome[winner.id] = ("ignored", "Older than the last applied event.")
+        elif order.status != "TO_PAY":
+            outcome[winner.id] = ("ignored", "Order is not awaiting payment.")
+        elif _data(winner).get("method") not in ONLINE_METHODS:
+            outcome[winner.id] = ("rejected", f"Unsupported method {_data(winner).get('method')!r}.")
+        else:
+            failures.append((order, winner))
+
+    if to_pay:
+        paid, skipped = apply_transition(
+            list(to_pay), "pay", note="gateway webhook",
+            by_order={oid: (_data(e)["method"], _data(e).get("transaction_id")) for oid, e in to_pay.items()},
+        )
+        for order in paid:
+            outcome[to_pay[order.id].id] = ("applied", "")
+        for oid, reason in skipped.items():
+            outcome[to_pay[oid].id] = ("ignored", reason)
+
+    if failures:
+        # re-check under lock: a concurrent pay / reconciliation may have moved
+        # the order on since the unlocked read, and its SUCCESS must stay
+        still_unpaid = {o.id: o for o in lock_orders([order.id for order, _ in failures]) if o.status == "TO_PAY"}
+        for order, event in failures:
+            locked = still_unpaid.get(order.id)
+            if locked is None:
+                outcome[event.id] = ("ignored", "Order is not awaiting payment.")
+                continue
+            data = _data(event)
+            record_payment_failure(locked, data["method"], data.get("transaction_id"))
+            outcome[event.id] = ("applied", "")
+
+    now = timezone.now()
+    for event in events:
+        event.result, event.detail = outcome[event.id]
+        event.detail = event.detail[:255]
+        event.processed_at = now
+    PaymentEvent.objects.bulk_update(events, ["result", "detail", "processed_at"])
+
+
+def process_payment_events(batch_size=None):
+    """
+    Apply pending events, oldest first, batch_size per transaction.
+    Rows claimed by another worker are skipped (SKIP LOCKED). A batch that
+    raises is retried event by event. Returns the count.
+    """
+    batch_size = batch_size or settings.PAYMENT_EVENT_BATCH_SIZE
+    done = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                PaymentEvent.objects
+                .select_for_update(skip_locked=True)
+                .filter(processed_at__isnull=True)
+                .order_by("id")[:batch_size]
+            )
+            if not events:
+                return done
+            try:
+                with transaction.atomic():
+                    _apply_batch(events)
+            except Exception:
+                logger.exception("Payment event batch failed, applying its events one by one")
+                for event in events:
+                    _apply_alone(event)
+        done += len(events)
+
+
+def _apply_alone(event):
+    """
+    Apply one event in its own savepoint. One that still fails is marked
+    "error" and left behind, so a poison event can't hold up the queue.
+    """
+    try:
+        with transaction.atomic():
+            _apply_batch([event])
+    except Exception as e:
+        logger.exception("Payment event %s failed", event.event_id)
+        event.result, event.detail, event.processed_at = "error", str(e)[:255], timezone.now()
+        event.save(update_fields=["result", "detail", "processed_at"])
+
+
+def _run():
+    _queued.release()
+    close_old_connections()
+    try:
+        process_payment_events()
+    except Exception:
+        logger.exception("Applying payment events failed")
+    finally:
+        close_old_connections()
+
+
+def _kick():
+    # a queued run will see these rows too, so one in the queue is enough
+    if _queued.acquire(blocking=False):
+        _executor.submit(_run)
+
+
+def schedule_processing():
+    if settings.PAYMENT_EVENTS_AUTO_APPLY:
+        transaction.on_commit(_kick)
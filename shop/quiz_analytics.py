@@ -0,0 +1,203 @@
+# shop/quiz_analytics.py
+"""
+Quiz funnel rollups: per quiz and day, how many people took it, which
+answers they picked, which category came out and how many bought a
+recommended product within QUIZ_CONVERSION_DAYS, in QuizFunnelRollup.
+
+A periodic job (`rollup_quiz_funnel`) folds results in incrementally. Two
+AnalyticsWatermark rows hold the last QuizResult id each pass has done:
+  - quiz_funnel:results      takers / answers / categories. Only results
+                             older than SETTLE_SECONDS, so rows still being
+                             committed aren't skipped.
+  - quiz_funnel:conversions  results whose conversion window has closed,
+                             each checked once against sale orders.
+Every chunk's upsert and its watermark move commit together. The admin
+endpoint reads only the rollups.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .analytics import SALE_STATUSES
+from .models import AnalyticsWatermark, OrderItem, Quiz, QuizAnswer, QuizFunnelRollup, QuizResult
+from .upserts import add_upsert
+
+CHUNK_SIZE = 2000
+SETTLE_SECONDS = 60
+
+RESULTS_MARK = "quiz_funnel:results"
+CONVERSIONS_MARK = "quiz_funnel:conversions"
+
+
+def conversion_window():
+    return timedelta(days=settings.QUIZ_CONVERSION_DAYS)
+
+
+# ─── Folding ─────────────────────────────────────
+def _upsert(counts):
+    """Add {(day, quiz_id, metric, key): n} onto the rollups: ONE statement."""
+    add_upsert(
+        QuizFunnelRollup, ["day", "quiz_id", "metric", "key"], ["count"],
+        [(*key, n) for key, n in counts.items()],
+    )
+
+
+def _count_results(results):
+    counts = Counter()
+    for r in results:
+        if r.created_at is None:
+            continue  # pre-timestamp rows: no day to put them on
+        day = r.created_at.date()
+        counts[(day, r.quiz_id, "takers", "")] += 1
+        counts[(day, r.quiz_id, "category", r.recommended_category)] += 1
+        for answer_id in r.answer_ids:
+            counts[(day, r.quiz_id, "answer", str(answer_id))] += 1
+    return counts
+
+
+def _count_conversions(results):
+    """A result converts if its user placed a sale order with one of its products inside the window."""
+    window = conversion_window()
+    results = [r for r in results if r.created_at is not None and r.user_id and r.product_ids]
+    if not results:
+        return Counter()
+
+    bought = defaultdict(list)  # user id -> [(placed_at, product_id)]
+    for user_id, placed_at, product_id in OrderItem.objects.filter(
+        order__user_id__in={r.user_id for r in results},
+        order__status__in=SALE_STATUSES,
+        order__created_at__gte=min(r.created_at for r in results),
+        order__created_at__lte=max(r.created_at for r in results) + window,
+    ).values_list("order__user_id", "order__created_at", "product_id"):
+        bought[user_id].append((placed_at, product_id))
+
+    counts = Counter()
+    for r in results:
+        recommended, until = set(r.product_ids), r.created_at + window
+        if any(r.created_at <= at <= until and pid in recommended for at, pid in bought[r.user_id]):
+            counts[(r.created_at.date(), r.quiz_id, "converted", r.recommended_category)] += 1
+    return counts
+
+
+def _fold_chunk(mark, results_qs, count, chunk_size):
+    """Fold the next chunk after watermark `mark`. Returns the number of results read."""
+    with transaction.atomic():
+        watermark, _ = AnalyticsWatermark.objects.select_for_update().get_or_create(name=mark)
+        results = list(results_qs.filter(id__gt=watermark.position).order_by("id")[:chunk_size])
+        if results:
+            _upsert(count(results))
+            watermark.position = results[-1].id
+            watermark.save(update_fields=["position", "updated_at"])
+    return len(results)
+
+
+def process_quiz_funnel(chunk_size=CHUNK_SIZE):
+    """Fold everything that is due. Returns (results counted, conversions checked)."""
+    now = timezone.now()
+    settled = QuizResult.objects.filter(created_at__lte=now - timedelta(seconds=SETTLE_SECONDS))
+    closed = QuizResult.objects.filter(created_at__lte=now - conversion_window())
+
+    totals = []
+    for mark, qs, count in (
+        (RESULTS_MARK, settled, _count_results),
+        (CONVERSIONS_MARK, closed, _count_conversions),
+    ):
+        done = 0
+        while True:
+            n = _fold_chunk(mark, qs, count, chunk_size)
+            done += n
+            if n < chunk_size:
+                break
+        totals.append(done)
+    return tuple(totals)
+
+
+def reset_quiz_funnel():
+    """Drop the rollups and rewind both watermarks (the next run rebuilds everything)."""
+    with transaction.atomic():
+        QuizFunnelRollup.objects.all().delete()
+        AnalyticsWatermark.objects.filter(name__in=[RESULTS_MARK, CONVERSIONS_MARK]).update(position=0)
+
+
+# ─── Reads ───────────────────────────────────────
+def conversions_final_through():
+    """Last day whose conversion counts can't change any more."""
+    return (timezone.now() - conversion_window()).date() - timedelta(days=1)
+
+
+def quiz_funnel(date_from, date_to, quiz_id=None):
+    """
+    Funnel per quiz straight from the rollups:
+    [{quiz, title, takers, converted, conversion_rate, categories, answers, series}]
+    conversion_rate only covers days whose conversion window has closed.
+    """
+    rollups = QuizFunnelRollup.objects.filter(day__gte=date_from, day__lte=date_to)
+    if quiz_id:
+        rollups = rollups.filter(quiz_id=quiz_id)
+    final_through = conversions_final_through()
+
+    totals = list(rollups.values("quiz_id", "metric", "key").annotate(n=Sum("count")).order_by())
+    daily = list(
+        rollups.filter(metric__in=["takers", "converted"])
+        .values("quiz_id", "day", "metric").annotate(n=Sum("count")).order_by("day")
+    )
+
+    answer_ids = [int(r["key"]) for r in totals if r["metric"] == "answer" and r["key"].isdigit()]
+    answers = {
+        a["id"]: a for a in QuizAnswer.objects.filter(id__in=answer_ids)
+        .values("id", "answer_text", "question_id", "question__text")
+    }
+    titles = dict(Quiz.objects.filter(id__in={r["quiz_id"] for r in totals}).values_list("id", "title"))
+
+    quizzes = {}
+
+    def entry(qid):
+        if qid not in quizzes:
+            quizzes[qid] = {
+                "quiz": qid, "title": titles.get(qid, f"Quiz {qid}"),
+                "takers": 0, "converted": 0, "conversion_rate": None,
+                "categories": [], "answers": [], "series": {},
+                "_settled_takers": 0, "_settled_converted": 0,
+            }
+        return quizzes[qid]
+
+    for r in totals:
+        e, n = entry(r["quiz_id"]), r["n"]
+        if r["metric"] == "takers":
+            e["takers"] += n
+        elif r["metric"] == "converted":
+            e["converted"] += n
+        elif r["metric"] == "category":
+            e["categories"].append({"category": r["key"], "count": n})
+        elif r["metric"] == "answer":
+            a = answers.get(int(r["key"])) if r["key"].isdigit() else None
+            e["answers"].append({
+                "answer": int(r["key"]) if r["key"].isdigit() else r["key"],
+                "answer_text": a["answer_text"] if a else "(deleted answer)",
+                "question": a["question_id"] if a else None,
+                "question_text": a["question__text"] if a else "",
+                "count": n,
+            })
+
+    for r in daily:
+        e = entry(r["quiz_id"])
+        point = e["series"].setdefault(r["day"], {"day": r["day"], "takers": 0, "converted": 0})
+        point[r["metric"]] += r["n"]
+        if r["day"] <= final_through:
+            e["_settled_" + r["metric"]] += r["n"]
+
+    out = []
+    for qid in sorted(quizzes):
+        e = quizzes[qid]
+        settled_takers, settled_converted = e.pop("_settled_takers"), e.pop("_settled_converted")
+        if settled_takers:
+            e["conversion_rate"] = round(settled_converted / settled_takers, 4)
+        e["categories"].sort(key=lambda c: (-c["count"], c["category"]))
+        e["answers"].sort(key=lambda a: (a["question"] or 0, -a["count"]))
+        e["series"] = list(e["series"].values())
+        out.append(e)
+    return out, final_through
@@ -0,0 +1,138 @@
+# shop/quiz_builder.py
+"""
+Whole-quiz reads and writes for the admin (GET/PUT /admin/quizzes/<id>/document/).
+
+The PUT body is the quiz tree: quiz fields, whitelist, questions with their
+answers. It's diffed against the stored tree and only the difference is
+written: bulk_create for rows without an id, bulk_update for changed rows,
+one DELETE per model for rows that are gone. All of that happens in one
+transaction, with a single cache bump on commit instead of one per row.
+Answers may move between questions of the same quiz; ids from other quizzes
+are rejected.
+"""
+from collections import Counter
+
+from django.db import transaction
+from rest_framework import serializers
+
+from .models import Quiz, QuizAnswer, QuizQuestion
+from .quiz_engine import bump_quiz_documents, public_quizzes, single_version_bump
+
+QUIZ_FIELDS = ["title", "label", "audience", "scoring", "top_k"]
+ANSWER_FIELDS = ["question_id", "answer_text", "category", "weights"]
+
+
+def quiz_tree(quiz_id):
+    """The admin document of one quiz (3 queries + the whitelist)."""
+    quiz = public_quizzes().get(id=quiz_id)
+    return {
+        "id": quiz.id,
+        **{f: getattr(quiz, f) for f in QUIZ_FIELDS},
+        "allowed_products": sorted(quiz.allowed_products.values_list("id", flat=True)),
+        "questions": [
+            {
+                "id": q.id,
+                "text": q.text,
+                "answers": [
+                    {"id": a.id, "answer_text": a.answer_text, "category": a.category, "weights": a.weights}
+                    for a in q.answers.all()
+                ],
+            }
+            for q in quiz.questions.all()
+        ],
+    }
+
+
+def _save_whitelist(quiz, product_ids, changes):
+    Link = Quiz.allowed_products.through
+    current = set(Link.objects.filter(quiz_id=quiz.id).values_list("product_id", flat=True))
+    wanted = set(product_ids)
+    if current - wanted:
+        Link.objects.filter(quiz_id=quiz.id, product_id__in=current - wanted).delete()
+    Link.objects.bulk_create([Link(quiz_id=quiz.id, product_id=pid) for pid in wanted - current])
+    changes["whitelist_removed"] += len(current - wanted)
+    changes["whitelist_added"] += len(wanted - current)
+
+
+def _save_questions(quiz, docs, changes):
+    questions = {q.id: q for q in QuizQuestion.objects.filter(quiz=quiz)}
+    answers = {a.id: a for a in QuizAnswer.objects.filter(question__quiz=quiz)}
+
+    unknown_q = [d["id"] for d in docs if "id" in d and d["id"] not in questions]
+    unknown_a = [a["id"] for d in docs for a in d.get("answers", []) if "id" in a and a["id"] not in answers]
+    if unknown_q or unknown_a:
+        raise serializers.ValidationError({
+            "questions": f"Not part of this quiz: questions {unknown_q}, answers {unknown_a}"
+        })
+
+    # questions first: new answers need the new question ids
+    new_q, changed_q, tree = [], [], []
+    for d in docs:
+        if "id" in d:
+            q = questions[d["id"]]
+            if q.text != d["text"]:
+                q.text = d["text"]
+                changed_q.append(q)
+        else:
+            q = QuizQuestion(quiz=quiz, text=d["text"])
+            new_q.append(q)
+        tree.append((q, d.get("answers", [])))
+    QuizQuestion.objects.bulk_create(new_q)
+    QuizQuestion.objects.bulk_update(changed_q, ["text"])
+
+    new_a, changed_a, kept_a = [], [], set()
+    for q, answer_docs in tree:
+        for d in answer_docs:
+            values = {
+                "question_id": q.id, "answer_text": d["answer_text"],
+                "category": d["category"], "weights": d.get("weights") or {},
+            }
+            if "id" in d:
+                a = answers[d["id"]]
+                kept_a.add(a.id)
+                if any(getattr(a, f) != v for f, v in values.items()):
+                    for f, v in values.items():
+                        setattr(a, f, v)
+                    changed_a.append(a)
+            else:
+                new_a.append(QuizAnswer(**values))
+    # moves land before the old questions go, so a moved answer isn't cascaded away
+    QuizAnswer.objects.bulk_update(changed_a, ANSWER_FIELDS)
+    QuizAnswer.objects.bulk_create(new_a)
+
+    gone_a = set(answers) - kept_a
+    gone_q = set(questions) - {d["id"] for d in docs if "id" in d}
+    if gone_a:
+        QuizAnswer.objects.filter(id__in=gone_a).delete()
+    if gone_q:
+        QuizQuestion.objects.filter(id__in=gone_q).delete()
+
+    changes.update({
+        "questions_created": len(new_q), "questions_updated": len(changed_q), "questions_deleted": len(gone_q),
+        "answers_created": len(new_a), "answers_updated": len(changed_a), "answers_deleted": len(gone_a),
+    })
+
+
+def save_quiz_tree(quiz_id, data):
+    """
+    Apply a validated QuizDocumentSerializer payload to quiz `quiz_id`.
+    Returns {change: count}. Raises ValidationError for foreign ids.
+    """
+    changes = Counter()
+    with transaction.atomic(), single_version_bump():
+        quiz = Quiz.objects.select_for_update().get(id=quiz_id)
+
+        fields = [f for f in QUIZ_FIELDS if f in data and getattr(quiz, f) != data[f]]
+        if fields:
+            for f in fields:
+                setattr(quiz, f, data[f])
+            quiz.save(update_fields=fields)
+            changes["quiz_fields_updated"] = len(fields)
+
+        if "allowed_products" in data:
+            _save_whitelist(quiz, data["allowed_products"], changes)
+        if "questions" in data:
+            _save_questions(quiz, data["questions"], changes)
+
+        bump_quiz_documents(quiz.id)
+    return {k: v for k, v in changes.items() if v}
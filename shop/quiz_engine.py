@@ -0,0 +1,399 @@
+# shop/quiz_engine.py
+"""
+Quiz scoring, compiled once per quiz and process.
+
+A CompiledQuiz holds everything a submission needs: answer id -> category,
+the products each category may recommend (audience + whitelist already
+applied) and the persona per category; WEIGHTED quizzes get a per-category
+ranking table instead (see CompiledQuiz._rank_table). Results are memoized
+by the canonical fingerprint of the selected answers (sorted, de-duplicated
+ids), so a repeat combination costs a dict lookup and the submission itself
+only writes the QuizResult.
+
+Invalidation: any save/delete of Quiz, QuizQuestion, QuizAnswer, Product or
+ScentPersona (and whitelist edits) replaces a version token in the shared
+cache when it commits; every process drops its compiled quizzes when the
+token changes.
+Stock moves by queryset UPDATE (checkout) and new reviews don't bump it, so
+compiled quizzes also expire after QUIZ_ENGINE_TTL seconds.
+
+The public quiz API reads serialized quiz documents from the shared cache,
+keyed by a per-quiz version token that any save/delete of a Quiz,
+QuizQuestion or QuizAnswer bumps on commit (bump_quiz_documents), whether
+it comes from the API, the Django admin or a shell.
+"""
+import heapq
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, Prefetch, Sum
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.http import Http404
+
+from .models import Product, Quiz, QuizAnswer, QuizQuestion, ScentPersona
+
+VERSION_KEY = "quiz_engine:version"
+DOC_VERSION_KEY = "quiz_doc:version:{}"
+DOC_LIST_VERSION_KEY = "quiz_doc:version:list"
+MEMO_SIZE = 512
+
+# WEIGHTED scoring: score = affinity * answer weight of the product's category
+# (answer vector normalised to 1) + rating * bayesian rating / 5
+# + stock * min(stock, STOCK_CAP) / STOCK_CAP
+RANK_WEIGHTS = {"affinity": 0.7, "rating": 0.2, "stock": 0.1}
+RATING_PRIOR = 4.0          # catalog mean used when nothing is rated yet
+RATING_PRIOR_WEIGHT = 5     # "virtual reviews" at the catalog mean
+STOCK_CAP = 20
+
+# quiz.audience -> allowed product.target values (ANY = no restriction)
+AUDIENCE_TARGETS = {
+    "MEN": ("MEN", "UNISEX"),
+    "WOMEN": ("WOMEN", "UNISEX"),
+    "UNISEX": ("UNISEX",),
+}
+
+_lock = threading.Lock()
+_batch = threading.local()
+_compiled = {}
+_compiled_version = None
+
+
+# ─── Versioning ──────────────────────────────────
+def _token(key):
+    """Shared version token under `key`; a missing key starts a new one."""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def quiz_version():
+    """Token for "quiz scoring data as of now"."""
+    return _token(VERSION_KEY)
+
+
+def _new_version():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def bump_quiz_version(*args, **kwargs):
+    """
+    Signal receiver (and plain helper): every compiled quiz is stale once the
+    current transaction commits (so no worker recompiles from uncommitted rows).
+    """
+    if getattr(_batch, "active", False):
+        return
+    transaction.on_commit(_new_version)
+
+
+@contextmanager
+def single_version_bump():
+    """Bulk quiz writes: per-row signal bumps inside are dropped, one bump on commit instead."""
+    _batch.active = True
+    try:
+        yield
+    finally:
+        _batch.active = False
+    transaction.on_commit(_new_version)
+
+
+def connect_signals():
+    for model in (Quiz, QuizQuestion, QuizAnswer, Product, ScentPersona):
+        post_save.connect(bump_quiz_version, sender=model, dispatch_uid=f"quiz_version_save_{model.__name__}")
+        post_delete.connect(bump_quiz_version, sender=model, dispatch_uid=f"quiz_version_delete_{model.__name__}")
+    m2m_changed.connect(
+        bump_quiz_version, sender=Quiz.allowed_products.through, dispatch_uid="quiz_version_whitelist",
+    )
+    for model in (Quiz, QuizQuestion, QuizAnswer):
+        pre_save.connect(_document_before_save, sender=model, dispatch_uid=f"quiz_doc_pre_save_{model.__name__}")
+        post_save.connect(_document_changed, sender=model, dispatch_uid=f"quiz_doc_save_{model.__name__}")
+        post_delete.connect(_document_changed, sender=model, dispatch_uid=f"quiz_doc_delete_{model.__name__}")
+
+
+# ─── Compiled quiz ───────────────────────────────
+class CompiledQuiz:
+    def __init__(self, quiz):
+        self.quiz = quiz
+        self.built_at = time.monotonic()
+        self.weighted = quiz.scoring == "WEIGHTED"
+
+        self.answer_category = {}
+        self.answer_weights = {}  # answer id -> {category: weight}, WEIGHTED only
+        for answer_id, category, weights in (
+            QuizAnswer.objects.filter(question__quiz=quiz).values_list("id", "category", "weights")
+        ):
+            self.answer_category[answer_id] = category
+            self.answer_weights[answer_id] = _clean_weights(weights) or ({category: 1.0} if category else {})
+        self.whitelist = frozenset(quiz.allowed_products.values_list("id", flat=True))
+        self.targets = AUDIENCE_TARGETS.get(quiz.audience)
+
+        if self.weighted:
+            categories = {c for w in self.answer_weights.values() for c in w}
+            self.ranked, self.fallback = self._rank_table(categories)
+        else:
+            categories = {c for c in self.answer_category.values() if c}
+            self.products_by_category = {c: [] for c in categories}
+            for product in self._products().filter(category__in=categories).order_by("id"):
+                self.products_by_category[product.category].append(product)
+        self.personas = {p.category: p for p in ScentPersona.objects.filter(category__in=categories)}
+
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+
+    def _products(self):
+        qs = Product.objects.all()
+        if self.targets:
+            qs = qs.filter(target__in=self.targets)
+        if self.whitelist:
+            qs = qs.filter(id__in=self.whitelist)
+        return qs
+
+    def _rank_table(self, categories):
+        """
+        ({category: [(static score, product id)]}, [(static score, product id, category)]),
+        both best first and top_k deep: one list per weighted category, and
+        one over every allowed product for the static score alone.
+
+        Product vectors are one-hot (a product has one category), so the
+        answer-vector . product-vector dot product is just the answer weight
+        of the product's category. The rest of the score (rating + stock)
+        doesn't depend on the answers, so every product of a submission's top
+        K is in the top K of its weighted category, or (no affinity) in the
+        static top K: ranking is a merge of a few short lists, whatever the
+        catalog size, and always K long if K products are allowed.
+        """
+        rows = list(
+            self._products()
+            .annotate(rating_sum=Sum("reviews__rating"), rating_count=Count("reviews"))
+            .values_list("id", "category", "stock", "rating_sum", "rating_count")
+        )
+        rated = [(r[3], r[4]) for r in rows if r[4]]
+        prior = sum(s for s, _ in rated) / sum(c for _, c in rated) if rated else RATING_PRIOR
+
+        table, everything = {c: [] for c in categories}, []
+        for product_id, category, stock, rating_sum, rating_count in rows:
+            # Bayesian average: few reviews stay close to the catalog mean
+            rating = ((rating_sum or 0) + prior * RATING_PRIOR_WEIGHT) / (rating_count + RATING_PRIOR_WEIGHT)
+            score = (
+                RANK_WEIGHTS["rating"] * rating / 5
+                + RANK_WEIGHTS["stock"] * min(stock, STOCK_CAP) / STOCK_CAP
+            )
+            if category in table:
+                table[category].append((score, -product_id))
+            everything.append((score, -product_id, category))
+        k = max(self.quiz.top_k, 1)
+        return (
+            {c: [(s, -neg_id) for s, neg_id in heapq.nlargest(k, items)] for c, items in table.items()},
+            [(s, -neg_id, c) for s, neg_id, c in heapq.nlargest(k, everything)],
+        )
+
+    def fingerprint(self, answer_ids):
+        """Canonical key: this quiz's answer ids, sorted, without duplicates."""
+        ids = set()
+        for raw in answer_ids if isinstance(answer_ids, (list, tuple)) else []:
+            try:
+                ids.add(int(raw))
+            except (TypeError, ValueError):
+                continue
+        return tuple(sorted(i for i in ids if i in self.answer_category))
+
+    def top_category(self, fingerprint):
+        # ties go to the category seen first, i.e. the lowest answer id
+        counts = Counter(self.answer_category[i] for i in fingerprint if self.answer_category[i])
+        return counts.most_common(1)[0][0] if counts else None
+
+    def answer_vector(self, fingerprint):
+        """Summed category weights of the selected answers, normalised to 1."""
+        vector = Counter()
+        for i in fingerprint:
+            vector.update(self.answer_weights[i])
+        total = sum(vector.values())
+        return {c: w / total for c, w in vector.items()} if total else {}
+
+    def rank(self, fingerprint):
+        """(top category, ranked product ids) for a WEIGHTED quiz."""
+        vector = self.answer_vector(fingerprint)
+        if not vector:
+            return None, []
+        candidates = {}  # product id -> full score (a product may be in both lists)
+        for category, weight in vector.items():
+            for score, product_id in self.ranked.get(category, ()):
+                candidates[product_id] = RANK_WEIGHTS["affinity"] * weight + score
+        for score, product_id, category in self.fallback:
+            candidates.setdefault(product_id, RANK_WEIGHTS["affinity"] * vector.get(category, 0) + score)
+        top = heapq.nlargest(max(self.quiz.top_k, 1), ((s, -pid) for pid, s in candidates.items()))
+        # ties go to the category seen first, i.e. the lowest answer id
+        return max(vector, key=vector.get), [-neg_id for _, neg_id in top]
+
+    def _build(self, fingerprint, request):
+        from .serializers import ProductCardSerializer, ScentPersonaSerializer
+
+        if self.weighted:
+            category, ids = self.rank(fingerprint)
+            by_id = Product.objects.annotate(
+                rating_avg=Avg("reviews__rating"), rating_count=Count("reviews"),
+            ).in_bulk(ids)
+            products = [by_id[i] for i in ids if i in by_id]
+        else:
+            category = self.top_category(fingerprint)
+            if category:
+                products = self.products_by_category.get(category, [])
+            else:
+                products = list(self._products().order_by("id"))  # no categorised answer: everything allowed
+        persona = self.personas.get(category)
+        context = {"request": request}
+        return {
+            "recommended_category": category or "",
+            "product_ids": [p.id for p in products],
+            "recommended_products": ProductCardSerializer(products, many=True, context=context).data,
+            "persona": ScentPersonaSerializer(persona, context=context).data if persona else None,
+        }
+
+    def recommend(self, fingerprint, request):
+        """Memoized recommendation for a fingerprint (absolute URLs depend on the host)."""
+        key = (fingerprint, request.build_absolute_uri("/") if request else "")
+        with self._memo_lock:
+            hit = self._memo.get(key)
+            if hit is not None:
+                self._memo.move_to_end(key)
+                return hit
+        result = self._build(fingerprint, request)
+        with self._memo_lock:
+            self._memo[key] = result
+            if len(self._memo) > MEMO_SIZE:
+                self._memo.popitem(last=False)
+        return result
+
+
+def _clean_weights(weights):
+    """{category: positive float} from an answer's weights JSON (bad entries dropped)."""
+    if not isinstance(weights, dict):
+        return {}
+    clean = {}
+    for category, weight in weights.items():
+        try:
+            weight = float(weight)
+        except (TypeError, ValueError):
+            continue
+        if category and weight > 0:
+            clean[str(category)] = weight
+    return clean
+
+
+def get_compiled_quiz(quiz_id):
+    """CompiledQuiz for this id (built on first use per version). Http404 if unknown."""
+    global _compiled_version
+    try:
+        quiz_id = int(quiz_id)
+    except (TypeError, ValueError):
+        raise Http404("No Quiz matches the given query.")
+
+    version = quiz_version()
+    with _lock:
+        if version != _compiled_version:
+            _compiled.clear()
+            _compiled_version = version
+        compiled = _compiled.get(quiz_id)
+    if compiled and time.monotonic() - compiled.built_at < settings.QUIZ_ENGINE_TTL:
+        return compiled
+
+    quiz = Quiz.objects.filter(id=quiz_id).first()
+    if quiz is None:
+        raise Http404("No Quiz matches the given query.")
+    compiled = CompiledQuiz(quiz)
+    with _lock:
+        if _compiled_version == version:
+            _compiled[quiz_id] = compiled
+    return compiled
+
+
+# ─── Public quiz documents ───────────────────────
+def public_quizzes():
+    """Quizzes with questions and answers prefetched (3 queries for any number of quizzes)."""
+    return Quiz.objects.order_by("id").prefetch_related(
+        Prefetch(
+            "questions",
+            queryset=QuizQuestion.objects.order_by("id").prefetch_related(
+                Prefetch("answers", queryset=QuizAnswer.objects.order_by("id"))
+            ),
+        )
+    )
+
+
+def bump_quiz_documents(*quiz_ids):
+    """Re-serialize these quizzes' documents (and the list) once the current transaction commits."""
+    quiz_ids = {q for q in quiz_ids if q}
+
+    def bump():
+        for quiz_id in quiz_ids:
+            cache.set(DOC_VERSION_KEY.format(quiz_id), uuid.uuid4().hex, None)
+        cache.set(DOC_LIST_VERSION_KEY, uuid.uuid4().hex, None)
+
+    transaction.on_commit(bump)
+
+
+_QUIZ_ID_LOOKUP = {Quiz: "id", QuizQuestion: "quiz_id", QuizAnswer: "question__quiz_id"}
+
+
+def _stored_quiz_ids(model, pk):
+    return set(model.objects.filter(pk=pk).values_list(_QUIZ_ID_LOOKUP[model], flat=True))
+
+
+def _document_before_save(sender, instance, **kwargs):
+    # a question / answer may move to another quiz: the old one's document is stale too
+    if instance.pk and not getattr(_batch, "active", False):
+        instance._document_quiz_ids = _stored_quiz_ids(sender, instance.pk)
+
+
+def _document_changed(sender, instance, **kwargs):
+    """post_save / post_delete receiver for Quiz, QuizQuestion and QuizAnswer."""
+    if getattr(_batch, "active", False):
+        return  # bulk writers (quiz_builder) bump their quiz themselves
+    if sender is Quiz:
+        now = {instance.id}
+    elif sender is QuizQuestion:
+        now = {instance.quiz_id}
+    else:  # empty when the question went in the same cascade: its own signal covers it
+        now = _stored_quiz_ids(QuizQuestion, instance.question_id)
+    bump_quiz_documents(*getattr(instance, "_document_quiz_ids", ()), *now)
+
+
+def quiz_document(quiz_id):
+    """(serialized quiz, version) for GET /quizzes/<id>/. Http404 if unknown."""
+    from .serializers import QuizSerializer
+
+    try:
+        quiz_id = int(quiz_id)
+    except (TypeError, ValueError):
+        raise Http404("No Quiz matches the given query.")
+
+    version = _token(DOC_VERSION_KEY.format(quiz_id))
+    key = f"quiz_doc:{quiz_id}:{version}"
+    doc = cache.get(key)
+    if doc is None:
+        quiz = public_quizzes().filter(id=quiz_id).first()
+        if quiz is None:
+            raise Http404("No Quiz matches the given query.")
+        doc = dict(QuizSerializer(quiz).data)
+        cache.set(key, doc, settings.QUIZ_DOCUMENT_TTL)
+    return doc, version
+
+
+def quiz_list_document():
+    """(serialized quiz list, version) for GET /quizzes/."""
+    from .serializers import QuizSerializer
+
+    version = _token(DOC_LIST_VERSION_KEY)
+    key = f"quiz_doc:list:{version}"
+    docs = cache.get(key)
+    if docs is None:
+        docs = list(QuizSerializer(public_quizzes(), many=True).data)
+        cache.set(key, docs, settings.QUIZ_DOCUMENT_TTL)
+    return docs, version
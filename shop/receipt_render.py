@@ -0,0 +1,155 @@
+# shop/receipt_render.py
+"""
+Pure receipt layout: plain dict in, PDF bytes out.
+
+No Django imports on purpose: this module is loaded by the renderer
+processes (see shop/receipts.py), which never set up Django.
+
+Snapshot shape (all values are plain str / int / bool):
+{
+    "id": 12, "created_at": "2025-01-31 14:05", "status": "TO_SHIP",
+    "address_lines": ["Name", "Phone: ..", ...],
+    "items": [{"name": "..", "quantity": 2, "price": "55.00", "line_total": "110.00"}],
+    "total": "110.00",
+    "payment": {"method": "CARD", "status": "SUCCESS", "transaction_id": ".."} | None,
+}
+"""
+from io import BytesIO
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+
+
+def _items_header(p, y):
+    p.drawString(25 * mm, y, "Product")
+    p.drawString(110 * mm, y, "Qty")
+    p.drawString(130 * mm, y, "Price")
+    p.drawString(160 * mm, y, "Total")
+    y -= 4 * mm
+    p.line(25 * mm, y, 185 * mm, y)
+    return y
+
+
+def render_receipt(data):
+    """
+    Build the PDF bytes from a snapshot.
+
+    - If payment is SUCCESS -> acts as a Payment Receipt.
+    - If payment is COD / PENDING -> acts as Order Confirmation / Invoice.
+    """
+    payment = data["payment"]
+
+    buffer = BytesIO()
+    p = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+
+    # ─── Header / Brand ─────────────────────────────────
+    y = height - 30 * mm
+    p.setFont("Helvetica-Bold", 18)
+    p.drawString(25 * mm, y, "GERAIN CHAN OFFICIAL STORE")
+
+    # Decide document title based on payment status
+    is_paid = bool(payment and payment["status"] == "SUCCESS")
+    doc_title = "Payment Receipt" if is_paid else "Order Confirmation / Invoice"
+
+    y -= 8 * mm
+    p.setFont("Helvetica", 11)
+    p.drawString(25 * mm, y, doc_title)
+
+    # ─── Order Details ──────────────────────────────────
+    y -= 10 * mm
+    p.setFont("Helvetica", 10)
+    p.drawString(25 * mm, y, f"Order ID: {data['id']}")
+    y -= 5 * mm
+    p.drawString(25 * mm, y, f"Order Date: {data['created_at']}")
+    y -= 5 * mm
+    p.drawString(25 * mm, y, f"Order Status: {data['status']}")
+
+    # ─── Customer / Shipping Info ───────────────────────
+    y -= 10 * mm
+    p.setFont("Helvetica-Bold", 11)
+    p.drawString(25 * mm, y, "Bill To / Ship To:")
+    p.setFont("Helvetica", 10)
+
+    for line in data["address_lines"]:
+        if line:
+            y -= 5 * mm
+            p.drawString(25 * mm, y, line)
+
+    # ─── Items Header ───────────────────────────────────
+    y -= 10 * mm
+    p.setFont("Helvetica-Bold", 11)
+    p.drawString(25 * mm, y, "Items")
+    p.setFont("Helvetica", 10)
+
+    y -= 6 * mm
+    y = _items_header(p, y)
+
+    # ─── Items List ─────────────────────────────────────
+    for item in data["items"]:
+        y -= 7 * mm
+        if y < 40 * mm:
+            p.showPage()
+            y = height - 30 * mm
+
+            # re-draw columns header on new page
+            p.setFont("Helvetica-Bold", 11)
+            p.drawString(25 * mm, y, "Items (cont.)")
+            p.setFont("Helvetica", 10)
+            y -= 6 * mm
+            y = _items_header(p, y)
+
+        p.drawString(25 * mm, y, item["name"][:40])
+        p.drawString(112 * mm, y, str(item["quantity"]))
+        p.drawRightString(150 * mm, y, f"RM {item['price']}")
+        p.drawRightString(185 * mm, y, f"RM {item['line_total']}")
+
+    # ─── Total ──────────────────────────────────────────
+    y -= 10 * mm
+    p.line(120 * mm, y, 185 * mm, y)
+    y -= 6 * mm
+    p.setFont("Helvetica-Bold", 11)
+    p.drawRightString(150 * mm, y, "Total:")
+    p.drawRightString(185 * mm, y, f"RM {data['total']}")
+
+    # ─── Payment Info ───────────────────────────────────
+    y -= 12 * mm
+    p.setFont("Helvetica-Bold", 11)
+    p.drawString(25 * mm, y, "Payment")
+    p.setFont("Helvetica", 10)
+
+    if payment:
+        method = payment["method"]
+        status = payment["status"]
+        txid = payment["transaction_id"] or "-"
+    else:
+        method = "N/A"
+        status = "N/A"
+        txid = "-"
+
+    y -= 6 * mm
+    p.drawString(25 * mm, y, f"Method: {method}")
+    y -= 5 * mm
+    p.drawString(25 * mm, y, f"Status: {status}")
+
+    # Only show TX ID for successful non-COD payments
+    if is_paid and method != "COD":
+        y -= 5 * mm
+        p.drawString(25 * mm, y, f"Transaction ID: {txid}")
+
+    # ─── Footer ─────────────────────────────────────────
+    y -= 15 * mm
+    p.setFont("Helvetica-Oblique", 9)
+
+    if is_paid:
+        footer = "Thank you for your payment and for shopping with GERAIN CHAN."
+    elif method == "COD":
+        footer = "Thank you for your order. For COD, please pay the amount due upon delivery."
+    else:
+        footer = "Thank you for your order. Payment is pending."
+    p.drawString(25 * mm, y, footer)
+
+    p.showPage()
+    p.save()
+    return buffer.getvalue()
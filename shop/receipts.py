@@ -0,0 +1,227 @@
+# shop/receipts.py
+"""
+Receipt / invoice PDFs.
+
+A PDF is rendered once per version of (order status, payment status/method/txid),
+stored in the "receipts" storage and served from there afterwards.
+Status changes schedule a background re-render so the next download is ready.
+The layout itself lives in shop/receipt_render.py and runs in a small
+process pool, so reportlab never holds the web worker's GIL.
+"""
+import hashlib
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import close_old_connections, transaction
+from django.db.models import Prefetch
+
+from .models import Order, OrderItem, Payment
+from .receipt_render import render_receipt
+
+logger = logging.getLogger(__name__)
+
+CENTS = Decimal("0.01")
+
+_executor = ThreadPoolExecutor(max_workers=settings.RECEIPT_WORKERS, thread_name_prefix="receipts")
+
+
+def receipt_storage():
+    return storages["receipts"]
+
+
+def _payment_of(order):
+    try:
+        return order.payment
+    except Payment.DoesNotExist:
+        return None
+
+
+# ─── Versioning ─────────────────────────────────
+def receipt_version(order):
+    """Short hash of everything that changes what the PDF shows after checkout."""
+    payment = _payment_of(order)
+    parts = [order.id, order.status]
+    if payment:
+        parts += [payment.status, payment.method, payment.transaction_id or ""]
+    return hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()[:16]
+
+
+def receipt_path(order, version=None):
+    return f"receipts/order_{order.id}/{version or receipt_version(order)}.pdf"
+
+
+# ─── Snapshot ───────────────────────────────────
+def _money(value):
+    return f"{Decimal(value).quantize(CENTS)}"
+
+
+def receipt_snapshot(order):
+    """Everything the PDF prints, as plain data (picklable, no ORM objects)."""
+    payment = _payment_of(order)
+    return {
+        "id": order.id,
+        "created_at": order.created_at.strftime("%Y-%m-%d %H:%M"),
+        "status": order.status,
+        "address_lines": [
+            order.fullname,
+            f"Phone: {order.phone}",
+            order.line1,
+            order.line2 or "",
+            f"{order.postcode} {order.city}",
+            f"{order.state}, {order.country}",
+        ],
+        "items": [
+            {
+                "name": item.product.name,
+                "quantity": item.quantity,
+                "price": _money(item.price),
+                "line_total": _money(item.price * item.quantity),
+            }
+            for item in order.items.all()
+        ],
+        "total": _money(order.total),
+        "payment": {
+            "method": payment.method,
+            "status": payment.status,
+            "transaction_id": payment.transaction_id,
+        } if payment else None,
+    }
+
+
+# ─── Rendering (process pool) ───────────────────
+class RenderBusy(Exception):
+    """No render slot freed up, or the render outlived RECEIPT_RENDER_TIMEOUT; retry later."""
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(settings.RECEIPT_RENDER_CONCURRENCY)
+
+
+def _get_pool():
+    """
+    One small pool per web worker, created lazily (after gunicorn forks).
+    "spawn" children import only shop.receipt_render + reportlab, so they
+    never inherit our threads, DB connections or Django state.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.RECEIPT_RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def render_receipt_pdf(order, wait=None):
+    """
+    PDF bytes for this order, rendered off the web worker's GIL.
+
+    At most RECEIPT_RENDER_CONCURRENCY renders run/queue per web worker.
+    `wait` = seconds to wait for a slot (None = block); RenderBusy if none frees up
+    or the render takes longer than RECEIPT_RENDER_TIMEOUT.
+    RECEIPT_RENDER_PROCESSES=0 renders in-process (dev / tests).
+    """
+    data = receipt_snapshot(order)
+    if not _slots.acquire(timeout=wait):
+        raise RenderBusy()
+    if settings.RECEIPT_RENDER_PROCESSES <= 0:
+        try:
+            return render_receipt(data)
+        finally:
+            _slots.release()
+
+    pool = _get_pool()
+    try:
+        future = pool.submit(render_receipt, data)
+    except BaseException as e:
+        _slots.release()
+        if isinstance(e, BrokenProcessPool):
+            _discard_pool(pool)
+        raise
+    # a render we stop waiting for still runs: its slot frees when it ends
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=settings.RECEIPT_RENDER_TIMEOUT)
+    except FuturesTimeout:
+        raise RenderBusy() from None
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+
+
+# ─── Storage ────────────────────────────────────
+def _drop_old_versions(order, keep):
+    storage = receipt_storage()
+    folder = f"receipts/order_{order.id}"
+    try:
+        _, files = storage.listdir(folder)
+    except (FileNotFoundError, NotImplementedError, OSError):
+        return
+    for name in files:
+        if name != f"{keep}.pdf":
+            storage.delete(f"{folder}/{name}")
+
+
+def ensure_receipt(order, wait=None):
+    """
+    Storage path of the current receipt, rendering + storing it only if this
+    version doesn't exist yet. Returns (path, version).
+    """
+    storage = receipt_storage()
+    version = receipt_version(order)
+    path = receipt_path(order, version)
+    if not storage.exists(path):
+        storage.save(path, ContentFile(render_receipt_pdf(order, wait=wait)))
+        _drop_old_versions(order, keep=version)
+    return path, version
+
+
+def _orders_for_render(order_ids):
+    return (
+        Order.objects
+        .filter(id__in=order_ids)
+        .select_related("payment")
+        .prefetch_related(
+            # only what the PDF prints
+            Prefetch("items", queryset=OrderItem.objects.select_related("product").only(
+                "id", "order_id", "quantity", "price", "product__id", "product__name",
+            ))
+        )
+    )
+
+
+def _prerender(order_ids):
+    close_old_connections()
+    try:
+        for order in _orders_for_render(order_ids):
+            try:
+                ensure_receipt(order)
+            except Exception:
+                logger.exception("Receipt pre-render failed for order %s", order.id)
+    finally:
+        close_old_connections()
+
+
+def schedule_receipts(order_ids):
+    """After the current transaction commits, re-render these receipts in the background."""
+    order_ids = list(order_ids)
+    if not settings.RECEIPT_PRERENDER or not order_ids:
+        return
+    transaction.on_commit(lambda: _executor.submit(_prerender, order_ids))
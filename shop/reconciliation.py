@@ -0,0 +1,170 @@
+# shop/reconciliation.py
+"""
+Order <-> payment reconciliation.
+
+Scans orders (LEFT JOIN payment) and then payments (for orphans) in id-keyset
+chunks: one joined read per chunk, no row locks while scanning. Mismatches go
+to ReconciliationIssue rows of the run. With repair=True the safe fixes are
+applied per chunk in a short transaction, re-checked under lock:
+  - amount_mismatch   -> payment.amount = order.total
+  - success_on_unpaid -> "payment_confirmed" transition (order -> TO_SHIP)
+Everything else is report-only (needs a human: refunds, missing money).
+"""
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import Order, Payment, ReconciliationIssue, ReconciliationRun
+from .order_flow import apply_transition
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+REPAIRABLE = {"amount_mismatch", "success_on_unpaid"}
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reconciliation")
+
+
+# ─── Checks ──────────────────────────────────────
+def _order_issues(row):
+    """Issues for one order row (order + LEFT JOINed payment columns)."""
+    if row["payment__id"] is None:
+        return [("missing_payment", "", "")]
+
+    issues = []
+    status, p_status, online = row["status"], row["payment__status"], row["payment__method"] != "COD"
+    if row["payment__amount"] != row["total"]:
+        issues.append(("amount_mismatch", str(row["total"]), str(row["payment__amount"])))
+    if status == "TO_PAY" and p_status == "SUCCESS" and online:
+        issues.append(("success_on_unpaid", "TO_SHIP", status))
+    if status in ("TO_SHIP", "TO_RECEIVE", "TO_RATE", "COMPLETED") and online and p_status != "SUCCESS":
+        issues.append(("unpaid_fulfilled", "SUCCESS", p_status))
+    if status == "CANCELLED" and p_status == "SUCCESS":
+        issues.append(("refund_due", "CANCELLED", p_status))
+    return issues
+
+
+def _order_chunks(chunk_size):
+    qs = Order.objects.order_by("id").values(
+        "id", "status", "total",
+        "payment__id", "payment__amount", "payment__status", "payment__method",
+    )
+    last_id = 0
+    while True:
+        rows = list(qs.filter(id__gt=last_id)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1]["id"]
+
+
+def _payment_chunks(chunk_size):
+    qs = (
+        Payment.objects.order_by("id")
+        .annotate(has_order=Exists(Order.objects.filter(id=OuterRef("order_id"))))
+        .values("id", "order_id", "has_order")
+    )
+    last_id = 0
+    while True:
+        rows = list(qs.filter(id__gt=last_id)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1]["id"]
+
+
+# ─── Repairs ─────────────────────────────────────
+def _repair(found):
+    """Apply the safe fixes for one chunk. Returns the set of repaired (kind, order_id)."""
+    amounts = [oid for kind, oid in found if kind == "amount_mismatch"]
+    unpaid = [oid for kind, oid in found if kind == "success_on_unpaid"]
+    repaired = set()
+
+    with transaction.atomic():
+        if amounts:
+            Payment.objects.filter(order_id__in=amounts).update(
+                amount=Subquery(Order.objects.filter(id=OuterRef("order_id")).values("total")[:1])
+            )
+            repaired |= {("amount_mismatch", oid) for oid in amounts}
+        if unpaid:
+            # re-check: payment still SUCCESS (the transition re-checks TO_PAY under lock)
+            still = list(
+                Payment.objects.filter(order_id__in=unpaid, status="SUCCESS", method__in=["CARD", "FPX", "E_WALLET"])
+                .values_list("order_id", flat=True)
+            )
+            moved, _ = apply_transition(still, "payment_confirmed", note="reconciliation")
+            repaired |= {("success_on_unpaid", o.id) for o in moved}
+    return repaired
+
+
+# ─── Run ─────────────────────────────────────────
+def run_reconciliation(run, chunk_size=CHUNK_SIZE, pause=0.0):
+    """
+    Scan everything for `run` (a RUNNING ReconciliationRun), writing issues
+    chunk by chunk. `pause` seconds between chunks to go easy on a busy DB.
+    """
+    summary = Counter()
+    try:
+        for rows in _order_chunks(chunk_size):
+            found = {}
+            for row in rows:
+                for kind, expected, actual in _order_issues(row):
+                    found[(kind, row["id"])] = ReconciliationIssue(
+                        run=run, kind=kind, order_ref=row["id"], payment_ref=row["payment__id"],
+                        expected=expected, actual=actual or "",
+                    )
+            if run.repair:
+                for key in _repair([k for k in found if k[0] in REPAIRABLE]):
+                    found[key].repaired = True
+            ReconciliationIssue.objects.bulk_create(found.values())
+
+            summary.update(kind for kind, _ in found)
+            run.scanned_orders += len(rows)
+            run.issues_found += len(found)
+            run.repaired += sum(1 for issue in found.values() if issue.repaired)
+            run.summary = dict(summary)
+            run.save(update_fields=["scanned_orders", "issues_found", "repaired", "summary"])
+            if pause:
+                time.sleep(pause)
+
+        for rows in _payment_chunks(chunk_size):
+            orphans = [
+                ReconciliationIssue(run=run, kind="orphan_payment", order_ref=row["order_id"], payment_ref=row["id"])
+                for row in rows if not row["has_order"]
+            ]
+            ReconciliationIssue.objects.bulk_create(orphans)
+            summary.update(["orphan_payment"] * len(orphans))
+            run.scanned_payments += len(rows)
+            run.issues_found += len(orphans)
+            run.summary = dict(summary)
+            run.save(update_fields=["scanned_payments", "issues_found", "summary"])
+            if pause:
+                time.sleep(pause)
+
+        run.status = "DONE"
+    except Exception as e:
+        logger.exception("Reconciliation run %s failed", run.id)
+        run.status, run.error = "FAILED", str(e)
+    run.finished_at = timezone.now()
+    run.save(update_fields=["status", "error", "finished_at"])
+    return run
+
+
+def _run_in_background(run_id, chunk_size, pause):
+    close_old_connections()
+    try:
+        run_reconciliation(ReconciliationRun.objects.get(id=run_id), chunk_size, pause)
+    finally:
+        close_old_connections()
+
+
+def start_reconciliation(user=None, repair=False, chunk_size=CHUNK_SIZE, pause=0.0):
+    """New run, executed in a background thread after commit. Returns the run."""
+    run = ReconciliationRun.objects.create(started_by=user, repair=repair)
+    transaction.on_commit(lambda: _executor.submit(_run_in_background, run.id, chunk_size, pause))
+    return run
@@ -1,5 +1,6 @@
 import json
 from datetime import datetime, time
+from decimal import Decimal
 from rest_framework import serializers
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.encoding import force_str
@@ -13,11 +14,24 @@ from .models import (
     User, Product, ProductMedia, ARExperience, Review, ReviewMedia,
     Cart, CartItem, Order, OrderItem, Payment,
     Quiz, QuizQuestion, QuizAnswer, QuizResult, SiteAbout, Retailer,
-    ScentPersona,
+    ScentPersona, StockReservation, OrderEvent, SalesRollup,
+    ReconciliationIssue, ReconciliationRun,
 )
+from .analytics import default_range
+from .categories import get_categories
+from .cart_service import add_to_cart, guest_cart_token, merge_guest_cart
+from .inventory import available_stock, decrement_stock, lock_products, release
+from .order_flow import INTERNAL_ACTIONS, STATUSES as ORDER_STATUSES, TRANSITIONS, order_created
 
 User = get_user_model()
 
+
+def _merge_guest_cart_from_context(serializer, user):
+    """Fold the anonymous cart (if the client sent its token) into the user's cart."""
+    request = serializer.context.get("request")
+    if request is not None:
+        merge_guest_cart(user, guest_cart_token(request))
+
 # put this near the top of serializers.py
 class StringListField(serializers.Field):
     """
@@ -100,6 +114,7 @@ class UserSignupSerializer(serializers.ModelSerializer):
         user = User(**validated_data)
         user.set_password(password)
         user.save()
+        _merge_guest_cart_from_context(self, user)
         return user
 
 
@@ -120,6 +135,9 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         # ✅ Update last login timestamp
         update_last_login(None, user)
 
+        # ✅ Bring the guest cart along
+        _merge_guest_cart_from_context(self, user)
+
         # ✅ Include user info
         data["user"] = {
             "id": user.id,
@@ -540,28 +558,42 @@ class CartItemSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         request = self.context.get("request")
-        user = request.user
-        cart, _ = Cart.objects.get_or_create(user=user)
+        # ✅ single-statement upsert: concurrent clicks can't duplicate or lose increments
+        return add_to_cart(
+            request.user,
+            validated_data["product"],
+            validated_data.get("quantity", 1),
+        )
+
+class CartOperationSerializer(serializers.Serializer):
+    """
+    One line of a batch cart update:
+      - add:    increase quantity (default 1)
+      - set:    set exact quantity (0 removes the line)
+      - remove: drop the line
+    """
+    op = serializers.ChoiceField(choices=["add", "set", "remove"])
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=0, required=False)
 
-        product = validated_data["product"]
-        qty = validated_data.get("quantity", 1)
+    def validate(self, attrs):
+        op = attrs["op"]
+        qty = attrs.get("quantity")
 
-        item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={"quantity": qty}
-        )
+        if op == "add":
+            qty = 1 if qty is None else qty
+            if qty <= 0:
+                raise serializers.ValidationError({"quantity": "Quantity must be at least 1."})
+        elif op == "set" and qty is None:
+            raise serializers.ValidationError({"quantity": "Quantity is required for 'set'."})
 
-        if not created:
-            new_qty = item.quantity + qty
-            if product.stock is not None and new_qty > product.stock:
-                raise serializers.ValidationError(
-                    {"quantity": f"Only {product.stock} left in stock."}
-                )
-            item.quantity = new_qty
-            item.save()
+        attrs["quantity"] = qty or 0
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=200)
 
-        return item
 
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
@@ -572,10 +604,35 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ["id", "user", "items", "created_at"]
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
-    product_id = serializers.PrimaryKeyRelatedField(
-        queryset=Product.objects.all(), source="product", write_only=True
+class ReservationItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class ReservationRequestSerializer(serializers.Serializer):
+    """Items to hold; when omitted the user's current cart is reserved."""
+    items = ReservationItemSerializer(many=True, required=False, max_length=200)
+
+
+class CheckoutSelectionSerializer(serializers.Serializer):
+    """Cart lines to check out; when omitted the whole cart is."""
+    item_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, allow_empty=False, max_length=200
     )
+
+
+class StockReservationSerializer(serializers.ModelSerializer):
+    product_id = serializers.IntegerField(read_only=True)
+    product_name = serializers.CharField(source="product.name", read_only=True)
+
+    class Meta:
+        model = StockReservation
+        fields = ["id", "product_id", "product_name", "quantity", "expires_at"]
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    # plain id: OrderSerializer resolves all products of an order in one query
+    product_id = serializers.IntegerField(min_value=1, write_only=True)
     product = ProductCardSerializer(read_only=True)
 
     class Meta:
@@ -646,12 +703,23 @@ class OrderSerializer(serializers.ModelSerializer):
             "created_at": p.created_at,
         }
     
+    def validate_items(self, value):
+        for item in value:
+            if item.get("quantity", 1) <= 0:
+                raise serializers.ValidationError("Quantity must be at least 1.")
+        return value
+
     def create(self, validated_data):
         """
         Create Order + OrderItems, compute total, decrement stock.
         - COD: order starts TO_SHIP (pay on delivery)
         - Online: order starts TO_PAY
-        Also creates/updates a Payment row with the chosen method.
+        Also creates a Payment row with the chosen method.
+
+        Built for contention (must run inside a transaction):
+        - all products resolved + row-locked in ONE query, in id order
+        - stock taken with ONE conditional UPDATE (never below zero)
+        - OrderItems written with bulk_create
         """
         request = self.context["request"]
         user = request.user
@@ -664,47 +732,49 @@ class OrderSerializer(serializers.ModelSerializer):
         else:
             initial_status = "TO_PAY"
 
-        order = Order.objects.create(user=user, status=initial_status, **validated_data)
-
-        total = 0
+        quantities = {}
         for item_data in items_data:
-            product = item_data["product"]
-            qty = item_data["quantity"]
+            pid = item_data["product_id"]
+            quantities[pid] = quantities.get(pid, 0) + item_data.get("quantity", 1)
+
+        products = lock_products(quantities)
+        missing = sorted(set(quantities) - products.keys())
+        if missing:
+            raise serializers.ValidationError(
+                {"items": [f"Product {pid} does not exist." for pid in missing]}
+            )
 
-            if product.stock < qty:
+        # stock held by OTHER shoppers' checkout reservations is not for sale
+        available = available_stock(products.values(), exclude_user=user)
+        for pid, qty in quantities.items():
+            if available[pid] < qty:
                 raise serializers.ValidationError(
-                    {"detail": f"Not enough stock for {product.name}. Remaining: {product.stock}"}
+                    {"detail": f"Not enough stock for {products[pid].name}. Remaining: {available[pid]}"}
                 )
 
-            product.stock -= qty
-            product.save()
+        if not decrement_stock(quantities):
+            raise serializers.ValidationError({"detail": "Stock changed, please try again."})
 
-            price = product.price
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=qty,
-                price=price,
-            )
-            total += float(price) * qty
-
-        order.total = total
-        order.save(update_fields=["total"])
-
-        # ✅ ensure payment row exists and matches chosen method
-        payment, created = Payment.objects.get_or_create(
-            order=order,
-            defaults={
-                "amount": order.total,
-                "method": payment_method,
-                "status": "PENDING" if payment_method == "COD" else "PENDING",
-            },
+        lines = [
+            (products[item_data["product_id"]], item_data.get("quantity", 1))
+            for item_data in items_data
+        ]
+        total = sum((product.price * qty for product, qty in lines), Decimal("0.00"))
+
+        order = Order.objects.create(
+            user=user, status=initial_status, total=total, **validated_data
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=qty, price=product.price)
+            for product, qty in lines
+        ])
+        Payment.objects.create(
+            order=order, amount=total, method=payment_method, status="PENDING"
         )
-        if not created:
-            payment.amount = order.total
-            payment.method = payment_method
-            payment.status = "PENDING"
-            payment.save(update_fields=["amount", "method", "status"])
+        order_created(order)
+
+        # ✅ stock is now decremented for real -> drop this user's holds
+        release(user, list(quantities))
 
         return order
 
@@ -736,6 +806,105 @@ class PaymentSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "order", "amount", "status", "transaction_id", "created_at"]
 
 
+class OrderEventSerializer(serializers.ModelSerializer):
+    actor = serializers.CharField(source="actor.username", default=None, read_only=True)
+
+    class Meta:
+        model = OrderEvent
+        fields = ["id", "action", "from_status", "to_status", "actor", "note", "created_at"]
+
+
+class BulkTransitionSerializer(serializers.Serializer):
+    order_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=2000
+    )
+    action = serializers.ChoiceField(
+        choices=[a for a in TRANSITIONS if a not in INTERNAL_ACTIONS and a != "pay"]
+    )
+
+
+class DateRangeQuerySerializer(serializers.Serializer):
+    """
+    Query params ?from=YYYY-MM-DD&to=YYYY-MM-DD as date_from / date_to, plus
+    the subclass's own params ({field: query param} in `params`). Empty or
+    missing params are left out. With `default_days`, missing ends default to
+    the last default_days days. `from` after `to` is a 400 either way.
+    """
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    params = {}
+    default_days = None
+
+    def to_internal_value(self, data):
+        values = {
+            "date_from": data.get("from"),
+            "date_to": data.get("to"),
+            **{field: data.get(param) for field, param in self.params.items()},
+        }
+        return super().to_internal_value({k: v for k, v in values.items() if v not in (None, "")})
+
+    def validate(self, attrs):
+        if self.default_days:
+            default_from, default_to = default_range(self.default_days)
+            attrs.setdefault("date_from", default_from)
+            attrs.setdefault("date_to", default_to)
+        if attrs.get("date_from") and attrs.get("date_to") and attrs["date_from"] > attrs["date_to"]:
+            raise serializers.ValidationError({"to": "Must be on or after 'from'."})
+        return attrs
+
+
+class InvoiceExportSerializer(DateRangeQuerySerializer):
+    """Query params of /admin/orders/invoices.zip (open-ended range)"""
+    status = serializers.CharField(required=False, allow_blank=True)
+    export_id = serializers.RegexField(r"^[A-Za-z0-9_-]{8,64}$", required=False)
+
+    params = {"status": "status", "export_id": "export_id"}
+
+    def validate_status(self, value):
+        wanted = [s.strip() for s in value.split(",") if s.strip()]
+        unknown = sorted(set(wanted) - set(ORDER_STATUSES))
+        if unknown:
+            raise serializers.ValidationError(f"Unknown status: {', '.join(unknown)}")
+        return wanted
+
+
+class SalesAnalyticsSerializer(DateRangeQuerySerializer):
+    """Query params of /admin/analytics/sales/"""
+    group = serializers.ChoiceField(choices=["day", "week", "month"], default="day")
+    dimension = serializers.ChoiceField(
+        choices=[code for code, _ in SalesRollup.DIMENSION_CHOICES], default="total"
+    )
+    limit = serializers.IntegerField(min_value=1, max_value=100, required=False)
+
+    params = {"group": "group", "dimension": "dimension", "limit": "limit"}
+    default_days = 30
+
+
+class QuizAnalyticsSerializer(DateRangeQuerySerializer):
+    """Query params of /admin/analytics/quizzes/"""
+    quiz = serializers.IntegerField(min_value=1, required=False)
+
+    params = {"quiz": "quiz"}
+    default_days = 30
+
+
+class ReconciliationRunSerializer(serializers.ModelSerializer):
+    started_by = serializers.CharField(source="started_by.username", read_only=True, default=None)
+
+    class Meta:
+        model = ReconciliationRun
+        fields = [
+            "id", "status", "repair", "started_by", "started_at", "finished_at",
+            "scanned_orders", "scanned_payments", "issues_found", "repaired", "summary", "error",
+        ]
+        read_only_fields = fields
+
+
+class ReconciliationIssueSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ReconciliationIssue
+        fields = ["id", "kind", "order_ref", "payment_ref", "expected", "actual", "repaired"]
 
 # ─── Quiz Serializers ───────────────
 class QuizAnswerSerializer(serializers.ModelSerializer):
@@ -778,6 +947,16 @@ class QuizResultSerializer(serializers.ModelSerializer):
         return ScentPersonaSerializer(persona, context=self.context).data
 
 # ─── Admin Quiz Serializers (Writable) ───────────────
+def validate_answer_weights(value):
+    # {"Fresh": 2, "Woody": 0.5}: used by WEIGHTED quizzes
+    if not isinstance(value, dict):
+        raise serializers.ValidationError("Expected an object of category -> weight.")
+    for category, weight in value.items():
+        if not category or isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight < 0:
+            raise serializers.ValidationError(f"Invalid weight for '{category}': use a number >= 0.")
+    return value
+
+
 class AdminQuizSerializer(serializers.ModelSerializer):
     allowed_products = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(),
@@ -787,8 +966,9 @@ class AdminQuizSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Quiz
-        fields = ["id", "title", "label", "audience", "allowed_products", "created_at"]
+        fields = ["id", "title", "label", "audience", "scoring", "top_k", "allowed_products", "created_at"]
         read_only_fields = ["id", "created_at"]
+        extra_kwargs = {"top_k": {"min_value": 1, "max_value": 100}}
 
 
 
@@ -806,9 +986,65 @@ class AdminQuizAnswerSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = QuizAnswer
-        fields = ["id", "question", "question_text", "answer_text", "category"]
+        fields = ["id", "question", "question_text", "answer_text", "category", "weights"]
         read_only_fields = ["id", "question_text"]
 
+    def validate_weights(self, value):
+        return validate_answer_weights(value)
+
+
+# ─── Admin Quiz Document (whole tree in one request) ───
+class QuizDocumentAnswerSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=False)  # omitted = new answer
+    answer_text = serializers.CharField(max_length=255)
+    category = serializers.CharField(max_length=50)
+    weights = serializers.JSONField(required=False, default=dict)
+
+    def validate_weights(self, value):
+        return validate_answer_weights(value)
+
+
+class QuizDocumentQuestionSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=False)  # omitted = new question
+    text = serializers.CharField(max_length=255)
+    answers = QuizDocumentAnswerSerializer(many=True, required=False)
+
+
+class QuizDocumentSerializer(serializers.Serializer):
+    """
+    PUT /admin/quizzes/{id}/document/. Omitted top-level keys are left alone;
+    a given `questions` list is the whole tree (missing ids are deleted).
+    Categories are checked once against the registry, not per answer.
+    """
+    title = serializers.CharField(max_length=200, required=False)
+    label = serializers.CharField(max_length=100, required=False, allow_blank=True)
+    audience = serializers.ChoiceField(choices=Quiz.AUDIENCE_CHOICES, required=False)
+    scoring = serializers.ChoiceField(choices=Quiz.SCORING_CHOICES, required=False)
+    top_k = serializers.IntegerField(min_value=1, max_value=100, required=False)
+    allowed_products = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
+    questions = QuizDocumentQuestionSerializer(many=True, required=False)
+
+    def validate_allowed_products(self, value):
+        value = list(dict.fromkeys(value))
+        found = set(Product.objects.filter(id__in=value).values_list("id", flat=True))
+        missing = [pid for pid in value if pid not in found]
+        if missing:
+            raise serializers.ValidationError(f"Unknown products: {missing}")
+        return value
+
+    def validate_questions(self, value):
+        categories = set(get_categories())
+        question_ids = [q["id"] for q in value if "id" in q]
+        answers = [a for q in value for a in q.get("answers", [])]
+        answer_ids = [a["id"] for a in answers if "id" in a]
+        if len(question_ids) != len(set(question_ids)) or len(answer_ids) != len(set(answer_ids)):
+            raise serializers.ValidationError("Each question / answer id may appear only once.")
+        unknown = sorted({a["category"] for a in answers} - categories)
+        if unknown:
+            raise serializers.ValidationError(f"Unknown categories: {unknown}")
+        return value
+
+
 class ScentPersonaSerializer(serializers.ModelSerializer):
     # Expose URLs for images
     image_url = serializers.SerializerMethodField()
@@ -8,6 +8,8 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from google.oauth2 import id_token
 from google.auth.transport import requests as grequests
 
+from .cart_service import guest_cart_token, merge_guest_cart
+
 User = get_user_model()
 
 class GoogleLoginView(APIView):
@@ -42,6 +44,8 @@ class GoogleLoginView(APIView):
             user.set_unusable_password()
             user.save()
 
+        merge_guest_cart(user, guest_cart_token(request))
+
         refresh = RefreshToken.for_user(user)
         return Response({
             "user": {"id": user.id, "username": user.username, "email": user.email},
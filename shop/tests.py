@@ -1,3 +1,958 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from .cart_service import (
+    add_to_cart, apply_cart_operations, build_cart_summary, load_guest_cart, merge_guest_cart,
+    new_guest_cart_token, save_guest_cart,
+)
+from .analytics import DIMENSIONS, rebuild_sales, sales_series
+from .counters import COUNTED, current_counts, recount
+from .inventory import decrement_stock
+from .order_flow import ERRORS, TransitionError, record_payment_failure, record_payment_started, transition
+from .categories import get_categories
+from .models import (
+    Cart, CartItem, Order, OrderItem, Payment, PaymentEvent, Product,
+    Quiz, QuizAnswer, QuizFunnelRollup, QuizQuestion, QuizResult, ReconciliationRun, User,
+)
+from .payment_events import FAILED, ingest, process_payment_events, sign
+from .quiz_analytics import SETTLE_SECONDS, conversion_window, process_quiz_funnel
+from .quiz_engine import (
+    RANK_WEIGHTS, RATING_PRIOR, STOCK_CAP, get_compiled_quiz, quiz_document, single_version_bump,
+)
+from .reconciliation import run_reconciliation
+from . import receipts
+
+
+def run_threads(n, target):
+    """Start n threads on target(i) together; each closes its own DB connection."""
+    barrier = threading.Barrier(n)
+    errors = []
+
+    def worker(i):
+        barrier.wait()
+        try:
+            target(i)
+        except Exception as e:  # collected, asserted by the test
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+# ─── Cart ───────────────────────────────────────
+class AddToCartConcurrencyTests(TransactionTestCase):
+    THREADS = 12
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="buyer", email="buyer@x.com", password="pw123456")
+        self.product = Product.objects.create(
+            name="P", category="Fresh", price=Decimal("10.00"), stock=7, description="d",
+        )
+
+    def test_parallel_adds_make_one_cart_and_line_within_stock(self):
+        per_add = 1
+        errors = run_threads(self.THREADS, lambda i: add_to_cart(self.user, self.product, per_add))
+
+        self.assertTrue(all(isinstance(e, serializers.ValidationError) for e in errors), errors)
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 1)
+        item = CartItem.objects.get(cart__user=self.user)
+        self.assertEqual(item.quantity, min(self.THREADS * per_add, self.product.stock))
+        self.assertEqual(len(errors), self.THREADS * per_add - item.quantity)
+
+
+class CartOperationsConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="batcher", email="batcher@x.com", password="pw123456")
+        self.products = [
+            Product.objects.create(name=f"P{i}", category="Fresh", price=Decimal("10.00"), stock=100, description="d")
+            for i in range(2)
+        ]
+
+    def test_parallel_batches_lose_no_increments(self):
+        ops = [{"op": "add", "product_id": p.id, "quantity": 2} for p in self.products]
+        errors = run_threads(self.THREADS, lambda i: apply_cart_operations(self.user, ops))
+
+        self.assertEqual(errors, [])
+        quantities = dict(CartItem.objects.filter(cart__user=self.user).values_list("product_id", "quantity"))
+        self.assertEqual(quantities, {p.id: 2 * self.THREADS for p in self.products})
+
+
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="summer", email="summer@x.com", password="pw123456")
+        cart = Cart.objects.create(user=self.user)
+        for name, price, stock, quantity in [("A", "10.00", 5, 2), ("B", "3.35", 1, 3), ("C", "7.00", 0, 1)]:
+            product = Product.objects.create(
+                name=name, category="Fresh", price=Decimal(price), stock=stock, description="d",
+            )
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+
+    def test_totals_and_warnings_in_one_query(self):
+        with self.assertNumQueries(1):
+            summary = build_cart_summary(self.user)
+
+        self.assertEqual((summary["item_count"], summary["subtotal"], summary["total"]), (6, "37.05", "37.05"))
+        self.assertEqual([item["line_total"] for item in summary["items"]], ["20.00", "10.05", "7.00"])
+        self.assertEqual(
+            [(w["code"], w["available"]) for w in summary["warnings"]],
+            [("INSUFFICIENT_STOCK", 1), ("OUT_OF_STOCK", 0)],
+        )
+
+    def test_endpoint_serves_the_summary(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get(reverse("cart-summary")).data, build_cart_summary(self.user))
+
+
+class GuestCartMergeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="guest", email="guest@x.com", password="pw123456")
+        self.kept, self.capped = (
+            Product.objects.create(name=n, category="Fresh", price=Decimal("5.00"), stock=4, description="d")
+            for n in ("Kept", "Capped")
+        )
+        add_to_cart(self.user, self.capped, 3)  # already in the account's cart
+
+    def test_login_adds_the_guest_lines_clamped_to_stock_and_drops_the_guest_cart(self):
+        client = APIClient()
+        ops = [
+            {"op": "add", "product_id": self.kept.id, "quantity": 2},
+            {"op": "add", "product_id": self.capped.id, "quantity": 2},
+        ]
+        guest = client.post(reverse("cart-guest"), {"operations": ops}, format="json")
+        self.assertEqual(guest.status_code, 200, guest.data)
+        self.assertFalse(Cart.objects.exclude(user=self.user).exists())  # guest carts live in the cache
+        token = guest.data["cart_token"]
+
+        login = client.post("/api/token/", {"username": "guest", "password": "pw123456", "cart_token": token})
+        self.assertEqual(login.status_code, 200)
+
+        quantities = dict(CartItem.objects.filter(cart__user=self.user).values_list("product_id", "quantity"))
+        self.assertEqual(quantities, {self.kept.id: 2, self.capped.id: 4})
+        self.assertEqual(load_guest_cart(token), {})
+
+    def test_forged_token_merges_nothing(self):
+        token = new_guest_cart_token()
+        save_guest_cart(token, {self.kept.id: 1})
+        forged = token[:-1] + ("x" if token[-1] != "x" else "y")
+
+        self.assertIsNone(merge_guest_cart(self.user, forged))
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 1)
+        self.assertEqual(load_guest_cart(token), {self.kept.id: 1})
+
+
+# ─── Checkout ───────────────────────────────────
+class CheckoutItemSelectionTests(TestCase):
+    ADDRESS = {
+        "fullname": "A B", "phone": "0123", "line1": "1 Road", "postcode": "50000",
+        "city": "KL", "state": "WP", "country": "MY",
+    }
+
+    def setUp(self):
+        user = User.objects.create_user(username="checker", email="checker@x.com", password="pw123456")
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        cart = Cart.objects.create(user=user)
+        self.lines = [
+            CartItem.objects.create(
+                cart=cart, quantity=1,
+                product=Product.objects.create(
+                    name=f"P{i}", category="Fresh", price=Decimal("10.00"), stock=5, description="d",
+                ),
+            )
+            for i in range(3)
+        ]
+
+    def test_repeated_form_keys_select_every_listed_line(self):
+        first, second, _ = self.lines
+        res = self.client.post(
+            reverse("order-checkout"), {**self.ADDRESS, "item_ids": [first.id, second.id]}, format="multipart"
+        )
+        self.assertEqual(res.status_code, 201, res.data)
+        self.assertEqual(len(res.data["items"]), 2)
+        self.assertEqual(list(CartItem.objects.values_list("id", flat=True)), [self.lines[2].id])
+
+    def test_malformed_item_ids_are_a_400(self):
+        for bad in ["x", ["x"], [], "12"]:
+            res = self.client.post(reverse("order-checkout"), {**self.ADDRESS, "item_ids": bad}, format="json")
+            self.assertEqual(res.status_code, 400, bad)
+            self.assertIn("item_ids", res.data)
+        self.assertEqual(CartItem.objects.count(), 3)
+
+
+class DecrementStockTests(TestCase):
+    def setUp(self):
+        self.a, self.b = (
+            Product.objects.create(name=n, category="Fresh", price=Decimal("1.00"), stock=3, description="d")
+            for n in "AB"
+        )
+
+    def stocks(self):
+        products = Product.objects.filter(id__in=[self.a.id, self.b.id]).order_by("id")
+        return list(products.values_list("stock", flat=True))
+
+    def test_takes_exactly_what_is_asked(self):
+        self.assertTrue(decrement_stock({self.a.id: 3, self.b.id: 1}))
+        self.assertEqual(self.stocks(), [0, 2])
+
+    def test_short_product_fails_the_call(self):
+        with transaction.atomic():
+            self.assertFalse(decrement_stock({self.a.id: 1, self.b.id: 4}))
+            transaction.set_rollback(True)  # what checkout does on False
+        self.assertEqual(self.stocks(), [3, 3])
+
+    def test_never_goes_negative(self):
+        self.assertFalse(decrement_stock({self.a.id: 4}))
+        self.assertTrue(decrement_stock({self.a.id: 3}))
+        self.assertFalse(decrement_stock({self.a.id: 1}))
+        self.assertEqual(self.stocks(), [0, 3])
+
+
+class CheckoutContentionTests(TransactionTestCase):
+    def test_bench_sells_exactly_the_stock(self):
+        out = StringIO()
+        # raises CommandError on oversell or a stock / units-sold mismatch
+        call_command("bench_checkout", threads=6, checkouts=3, products=2, stock=10, stdout=out)
+        self.assertIn("10 orders", out.getvalue())
+        self.assertIn("orders/s", out.getvalue())
+        self.assertFalse(Product.objects.filter(category="Bench").exists())  # cleaned up
+
+    def test_bench_leaves_the_dashboard_counters_as_they_were(self):
+        for i in range(5):  # counts are floored at 0: start above what the bench creates
+            User.objects.create_user(username=f"u{i}", email=f"u{i}@x.com", password="pw123456")
+            Product.objects.create(name=f"P{i}", category="Fresh", price=Decimal("1.00"), description="d")
+        before = current_counts()
+        self.assertEqual((before["users"], before["products"]), (5, 5))
+        call_command("bench_checkout", threads=2, checkouts=1, products=2, stock=5, stdout=StringIO())
+        self.assertEqual(current_counts(), before)
+
+    def test_bench_refuses_a_non_test_database_without_yes(self):
+        with mock.patch.dict(connection.settings_dict, {"NAME": "/srv/shop/db.sqlite3"}), \
+                self.assertRaisesMessage(CommandError, "--yes"):
+            call_command("bench_checkout", stdout=StringIO())
+        self.assertFalse(User.objects.filter(username__startswith="checkout-bench-").exists())
+
+
+# ─── Idempotency keys ───────────────────────────
+class IdempotentOrderCreateTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="retrier", email="retrier@x.com", password="pw123456")
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.product = Product.objects.create(
+            name="P", category="Fresh", price=Decimal("10.00"), stock=10, description="d",
+        )
+
+    def place(self, key, quantity=1):
+        body = {**CheckoutItemSelectionTests.ADDRESS, "items": [{"product_id": self.product.id, "quantity": quantity}]}
+        return self.client.post(reverse("order-list"), body, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first, again = self.place("k-1"), self.place("k-1")
+
+        self.assertEqual((first.status_code, again.status_code), (201, 201))
+        self.assertEqual(again["Idempotent-Replayed"], "true")
+        self.assertEqual(again.json()["id"], first.data["id"])
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 9)
+
+    def test_same_key_for_a_different_request_is_a_422(self):
+        self.assertEqual(self.place("k-2").status_code, 201)
+        self.assertEqual(self.place("k-2", quantity=2).status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_different_keys_are_different_orders(self):
+        self.place("k-3")
+        self.place("k-4")
+        self.assertEqual(Order.objects.count(), 2)
+
+
+# ─── Category registry ──────────────────────────
+class CategoryRegistryTests(TransactionTestCase):
+    def test_new_category_appears_only_after_commit(self):
+        Product.objects.create(name="A", category="Fresh", price=Decimal("1.00"), description="d")
+        self.assertEqual(get_categories(), ("Fresh",))
+
+        with transaction.atomic():
+            Product.objects.create(name="B", category="Woody", price=Decimal("1.00"), description="d")
+            # not committed: the version hasn't moved, the cached tuple stays
+            self.assertEqual(get_categories(), ("Fresh",))
+        self.assertEqual(get_categories(), ("Fresh", "Woody"))
+
+
+# ─── Order transitions ──────────────────────────
+class OrderTransitionTests(TestCase):
+    def setUp(self):
+        # staff, so the admin-only ship route reaches the status check too
+        user = User.objects.create_user(username="mover", email="mover@x.com", password="pw123456", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.product = Product.objects.create(
+            name="P", category="Fresh", price=Decimal("10.00"), stock=10, description="d",
+        )
+        body = {
+            **CheckoutItemSelectionTests.ADDRESS, "payment_method": "CARD",
+            "items": [{"product_id": self.product.id, "quantity": 3}],
+        }
+        response = self.client.post(reverse("order-list"), body, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.order_id = response.data["id"]
+
+    def post(self, action):
+        return self.client.post(reverse(f"order-{action}", args=[self.order_id]))
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock
+
+    def test_illegal_transitions_are_rejected(self):
+        for action in ("ship", "deliver", "complete"):
+            response = self.post(action)
+            self.assertEqual(response.status_code, 400, action)
+            self.assertEqual(response.data["error"], ERRORS[action])
+        order = Order.objects.get(id=self.order_id)
+        self.assertEqual(order.status, "TO_PAY")
+        self.assertFalse(order.events.exists())
+
+        with self.assertRaises(TransitionError):
+            transition(order, "ship")
+
+    def test_cancel_restocks_once(self):
+        self.assertEqual(self.stock(), 7)
+
+        self.assertEqual(self.post("cancel").status_code, 200)
+        self.assertEqual(Order.objects.get(id=self.order_id).status, "CANCELLED")
+        self.assertEqual(self.stock(), 10)
+
+        self.assertEqual(self.post("cancel").status_code, 400)
+        self.assertEqual(self.stock(), 10)
+
+
+# ─── Order history pages ────────────────────────
+class OrderCursorPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="pager", email="pager@x.com", password="pw123456")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_orders(self, n):
+        return [Order.objects.create(user=self.user, total=Decimal("1.00")).id for _ in range(n)]
+
+    def walk(self, between_pages=None):
+        ids, url = [], reverse("order-list") + "?limit=10"
+        while url:
+            page = self.client.get(url).data
+            ids += [row["id"] for row in page["results"]]
+            url = page["next"]
+            if between_pages:
+                between_pages()
+        return ids
+
+    def test_new_orders_between_pages_do_not_shift_the_walk(self):
+        existing = self.make_orders(25)
+
+        ids = self.walk(between_pages=lambda: self.make_orders(3))
+
+        self.assertEqual(ids, sorted(existing, reverse=True))
+
+    def test_orders_sharing_a_timestamp_are_neither_skipped_nor_repeated(self):
+        existing = self.make_orders(25)
+        Order.objects.update(created_at=timezone.now())
+
+        ids = self.walk()
+
+        self.assertEqual(ids, sorted(existing, reverse=True))
+
+
+# ─── Order payments ─────────────────────────────
+class PayAttemptRaceTests(TestCase):
+    """A failed / started attempt must not overwrite a payment that settled meanwhile."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="racer", email="racer@x.com", password="pw123456")
+        self.order = Order.objects.create(user=self.user, total=Decimal("50.00"))
+        Payment.objects.create(order=self.order, method="CARD", amount=Decimal("50.00"), status="PENDING")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def settle(self):
+        Order.objects.filter(id=self.order.id).update(status="TO_SHIP")
+        Payment.objects.filter(order=self.order).update(status="SUCCESS")
+
+    def pay_after_concurrent_success(self, body):
+        from .views import OrderViewSet
+
+        real_get_object = OrderViewSet.get_object
+
+        def get_object_then_settle(view):
+            order = real_get_object(view)  # the unlocked read the status check uses
+            self.settle()
+            return order
+
+        with mock.patch.object(OrderViewSet, "get_object", get_object_then_settle):
+            return self.client.post(reverse("order-pay", args=[self.order.id]), body, format="json")
+
+    def assert_untouched(self):
+        self.assertEqual(Payment.objects.get(order=self.order).status, "SUCCESS")
+        self.assertFalse(self.order.events.filter(action__in=["pay_failed", "pay_started"]).exists())
+
+    def test_failure_on_a_stale_order_is_rejected(self):
+        stale = Order.objects.get(id=self.order.id)
+        self.settle()
+        with self.assertRaises(TransitionError):
+            record_payment_failure(stale, "CARD")
+        self.assert_untouched()
+
+    def test_started_on_a_stale_order_is_rejected(self):
+        stale = Order.objects.get(id=self.order.id)
+        self.settle()
+        with self.assertRaises(TransitionError):
+            record_payment_started(stale, "CARD", "ch_1")
+        self.assert_untouched()
+
+    @override_settings(PAYMENT_WEBHOOK_ONLY=True)
+    def test_webhook_only_pay_racing_a_webhook_success_is_a_400(self):
+        res = self.pay_after_concurrent_success({"method": "CARD", "transaction_id": "ch_1"})
+        self.assertEqual(res.status_code, 400)
+        self.assert_untouched()
+
+    def test_failed_pay_racing_a_success_is_a_400(self):
+        res = self.pay_after_concurrent_success({"method": "CARD", "success": False})
+        self.assertEqual(res.status_code, 400)
+        self.assert_untouched()
+
+
+# ─── Payment webhooks ───────────────────────────
+@override_settings(PAYMENT_EVENTS_AUTO_APPLY=False)
+class PaymentEventTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="payer", email="payer@x.com", password="pw123456")
+        self.order = Order.objects.create(user=user, total=Decimal("50.00"))
+        Payment.objects.create(order=self.order, method="CARD", amount=Decimal("50.00"), status="PENDING")
+
+    def event(self, event_id, type_, **data):
+        return {
+            "id": event_id, "type": type_, "created": int(time.time()),
+            "data": {"order_id": self.order.id, "amount": "50.00", "method": "CARD", **data},
+        }
+
+    def test_failure_does_not_overwrite_a_payment_made_meanwhile(self):
+        ingest([self.event("evt_fail", FAILED)])
+
+        def paid_meanwhile(order_ids):
+            # another worker pays the order between the unlocked read and the lock
+            Order.objects.filter(id=self.order.id).update(status="TO_SHIP")
+            Payment.objects.filter(order=self.order).update(status="SUCCESS")
+            return {}
+
+        with mock.patch("shop.payment_events._latest_applied", side_effect=paid_meanwhile):
+            process_payment_events()
+
+        self.assertEqual(Payment.objects.get(order=self.order).status, "SUCCESS")
+        self.assertEqual(PaymentEvent.objects.get(event_id="evt_fail").result, "ignored")
+
+    def test_poison_event_is_marked_error_and_the_rest_still_apply(self):
+        other = Order.objects.create(user=self.order.user, total=Decimal("50.00"))
+        Payment.objects.create(order=other, method="CARD", amount=Decimal("50.00"), status="PENDING")
+        ingest([
+            self.event("evt_poison", FAILED),
+            self.event("evt_other", FAILED, order_id=other.id),
+        ])
+
+        def fail_on_first_order(order, *args):
+            if order.id == self.order.id:
+                raise RuntimeError("boom")
+            return record_payment_failure(order, *args)
+
+        with mock.patch("shop.payment_events.record_payment_failure", side_effect=fail_on_first_order), \
+                self.assertLogs("shop.payment_events", "ERROR"):
+            self.assertEqual(process_payment_events(), 2)
+
+        poison, applied = PaymentEvent.objects.get(event_id="evt_poison"), PaymentEvent.objects.get(event_id="evt_other")
+        self.assertEqual((poison.result, poison.detail), ("error", "boom"))
+        self.assertIsNotNone(poison.processed_at)
+        self.assertEqual(applied.result, "applied")
+        self.assertEqual(Payment.objects.get(order=other).status, "FAILED")
+        self.assertEqual(process_payment_events(), 0)  # nothing left to block the queue
+
+
+@override_settings(PAYMENT_EVENTS_AUTO_APPLY=False, PAYMENT_WEBHOOK_SECRET="whsec", PAYMENT_WEBHOOK_TOLERANCE=300)
+class PaymentWebhookTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="hooked", email="hooked@x.com", password="pw123456")
+        self.order = Order.objects.create(user=user, total=Decimal("50.00"))
+        self.body = json.dumps({
+            "id": "evt_1", "type": FAILED, "created": int(time.time()),
+            "data": {"order_id": self.order.id, "amount": "50.00", "method": "CARD"},
+        }).encode()
+
+    def deliver(self, signature, body=None):
+        return APIClient().post(
+            reverse("payment-webhook"), body or self.body, content_type="application/json",
+            HTTP_X_GATEWAY_SIGNATURE=signature,
+        )
+
+    def test_bad_signatures_are_rejected_and_nothing_is_stored(self):
+        for signature in [
+            "",
+            sign(self.body, "not-the-secret"),
+            sign(self.body, "whsec", timestamp=time.time() - 301),  # replayed too late
+            sign(b'{"tampered": true}', "whsec"),
+        ]:
+            self.assertEqual(self.deliver(signature).status_code, 400, signature)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_redelivery_is_stored_once(self):
+        first = self.deliver(sign(self.body, "whsec"))
+        again = self.deliver(sign(self.body, "whsec"))
+
+        self.assertEqual(first.data, {"received": 1, "duplicates": 0})
+        self.assertEqual(again.data, {"received": 0, "duplicates": 1})
+        self.assertEqual(PaymentEvent.objects.filter(event_id="evt_1").count(), 1)
+
+    def test_duplicates_inside_one_delivery_are_stored_once(self):
+        body = json.dumps({"events": [json.loads(self.body)] * 2}).encode()
+        response = self.deliver(sign(body, "whsec"), body=body)
+
+        self.assertEqual(response.data, {"received": 1, "duplicates": 1})
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+
+
+# ─── Receipts ───────────────────────────────────
+@override_settings(RECEIPT_RENDER_PROCESSES=1, RECEIPT_RENDER_TIMEOUT=0.1)
+class ReceiptRenderTimeoutTests(TestCase):
+    def test_slow_render_is_busy_and_keeps_its_slot_until_it_ends(self):
+        user = User.objects.create_user(username="reader", email="reader@x.com", password="pw123456")
+        order = Order.objects.create(user=user, total=Decimal("10.00"))
+        release = threading.Event()
+        started, finished = threading.Event(), []
+
+        def slow_render(data):
+            started.set()
+            release.wait(5)
+            finished.append(data["id"])
+            return b"%PDF"
+
+        pool = ThreadPoolExecutor(max_workers=1)  # stands in for the process pool
+        self.addCleanup(pool.shutdown)
+        free = receipts._slots._value
+        with mock.patch.object(receipts, "_get_pool", return_value=pool), \
+                mock.patch.object(receipts, "render_receipt", slow_render):
+            with self.assertRaises(receipts.RenderBusy):
+                receipts.render_receipt_pdf(order)
+            self.assertTrue(started.is_set())
+            self.assertEqual(receipts._slots._value, free - 1)  # still rendering, still counted
+
+            release.set()
+            pool.shutdown(wait=True)
+        self.assertEqual(finished, [order.id])
+        self.assertEqual(receipts._slots._value, free)
+
+
+class ReceiptVersionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="payer", email="payer@x.com", password="pw123456")
+        self.order = Order.objects.create(user=self.user, total=Decimal("10.00"))
+        Payment.objects.create(order=self.order, method="CARD", amount=Decimal("10.00"), status="PENDING")
+
+    def version(self):
+        return receipts.receipt_version(Order.objects.select_related("payment").get(id=self.order.id))
+
+    def test_version_follows_the_payment_status(self):
+        pending = self.version()
+        self.assertEqual(self.version(), pending)
+
+        Payment.objects.filter(order=self.order).update(status="SUCCESS")
+        paid = self.version()
+        self.assertNotEqual(paid, pending)
+        self.assertNotEqual(receipts.receipt_path(self.order, paid), receipts.receipt_path(self.order, pending))
+
+    def test_stale_etag_is_not_a_304_after_payment(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse("order-receipt-pdf", args=[self.order.id])
+        etag = f'"{self.version()}"'
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Payment.objects.filter(order=self.order).update(status="SUCCESS")
+        with mock.patch("shop.views.ensure_receipt", side_effect=receipts.RenderBusy):
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 503)  # went on to (re)render the new version
+
+
+# ─── Quiz engine ────────────────────────────────
+class CompiledQuizInvalidationTests(TransactionTestCase):
+    def setUp(self):
+        self.quiz = Quiz.objects.create(title="Q")
+        question = QuizQuestion.objects.create(quiz=self.quiz, text="Q1")
+        self.answer = QuizAnswer.objects.create(question=question, answer_text="A", category="Fresh")
+
+    def test_compiled_quiz_is_reused_until_something_changes(self):
+        compiled = get_compiled_quiz(self.quiz.id)
+        self.assertIs(get_compiled_quiz(self.quiz.id), compiled)
+
+        with transaction.atomic():
+            self.answer.category = "Woody"
+            self.answer.save()
+            # uncommitted: no worker may recompile from it yet
+            self.assertIs(get_compiled_quiz(self.quiz.id), compiled)
+
+        fresh = get_compiled_quiz(self.quiz.id)
+        self.assertIsNot(fresh, compiled)
+        self.assertEqual(fresh.answer_category[self.answer.id], "Woody")
+
+    def test_whitelist_edit_recompiles(self):
+        product = Product.objects.create(name="P", category="Fresh", price=Decimal("10.00"), description="d")
+        self.assertEqual(get_compiled_quiz(self.quiz.id).whitelist, frozenset())
+
+        self.quiz.allowed_products.add(product)
+        self.assertEqual(get_compiled_quiz(self.quiz.id).whitelist, {product.id})
+
+    def test_single_version_bump_bumps_once(self):
+        with mock.patch("shop.quiz_engine._new_version") as new_version:
+            with transaction.atomic(), single_version_bump():
+                for i in range(5):
+                    QuizAnswer.objects.create(question=self.answer.question, answer_text=f"B{i}", category="Fresh")
+        new_version.assert_called_once_with()
+
+
+class WeightedRankingTests(TestCase):
+    def setUp(self):
+        self.quiz = Quiz.objects.create(title="W", scoring="WEIGHTED", top_k=5)
+        question = QuizQuestion.objects.create(quiz=self.quiz, text="Q")
+        self.answer = QuizAnswer.objects.create(
+            question=question, answer_text="A", category="Fresh", weights={"Fresh": 2, "Woody": 1},
+        )
+        # only 3 products carry answer weight: the other 2 slots come from the rest of the catalog
+        for i, (category, stock) in enumerate(
+            [("Fresh", 1), ("Fresh", 30), ("Woody", 4), ("Bold", 25), ("Bold", 2), ("Bold", 18), ("Bold", 25)]
+        ):
+            Product.objects.create(name=f"P{i}", category=category, price=Decimal("1.00"), stock=stock, description="d")
+
+    def brute_force(self, vector, k):
+        def score(p):  # no reviews: every product sits at the prior rating
+            return (
+                RANK_WEIGHTS["affinity"] * vector.get(p.category, 0)
+                + RANK_WEIGHTS["rating"] * RATING_PRIOR / 5
+                + RANK_WEIGHTS["stock"] * min(p.stock, STOCK_CAP) / STOCK_CAP
+            )
+        return [p.id for p in sorted(Product.objects.all(), key=lambda p: (-score(p), p.id))][:k]
+
+    def test_top_k_matches_a_full_ranking_and_is_k_long(self):
+        compiled = get_compiled_quiz(self.quiz.id)
+        fingerprint = compiled.fingerprint([self.answer.id])
+        category, ids = compiled.rank(fingerprint)
+
+        self.assertEqual(category, "Fresh")
+        self.assertEqual(ids, self.brute_force(compiled.answer_vector(fingerprint), 5))
+        self.assertEqual(len(ids), 5)
+
+
+# ─── Quiz documents ─────────────────────────────
+class QuizDocumentInvalidationTests(TransactionTestCase):
+    """Plain ORM writes (as the Django admin makes them) move the public documents."""
+
+    def setUp(self):
+        self.quiz_a, self.quiz_b = Quiz.objects.create(title="A"), Quiz.objects.create(title="B")
+        self.question_a = QuizQuestion.objects.create(quiz=self.quiz_a, text="Qa")
+        self.question_b = QuizQuestion.objects.create(quiz=self.quiz_b, text="Qb")
+        self.answer = QuizAnswer.objects.create(question=self.question_a, answer_text="Ans", category="Fresh")
+
+    def answers_of(self, quiz):
+        doc, _ = quiz_document(quiz.id)
+        return [a["answer_text"] for q in doc["questions"] for a in q["answers"]]
+
+    def test_saves_and_deletes_refresh_the_document(self):
+        self.assertEqual(self.answers_of(self.quiz_a), ["Ans"])
+
+        self.answer.answer_text = "Renamed"
+        self.answer.save()
+        self.assertEqual(self.answers_of(self.quiz_a), ["Renamed"])
+
+        self.question_a.delete()
+        self.assertEqual(quiz_document(self.quiz_a.id)[0]["questions"], [])
+
+    def test_moving_an_answer_refreshes_both_quizzes(self):
+        self.assertEqual((self.answers_of(self.quiz_a), self.answers_of(self.quiz_b)), (["Ans"], []))
+
+        self.answer.question = self.question_b
+        self.answer.save()
+        self.assertEqual((self.answers_of(self.quiz_a), self.answers_of(self.quiz_b)), ([], ["Ans"]))
+
+    def test_document_moves_only_on_commit(self):
+        _, version = quiz_document(self.quiz_a.id)
+        with transaction.atomic():
+            Quiz.objects.filter(id=self.quiz_a.id).get().save()
+            self.assertEqual(quiz_document(self.quiz_a.id)[1], version)
+        self.assertNotEqual(quiz_document(self.quiz_a.id)[1], version)
+
+
+@mock.patch("shop.serializers.get_categories", return_value=["Fresh", "Bold"])
+class QuizDocumentPutTests(TestCase):
+    def setUp(self):
+        admin = User.objects.create_user(username="editor", email="editor@x.com", password="pw123456", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        self.quiz, self.other = Quiz.objects.create(title="Q"), Quiz.objects.create(title="Other")
+        self.q1 = QuizQuestion.objects.create(quiz=self.quiz, text="One")
+        self.q2 = QuizQuestion.objects.create(quiz=self.quiz, text="Two")
+        self.a1, self.a2 = (
+            QuizAnswer.objects.create(question=self.q1, answer_text=t, category="Fresh") for t in ("a1", "a2")
+        )
+        self.a3 = QuizAnswer.objects.create(question=self.q2, answer_text="a3", category="Bold")
+        self.foreign = QuizQuestion.objects.create(quiz=self.other, text="Theirs")
+        self.foreign_answer = QuizAnswer.objects.create(question=self.foreign, answer_text="x", category="Fresh")
+
+    def put(self, questions):
+        url = reverse("admin-quizzes-document", args=[self.quiz.id])
+        return self.client.put(url, {"questions": questions}, format="json")
+
+    def answer(self, a):
+        return {"id": a.id, "answer_text": a.answer_text, "category": a.category}
+
+    def test_move_delete_and_create_in_one_put(self, _):
+        response = self.put([{
+            "id": self.q1.id, "text": "One",
+            "answers": [self.answer(self.a1), self.answer(self.a3), {"answer_text": "new", "category": "Bold"}],
+        }])
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["changes"], {
+            "questions_deleted": 1, "answers_created": 1, "answers_updated": 1, "answers_deleted": 1,
+        })
+        self.assertFalse(QuizQuestion.objects.filter(id=self.q2.id).exists())
+        self.assertFalse(QuizAnswer.objects.filter(id=self.a2.id).exists())
+        self.a3.refresh_from_db()  # moved before its old question went, not cascaded away
+        self.assertEqual(self.a3.question_id, self.q1.id)
+        self.assertEqual(
+            list(self.q1.answers.order_by("id").values_list("answer_text", flat=True)), ["a1", "a3", "new"]
+        )
+
+    def test_ids_from_another_quiz_are_a_400_and_change_nothing(self, _):
+        for questions in [
+            [{"id": self.foreign.id, "text": "Mine now"}],
+            [{"id": self.q1.id, "text": "One", "answers": [self.answer(self.foreign_answer)]}],
+        ]:
+            response = self.put(questions)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("Not part of this quiz", str(response.data["questions"]))
+
+        self.assertEqual(QuizQuestion.objects.filter(quiz=self.quiz).count(), 2)
+        self.assertEqual(QuizQuestion.objects.get(id=self.foreign.id).text, "Theirs")
+        self.assertEqual(QuizAnswer.objects.get(id=self.foreign_answer.id).question_id, self.foreign.id)
+
+
+# ─── Sales rollups ──────────────────────────────
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="seller", email="seller@x.com", password="pw123456")
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.fresh, self.bold = (
+            Product.objects.create(name=c, category=c, price=price, stock=50, description="d")
+            for c, price in (("Fresh", Decimal("10.00")), ("Bold", Decimal("25.50")))
+        )
+
+    def place(self, method, *lines):
+        body = {
+            **CheckoutItemSelectionTests.ADDRESS, "payment_method": method,
+            "items": [{"product_id": p.id, "quantity": q} for p, q in lines],
+        }
+        response = self.client.post(reverse("order-list"), body, format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data["id"]
+
+    def series(self):
+        today = timezone.now().date()
+        return {d: sales_series(today, today, dimension=d) for d in DIMENSIONS}
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        self.place("COD", (self.fresh, 2), (self.bold, 1))
+        cancelled = self.place("COD", (self.bold, 3))
+        self.place("CARD", (self.fresh, 5))  # TO_PAY: not a sale yet
+        self.client.post(reverse("order-cancel", args=[cancelled]))
+
+        incremental = self.series()
+        self.assertEqual(
+            incremental["total"]["totals"], {"orders": 1, "units": 3, "revenue": Decimal("45.50")}
+        )
+        self.assertEqual(
+            {row["key"]: row["units"] for row in incremental["category"]["series"]}, {"Fresh": 2, "Bold": 1}
+        )
+
+        with transaction.atomic():
+            rebuild_sales()
+        self.assertEqual(self.series(), incremental)
+
+
+# ─── Dashboard counters ─────────────────────────
+class DashboardCounterTests(TestCase):
+    def table_counts(self):
+        return {name: model.objects.count() for name, model in COUNTED.items()}
+
+    def test_creates_and_deletes_keep_the_counters_exact(self):
+        users = [
+            User.objects.create_user(username=f"c{i}", email=f"c{i}@x.com", password="pw123456") for i in range(3)
+        ]
+        product = Product.objects.create(name="P", category="Fresh", price=Decimal("1.00"), description="d")
+        for user in users:
+            order = Order.objects.create(user=user, total=Decimal("1.00"))
+            Payment.objects.create(order=order, method="COD", amount=Decimal("1.00"))
+        self.assertEqual(current_counts(), self.table_counts())
+
+        users[0].delete()  # cascades to its order and payment, one signal each
+        Order.objects.filter(user=users[1]).delete()
+        product.delete()
+        self.assertEqual(current_counts(), self.table_counts())
+        self.assertEqual(recount(), self.table_counts())
+        self.assertEqual(current_counts(), self.table_counts())
+
+
+# ─── Reconciliation ─────────────────────────────
+class ReconciliationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="auditor", email="auditor@x.com", password="pw123456")
+
+    def order(self, status, payment_status=None, method="CARD", amount="10.00"):
+        order = Order.objects.create(user=self.user, total=Decimal("10.00"), status=status)
+        if payment_status:
+            Payment.objects.create(order=order, method=method, amount=Decimal(amount), status=payment_status)
+        return order.id
+
+    def reconcile(self, repair):
+        run = ReconciliationRun.objects.create(repair=repair)
+        return run_reconciliation(run, chunk_size=2)  # several chunks
+
+    def test_finds_every_kind_and_repairs_only_the_safe_ones(self):
+        ids = {
+            "ok": self.order("TO_SHIP", "SUCCESS"),
+            "ok_cod": self.order("TO_SHIP", "PENDING", method="COD"),
+            "amount_mismatch": self.order("TO_PAY", "PENDING", amount="9.00"),
+            "success_on_unpaid": self.order("TO_PAY", "SUCCESS"),
+            "unpaid_fulfilled": self.order("TO_SHIP", "PENDING"),
+            "refund_due": self.order("CANCELLED", "SUCCESS"),
+            "missing_payment": self.order("TO_PAY"),
+        }
+
+        run = self.reconcile(repair=True)
+
+        self.assertEqual((run.status, run.scanned_orders), ("DONE", 7))
+        found = {issue.kind: (issue.order_ref, issue.repaired) for issue in run.issues.all()}
+        self.assertEqual(found, {
+            kind: (ids[kind], kind in ("amount_mismatch", "success_on_unpaid"))
+            for kind in ids if not kind.startswith("ok")
+        })
+        self.assertEqual(Payment.objects.get(order_id=ids["amount_mismatch"]).amount, Decimal("10.00"))
+        self.assertEqual(Order.objects.get(id=ids["success_on_unpaid"]).status, "TO_SHIP")
+
+        again = self.reconcile(repair=False)
+        self.assertEqual(sorted(again.summary), ["missing_payment", "refund_due", "unpaid_fulfilled"])
+
+
+# ─── Admin date-range params ────────────────────
+class DateRangeParamsTests(TestCase):
+    URLS = ["admin-analytics-sales", "admin-analytics-quizzes", "admin-invoices-zip"]
+
+    def setUp(self):
+        admin = User.objects.create_superuser(username="boss", email="boss@x.com", password="pw123456")
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+
+    def test_from_after_to_is_a_400_everywhere(self):
+        for name in self.URLS:
+            res = self.client.get(reverse(name), {"from": "2026-02-01", "to": "2026-01-01"})
+            self.assertEqual(res.status_code, 400, name)
+            self.assertIn("to", res.json())
+
+    def test_from_after_the_default_end_is_a_400(self):
+        future = (timezone.now() + timedelta(days=3)).date().isoformat()
+        for name in self.URLS[:2]:
+            self.assertEqual(self.client.get(reverse(name), {"from": future}).status_code, 400, name)
+
+    def test_defaults_fill_missing_ends(self):
+        res = self.client.get(reverse("admin-analytics-quizzes"), {"to": "", "quiz": ""})
+        self.assertEqual(res.status_code, 200)
+        today = timezone.now().date()
+        self.assertEqual((res.data["from"], res.data["to"]), (today - timedelta(days=29), today))
+
+
+# ─── Quiz funnel rollups ────────────────────────
+class QuizFunnelFoldTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="taker", email="taker@x.com", password="pw123456")
+        self.quiz = Quiz.objects.create(title="Q")
+        self.product = Product.objects.create(name="P", category="Fresh", price=Decimal("10.00"), description="d")
+
+    def result(self, age):
+        r = QuizResult.objects.create(
+            quiz=self.quiz, user=self.user, recommended_category="Fresh",
+            product_ids=[self.product.id], answer_ids=[7, 9],
+        )
+        QuizResult.objects.filter(id=r.id).update(created_at=timezone.now() - age)
+        return r
+
+    def rollups(self):
+        return {
+            (metric, key): n
+            for metric, key, n in QuizFunnelRollup.objects.filter(quiz=self.quiz).values_list("metric", "key", "count")
+        }
+
+    def test_rerun_adds_nothing(self):
+        self.result(timedelta(minutes=5))
+        self.result(timedelta(minutes=5))
+
+        self.assertEqual(process_quiz_funnel(), (2, 0))
+        folded = self.rollups()
+        self.assertEqual(folded, {("takers", ""): 2, ("category", "Fresh"): 2, ("answer", "7"): 2, ("answer", "9"): 2})
+
+        self.assertEqual(process_quiz_funnel(), (0, 0))
+        self.assertEqual(self.rollups(), folded)
+
+    def test_results_inside_the_settle_window_wait_for_the_next_run(self):
+        self.result(timedelta(minutes=5))
+        fresh = self.result(timedelta(seconds=SETTLE_SECONDS // 2))
+
+        self.assertEqual(process_quiz_funnel(), (1, 0))
+        self.assertEqual(self.rollups()[("takers", "")], 1)
+
+        QuizResult.objects.filter(id=fresh.id).update(
+            created_at=timezone.now() - timedelta(seconds=SETTLE_SECONDS + 1)
+        )
+        self.assertEqual(process_quiz_funnel(), (1, 0))
+        self.assertEqual(self.rollups()[("takers", "")], 2)
+
+    def test_conversion_counted_once_its_window_closes(self):
+        self.result(conversion_window() + timedelta(days=1))
+        order = Order.objects.create(user=self.user, total=Decimal("10.00"), status="TO_SHIP")
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price=Decimal("10.00"))
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - conversion_window())
+        self.result(timedelta(minutes=5))  # window still open: not checked yet
+
+        self.assertEqual(process_quiz_funnel(), (2, 1))
+        self.assertEqual(self.rollups()[("converted", "Fresh")], 1)
+        self.assertEqual(process_quiz_funnel(), (0, 0))
+        self.assertEqual(self.rollups()[("converted", "Fresh")], 1)
@@ -0,0 +1,46 @@
+# shop/upserts.py
+"""
+The additive upsert behind the counter and rollup tables:
+
+    INSERT INTO t (k1, k2, n) VALUES (..), (..)
+    ON CONFLICT (k1, k2) DO UPDATE SET n = t.n + excluded.n
+
+One statement for any number of rows and no read-modify-write, so
+concurrent writers can't lose each other's increments (Postgres and
+SQLite alike). The key columns need a unique constraint.
+"""
+from django.db import connection
+
+
+def add_upsert_sql(model, keys, add, rows=1, select=None, where=None, returning=None):
+    """
+    The statement for `rows` VALUES tuples of (*keys, *add), or for `select`
+    (an INSERT ... SELECT yielding those columns; SQLite wants it to have a
+    WHERE). `where` guards the update, `returning` is passed through.
+    Column names are database columns ("user_id", not "user").
+    """
+    q = connection.ops.quote_name
+    table = q(model._meta.db_table)
+    columns = [*keys, *add]
+    if select is None:
+        row = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        select = "VALUES " + ", ".join([row] * rows)
+    sql = f"""
+        INSERT INTO {table} ({", ".join(map(q, columns))}) {select}
+        ON CONFLICT ({", ".join(map(q, keys))}) DO UPDATE SET
+            {", ".join(f"{q(c)} = {table}.{q(c)} + excluded.{q(c)}" for c in add)}
+    """
+    if where:
+        sql += f" WHERE {where}"
+    if returning:
+        sql += f" RETURNING {returning}"
+    return sql
+
+
+def add_upsert(model, keys, add, rows):
+    """Add rows of (*keys, *add values) onto `model` with ONE statement. No rows, no query."""
+    rows = list(rows)
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(add_upsert_sql(model, keys, add, len(rows)), [v for row in rows for v in row])
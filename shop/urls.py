@@ -5,6 +5,7 @@ from rest_framework_simplejwt.views import TokenRefreshView
 from .views import (
     ProductViewSet, ReviewViewSet, CartViewSet,
     OrderViewSet, PaymentViewSet, CartItemViewSet,
+    CartSummaryView, CartBatchView, GuestCartView, ReservationView,
     UserSignupView, MeView, UpdateMeView,
     PasswordResetRequestView, PasswordResetConfirmView,
     MyTokenObtainPairView, ReviewMediaViewSet,
@@ -16,6 +17,8 @@ from .views import (
     AdminReviewViewSet, SiteAboutViewSet, RetailerViewSet, AdminPaymentViewSet,
     ScentPersonaViewSet,
     AdminCategoryList, admin_dashboard_stats,
+    AdminInvoiceExportView, AdminInvoiceExportProgressView, AdminExportView,
+    AdminSalesAnalyticsView, AdminQuizAnalyticsView, PaymentWebhookView, AdminReconciliationViewSet,
 )
 from .views_upload import R2PresignBigFile, ARFinalizeBigFile, ARDeleteBigFile
 
@@ -45,10 +48,14 @@ admin_router.register("quiz-questions", AdminQuizQuestionViewSet, basename="admi
 admin_router.register("quiz-answers", AdminQuizAnswerViewSet, basename="admin-quiz-answers")
 admin_router.register("reviews", AdminReviewViewSet, basename="admin-reviews")
 admin_router.register("payments", AdminPaymentViewSet, basename="admin-payments")
+admin_router.register("reconciliation", AdminReconciliationViewSet, basename="admin-reconciliation")
 admin_router.register("scent-personas", ScentPersonaViewSet, basename="admin-scent-personas")
 
 # ─── URL Patterns ──────────────────────────────────────────
 urlpatterns = [
+    # Payment gateway webhook (before the router, which owns payments/<pk>/)
+    path("payments/webhook/", PaymentWebhookView.as_view(), name="payment-webhook"),
+
     path("", include(router.urls)),
 
     # Auth / JWT
@@ -63,10 +70,27 @@ urlpatterns = [
     path("password-reset/", PasswordResetRequestView.as_view(), name="password-reset"),
     path("password-reset/confirm/", PasswordResetConfirmView.as_view(), name="password-reset-confirm"),
 
+    # Cart
+    path("cart/summary/", CartSummaryView.as_view(), name="cart-summary"),
+    path("cart/batch/", CartBatchView.as_view(), name="cart-batch"),
+    path("cart/guest/", GuestCartView.as_view(), name="cart-guest"),
+
+    # Checkout stock holds
+    path("reservations/", ReservationView.as_view(), name="reservations"),
+
     # Quiz
     path("quiz-submit/", QuizSubmitView.as_view(), name="quiz-submit"),
 
     # Admin Endpoints
+    path("admin/orders/invoices.zip", AdminInvoiceExportView.as_view(), name="admin-invoices-zip"),
+    path(
+        "admin/orders/invoices-progress/<str:export_id>/",
+        AdminInvoiceExportProgressView.as_view(),
+        name="admin-invoices-progress",
+    ),
+    path("admin/export/<str:entity>.<str:fmt>", AdminExportView.as_view(), name="admin-export"),
+    path("admin/analytics/sales/", AdminSalesAnalyticsView.as_view(), name="admin-analytics-sales"),
+    path("admin/analytics/quizzes/", AdminQuizAnalyticsView.as_view(), name="admin-analytics-quizzes"),
     path("admin/", include(admin_router.urls)),
     path("admin/dashboard-stats/", admin_dashboard_stats, name="admin-dashboard-stats"),
     path("ar/<int:pk>/delete-marker/", ARDeleteMarkerView.as_view(), name="ar-delete-marker"),
@@ -1,9 +1,9 @@
-from collections import Counter
+from datetime import timedelta
 import json
-from io import BytesIO
 from rest_framework import viewsets, permissions, status, generics, parsers, mixins, filters, serializers
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView
@@ -14,24 +14,20 @@ from django.shortcuts import get_object_or_404
 from django.core.mail import send_mail
 from django.conf import settings
 from django.contrib.auth.tokens import default_token_generator
-from django.core.cache import cache
 from django.db import transaction
-from django.db.models import Avg, Count, Q, Prefetch, F
-from django.http import HttpResponse
+from django.db.models import Avg, Count, Q, Prefetch
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from django.utils import timezone
-from django.utils.http import urlsafe_base64_encode
+from django.utils.http import parse_etags, quote_etag, urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import update_last_login
 from django.core.files.storage import default_storage
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
 
 from .models import (
     Product, Review, Cart, Order, Payment, CartItem, ReviewMedia,
     Quiz, QuizAnswer, QuizQuestion, QuizResult, ProductMedia, ARExperience,
-    SiteAbout, Retailer, ScentPersona, OrderItem
+    SiteAbout, Retailer, ScentPersona, OrderItem, ReconciliationRun
 )
 from .serializers import (
     ProductSerializer, ReviewSerializer, CartSerializer,
@@ -39,11 +35,40 @@ from .serializers import (
     UserSerializer, UserSignupSerializer,
     PasswordResetRequestSerializer, PasswordResetConfirmSerializer,
     MyTokenObtainPairSerializer, ReviewMediaSerializer,
-    QuizSerializer, QuizResultSerializer, ProductMediaSerializer,
-    AdminQuizSerializer, AdminQuizAnswerSerializer, AdminQuizQuestionSerializer,
+    QuizSerializer, ProductMediaSerializer,
+    AdminQuizSerializer, AdminQuizAnswerSerializer, AdminQuizQuestionSerializer, QuizDocumentSerializer,
     ARExperienceSerializer, SiteAboutSerializer, RetailerSerializer, 
-    ScentPersonaSerializer, 
+    ScentPersonaSerializer, CartBatchSerializer,
+    ReservationRequestSerializer, StockReservationSerializer, CheckoutSelectionSerializer,
+    BulkTransitionSerializer, OrderEventSerializer, InvoiceExportSerializer,
+    SalesAnalyticsSerializer, QuizAnalyticsSerializer, ReconciliationRunSerializer, ReconciliationIssueSerializer,
 )
+from .cart_service import (
+    build_cart_summary, apply_cart_operations,
+    guest_cart_token, new_guest_cart_token, load_guest_cart, save_guest_cart,
+    apply_guest_cart_operations, build_guest_cart_summary,
+)
+from .inventory import active_holds, reserve, release
+from .idempotency import idempotent
+from .receipts import (
+    RenderBusy, ensure_receipt, receipt_storage, receipt_version, schedule_receipts,
+)
+from .invoice_export import export_queryset, get_progress, new_export_id, stream_invoices_zip
+from .exports import EXPORTS, FORMATS, export_rows, stream_export
+from .counters import dashboard_stats
+from .analytics import counts_as_sale, record_sales, sales_series
+from .order_flow import (
+    STATUSES as ORDER_STATUSES, TransitionError, apply_transition,
+    record_payment_failure, record_payment_started, set_status, status_counts, transition,
+)
+from .reconciliation import start_reconciliation
+from .quiz_engine import (
+    get_compiled_quiz, public_quizzes, quiz_document, quiz_list_document,
+)
+from .quiz_builder import quiz_tree, save_quiz_tree
+from .categories import get_categories
+from .quiz_analytics import quiz_funnel
+from .payment_events import InvalidEvent, MAX_EVENTS_PER_REQUEST, ingest, verify_signature
 
 User = get_user_model()
 
@@ -51,26 +76,11 @@ User = get_user_model()
 @api_view(["GET"])
 @permission_classes([IsAdminUser])
 def admin_dashboard_stats(request):
-    cache_key = "admin_dashboard_stats_v1"
-    cached = cache.get(cache_key)
-    if cached:
-        return Response(cached)
-
-    data = {
-        "users": User.objects.count(),
-        "products": Product.objects.count(),
-        "orders": Order.objects.count(),
-        "payments": Payment.objects.count(),
-        "quizzes": Quiz.objects.count(),
-        "scentPersonas": ScentPersona.objects.count(),
-        "ar": ARExperience.objects.count(),
-        "reviews": Review.objects.count(),
-        "retailers": Retailer.objects.count(),
-    }
-
-    # cache for 30s (admin dashboard doesn't need realtime)
-    cache.set(cache_key, data, 30)
-    return Response(data)
+    """
+    Entity counts + 30-day trends from the maintained counters
+    (shop/counters.py), cached in the shared cache with stale-while-revalidate.
+    """
+    return Response(dashboard_stats())
 
 
 # ─── Permissions ─────────────────────────────
@@ -257,7 +267,14 @@ class CartViewSet(viewsets.ModelViewSet):
         # prevent 401 spam
         if not self.request.user.is_authenticated:
             return Cart.objects.none()
-        return Cart.objects.filter(user=self.request.user)
+        return (
+            Cart.objects
+            .filter(user=self.request.user)
+            .select_related("user")
+            .prefetch_related(
+                Prefetch("items", queryset=CartItem.objects.select_related("product"))
+            )
+        )
 
     def perform_create(self, serializer):
         if self.request.user.is_authenticated:
@@ -283,11 +300,123 @@ class CartItemViewSet(viewsets.ModelViewSet):
         return ctx
 
 
+class CartSummaryView(APIView):
+    """
+    GET /cart/summary/
+    Compact cart (items + products + totals + stock warnings) in one query.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return Response(build_cart_summary(request.user, request))
+
+
+class CartBatchView(APIView):
+    """
+    POST /cart/batch/
+    { "operations": [ {"op": "add"|"set"|"remove", "product_id": 1, "quantity": 2}, ... ] }
+    Applies all operations in one transaction and returns the cart summary.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        apply_cart_operations(request.user, serializer.validated_data["operations"])
+        return Response(build_cart_summary(request.user, request))
+
+
+class GuestCartView(APIView):
+    """
+    Anonymous cart stored in the cache only (no DB writes).
+    The client keeps the signed token and sends it as `X-Cart-Token`.
+
+    GET    /cart/guest/   -> summary
+    POST   /cart/guest/   -> same body as /cart/batch/; issues a token if needed
+    DELETE /cart/guest/   -> drop the cart
+
+    The cart is merged into the user's Cart when `cart_token` is sent
+    along with login / signup.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        return Response(build_guest_cart_summary(guest_cart_token(request), request))
+
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        token = guest_cart_token(request)
+        if not load_guest_cart(token):
+            # unknown, expired or forged -> start a fresh cart
+            token = new_guest_cart_token()
+
+        apply_guest_cart_operations(token, serializer.validated_data["operations"])
+        return Response(build_guest_cart_summary(token, request))
+
+    def delete(self, request):
+        save_guest_cart(guest_cart_token(request), {})
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+# ─── Stock Reservations ────────────────────
+class ReservationView(APIView):
+    """
+    Checkout stock holds (expire after STOCK_HOLD_MINUTES).
+
+    GET    /reservations/  -> my active holds
+    POST   /reservations/  -> hold {"items": [{product_id, quantity}]} or my whole cart
+    DELETE /reservations/  -> release my holds
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def _active(self, request):
+        holds = active_holds().filter(user=request.user).select_related("product").order_by("id")
+        return StockReservationSerializer(holds, many=True).data
+
+    def get(self, request):
+        return Response(self._active(request))
+
+    def post(self, request):
+        serializer = ReservationRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        items = serializer.validated_data.get("items")
+        if items is None:
+            items = CartItem.objects.filter(cart__user=request.user).values("product_id", "quantity")
+
+        quantities = {}
+        for item in items:
+            quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+        if not quantities:
+            return Response({"error": "Nothing to reserve."}, status=400)
+
+        expires_at = reserve(request.user, quantities)
+        return Response({"expires_at": expires_at, "holds": self._active(request)})
+
+    def delete(self, request):
+        release(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 # ─── Orders ────────────────────────────────
+class OrderCursorPagination(CursorPagination):
+    """
+    Keyset pages for "My Orders": WHERE created_at < cursor, no OFFSET/COUNT,
+    so page N costs the same as page 1 (index: user, status, created_at).
+    """
+    page_size = 20
+    page_size_query_param = "limit"
+    max_page_size = 100
+    ordering = ("-created_at", "-id")
+
+
 class OrderViewSet(viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderCursorPagination
 
     def get_queryset(self):
         user = self.request.user
@@ -300,19 +429,92 @@ class OrderViewSet(viewsets.ModelViewSet):
             )
             .order_by("-created_at")
         )
+        if self.action == "list":
+            qs = self._filter_status(qs)
         if user.is_staff or user.is_superuser:
             return qs
         return qs.filter(user=user)
 
+    def _filter_status(self, qs):
+        """?status=TO_SHIP or ?status=COMPLETED,CANCELLED"""
+        raw = self.request.query_params.get("status")
+        if not raw:
+            return qs
+        wanted = [s.strip() for s in raw.split(",") if s.strip()]
+        unknown = sorted(set(wanted) - set(ORDER_STATUSES))
+        if unknown:
+            raise serializers.ValidationError({"status": f"Unknown status: {', '.join(unknown)}"})
+        return qs.filter(status__in=wanted)
+
+    @action(detail=False, methods=["get"])
+    def counts(self, request):
+        """
+        GET /orders/counts/
+        Tab badges from the per-user counters (one indexed read, no COUNT(*)).
+        """
+        counts = status_counts(request.user)
+        counts["HISTORY"] = counts["COMPLETED"] + counts["CANCELLED"]
+        return Response(counts)
+
     def get_serializer_context(self):
         return {"request": self.request}
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         # ✅ atomic checkout creation
         with transaction.atomic():
             return super().create(request, *args, **kwargs)
 
+    @action(detail=False, methods=["post"])
+    @idempotent
+    def checkout(self, request):
+        """
+        POST /orders/checkout/
+        Turn the user's current Cart into an Order in ONE request/transaction.
+        Body: address fields + payment_method; optional "item_ids" to check out
+        only some cart lines. Prices are snapshotted, stock decremented in bulk,
+        the Payment row created and the checked-out lines removed with one DELETE.
+        """
+        # item_ids straight from request.data: a form's repeated keys survive
+        selection = CheckoutSelectionSerializer(data=request.data)
+        selection.is_valid(raise_exception=True)
+        item_ids = selection.validated_data.get("item_ids")
+
+        data = request.data.dict() if hasattr(request.data, "dict") else dict(request.data)
+        data.pop("item_ids", None)
+
+        with transaction.atomic():
+            # lock the cart so a double-click can't check it out twice
+            list(Cart.objects.select_for_update().filter(user=request.user))
+
+            lines = CartItem.objects.filter(cart__user=request.user)
+            if item_ids:
+                lines = lines.filter(id__in=item_ids)
+            items = list(lines.order_by("id").values("product_id", "quantity"))
+            if not items:
+                return Response({"error": "Cart is empty."}, status=400)
+
+            serializer = self.get_serializer(data={**data, "items": items})
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+            lines.delete()
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def _respond(self, order):
+        return Response(OrderSerializer(order, context={"request": self.request}).data)
+
+    def _transition(self, action_name, order=None, **payment_fields):
+        order = order or self.get_object()
+        try:
+            order = transition(order, action_name, actor=self.request.user, **payment_fields)
+        except TransitionError as e:
+            return Response({"error": str(e)}, status=400)
+        return self._respond(order)
+
     @action(detail=True, methods=["post"])
+    @idempotent
     def pay(self, request, pk=None):
         with transaction.atomic():
             order = self.get_object()
@@ -333,280 +535,79 @@ class OrderViewSet(viewsets.ModelViewSet):
             if method not in ["CARD", "FPX", "E_WALLET"]:
                 return Response({"error": "Invalid or missing payment method."}, status=400)
 
-            payment = Payment.objects.filter(order=order).first()
-            if not payment:
-                payment = Payment.objects.create(
-                    order=order, amount=order.total, method=method, status="PENDING"
+            if settings.PAYMENT_WEBHOOK_ONLY:
+                # the gateway's signed webhook decides (shop/payment_events.py)
+                try:
+                    order = record_payment_started(order, method, txid, actor=request.user)
+                except TransitionError as e:
+                    return Response({"error": str(e)}, status=400)
+                return Response(
+                    {"detail": "Payment pending.", "order": OrderSerializer(order, context={"request": request}).data},
+                    status=202,
                 )
 
-            payment.method = method
-            payment.amount = order.total
-            if txid:
-                payment.transaction_id = txid
-
             if not success:
-                payment.status = "FAILED"
-                payment.save(update_fields=["method", "amount", "transaction_id", "status"])
-                order.status = "TO_PAY"
-                order.save(update_fields=["status"])
+                try:
+                    order = record_payment_failure(order, method, txid, actor=request.user)
+                except TransitionError as e:
+                    return Response({"error": str(e)}, status=400)
                 return Response(
                     {"detail": "Payment failed.", "order": OrderSerializer(order, context={"request": request}).data},
                     status=400
                 )
 
-            payment.status = "SUCCESS"
-            if not payment.transaction_id:
-                payment.transaction_id = f"PAY-{timezone.now().strftime('%Y%m%d%H%M%S')}-{order.id}"
-
-            order.status = "TO_SHIP"
-            payment.save(update_fields=["method", "amount", "transaction_id", "status"])
-            order.save(update_fields=["status"])
-
-            return Response(OrderSerializer(order, context={"request": request}).data)
+            return self._transition("pay", order, method=method, transaction_id=txid)
 
     @action(detail=True, methods=["post"])
     def cancel(self, request, pk=None):
-        with transaction.atomic():
-            order = self.get_object()
-
-            if order.status not in ["TO_PAY", "TO_SHIP"]:
-                return Response({"error": "Order cannot be cancelled."}, status=400)
-
-            # ✅ restock efficiently
-            for item in order.items.all():
-                Product.objects.filter(id=item.product_id).update(
-                    stock=F("stock") + item.quantity
-                )
-
-            # ✅ sync payment
-            payment = Payment.objects.filter(order=order).first()
-            if payment and payment.status in ["PENDING", "SUCCESS"]:
-                payment.status = "CANCELLED"
-                payment.save(update_fields=["status"])
-
-            order.status = "CANCELLED"
-            order.save(update_fields=["status"])
-
-            return Response(OrderSerializer(order, context={"request": request}).data)
+        # ✅ restock (one CASE UPDATE) + payment sync handled by order_flow
+        return self._transition("cancel")
 
     @action(detail=True, methods=["post"], permission_classes=[IsAdminUser])
     def ship(self, request, pk=None):
-        order = self.get_object()
-
-        if order.status != "TO_SHIP":
-            return Response({"error": "Order cannot be shipped."}, status=400)
-
-        payment = Payment.objects.filter(order=order).first()
-        if not payment:
-            return Response({"error": "No payment record."}, status=400)
-
-        if payment.method != "COD" and payment.status != "SUCCESS":
-            return Response({"error": "Payment not successful."}, status=400)
-
-        order.status = "TO_RECEIVE"
-        order.save(update_fields=["status"])
-        return Response(OrderSerializer(order, context={"request": request}).data)
+        return self._transition("ship")
 
     @action(detail=True, methods=["post"])
     def deliver(self, request, pk=None):
-        with transaction.atomic():
-            order = self.get_object()
-
-            if order.status != "TO_RECEIVE":
-                return Response({"error": "Order cannot be delivered."}, status=400)
-
-            order.status = "TO_RATE"
-            order.save(update_fields=["status"])
-
-            # ✅ COD becomes SUCCESS when delivered (keep this rule)
-            payment = Payment.objects.filter(order=order).first()
-            if payment and payment.method == "COD" and payment.status != "SUCCESS":
-                payment.status = "SUCCESS"
-                if not payment.transaction_id:
-                    payment.transaction_id = f"COD-{timezone.now().strftime('%Y%m%d%H%M%S')}-{order.id}"
-                payment.save(update_fields=["status", "transaction_id"])
-
-            return Response(OrderSerializer(order, context={"request": request}).data)
+        # ✅ COD becomes SUCCESS when delivered (rule lives in order_flow)
+        return self._transition("deliver")
 
     @action(detail=True, methods=["post"])
     def complete(self, request, pk=None):
-        order = self.get_object()
-        if order.status != "TO_RATE":
-            return Response({"error": "Order cannot be completed."}, status=400)
-        order.status = "COMPLETED"
-        order.save(update_fields=["status"])
-        return Response(OrderSerializer(order, context={"request": request}).data)
-    
+        return self._transition("complete")
 
     @action(detail=True, methods=["get"], url_path="receipt-pdf")
     def receipt_pdf(self, request, pk=None):
         """
-        Generate a PDF for this order.
-
-        - If payment is SUCCESS -> acts as a Payment Receipt.
-        - If payment is COD / PENDING -> acts as Order Confirmation / Invoice.
+        PDF for this order (receipt if paid, otherwise invoice).
+
+        - Rendered once per order/payment version and kept in storage;
+          repeat downloads stream the stored file (no reportlab).
+        - ETag = version, so the browser can revalidate with a 304.
+        - Rendering happens in the renderer process pool; if every render slot
+          stays busy for RECEIPT_RENDER_WAIT_SECONDS, or the render outlives
+          RECEIPT_RENDER_TIMEOUT, we answer 503 + Retry-After.
         - Always accessible only by the order owner (enforced by get_queryset()).
         """
         order = self.get_object()
-        try:
-            payment = order.payment
-        except Payment.DoesNotExist:
-            payment = None
-
-        buffer = BytesIO()
-        p = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-
-        # ─── Header / Brand ─────────────────────────────────
-        y = height - 30 * mm
-        p.setFont("Helvetica-Bold", 18)
-        p.drawString(25 * mm, y, "GERAIN CHAN OFFICIAL STORE")
-
-        # Decide document title based on payment status
-        is_paid = bool(payment and payment.status == "SUCCESS")
-        doc_title = "Payment Receipt" if is_paid else "Order Confirmation / Invoice"
-
-        y -= 8 * mm
-        p.setFont("Helvetica", 11)
-        p.drawString(25 * mm, y, doc_title)
-
-        # ─── Order Details ──────────────────────────────────
-        y -= 10 * mm
-        p.setFont("Helvetica", 10)
-        p.drawString(25 * mm, y, f"Order ID: {order.id}")
-        y -= 5 * mm
-        p.drawString(
-            25 * mm,
-            y,
-            f"Order Date: {order.created_at.strftime('%Y-%m-%d %H:%M')}",
-        )
-        y -= 5 * mm
-        p.drawString(25 * mm, y, f"Order Status: {order.status}")
-
-        # ─── Customer / Shipping Info ───────────────────────
-        y -= 10 * mm
-        p.setFont("Helvetica-Bold", 11)
-        p.drawString(25 * mm, y, "Bill To / Ship To:")
-        p.setFont("Helvetica", 10)
-
-        address_lines = [
-            order.fullname,
-            f"Phone: {order.phone}",
-            order.line1,
-            order.line2 or "",
-            f"{order.postcode} {order.city}",
-            f"{order.state}, {order.country}",
-        ]
-        for line in address_lines:
-            if line:
-                y -= 5 * mm
-                p.drawString(25 * mm, y, line)
-
-        # ─── Items Header ───────────────────────────────────
-        y -= 10 * mm
-        p.setFont("Helvetica-Bold", 11)
-        p.drawString(25 * mm, y, "Items")
-        p.setFont("Helvetica", 10)
-
-        y -= 6 * mm
-        p.drawString(25 * mm, y, "Product")
-        p.drawString(110 * mm, y, "Qty")
-        p.drawString(130 * mm, y, "Price")
-        p.drawString(160 * mm, y, "Total")
-
-        y -= 4 * mm
-        p.line(25 * mm, y, 185 * mm, y)
-
-        # ─── Items List ─────────────────────────────────────
-        for item in order.items.all():
-            line_total = float(item.price) * item.quantity
-
-            y -= 7 * mm
-            if y < 40 * mm:
-                p.showPage()
-                p.setFont("Helvetica", 10)
-                y = height - 30 * mm
-
-                # re-draw columns header on new page
-                p.setFont("Helvetica-Bold", 11)
-                p.drawString(25 * mm, y, "Items (cont.)")
-                p.setFont("Helvetica", 10)
-                y -= 6 * mm
-                p.drawString(25 * mm, y, "Product")
-                p.drawString(110 * mm, y, "Qty")
-                p.drawString(130 * mm, y, "Price")
-                p.drawString(160 * mm, y, "Total")
-                y -= 4 * mm
-                p.line(25 * mm, y, 185 * mm, y)
-
-            p.drawString(25 * mm, y, item.product.name[:40])
-            p.drawString(112 * mm, y, str(item.quantity))
-            p.drawRightString(150 * mm, y, f"RM {float(item.price):.2f}")
-            p.drawRightString(185 * mm, y, f"RM {line_total:.2f}")
-
-        # ─── Total ──────────────────────────────────────────
-        y -= 10 * mm
-        p.line(120 * mm, y, 185 * mm, y)
-        y -= 6 * mm
-        p.setFont("Helvetica-Bold", 11)
-        p.drawRightString(150 * mm, y, "Total:")
-        p.drawRightString(185 * mm, y, f"RM {float(order.total):.2f}")
-
-        # ─── Payment Info ───────────────────────────────────
-        y -= 12 * mm
-        p.setFont("Helvetica-Bold", 11)
-        p.drawString(25 * mm, y, "Payment")
-        p.setFont("Helvetica", 10)
-
-        if payment:
-            method = payment.method
-            status = payment.status
-            txid = payment.transaction_id or "-"
-        else:
-            method = "N/A"
-            status = "N/A"
-            txid = "-"
-
-        y -= 6 * mm
-        p.drawString(25 * mm, y, f"Method: {method}")
-        y -= 5 * mm
-        p.drawString(25 * mm, y, f"Status: {status}")
-
-        # Only show TX ID for successful non-COD payments
-        if is_paid and method != "COD":
-            y -= 5 * mm
-            p.drawString(25 * mm, y, f"Transaction ID: {txid}")
-
-        # ─── Footer ─────────────────────────────────────────
-        y -= 15 * mm
-        p.setFont("Helvetica-Oblique", 9)
-
-        if is_paid:
-            p.drawString(
-                25 * mm,
-                y,
-                "Thank you for your payment and for shopping with GERAIN CHAN.",
-            )
-        elif method == "COD":
-            p.drawString(
-                25 * mm,
-                y,
-                "Thank you for your order. For COD, please pay the amount due upon delivery.",
-            )
-        else:
-            p.drawString(
-                25 * mm,
-                y,
-                "Thank you for your order. Payment is pending.",
-            )
+        etag = quote_etag(receipt_version(order))
 
-        p.showPage()
-        p.save()
-        buffer.seek(0)
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponse(status=304)
+        else:
+            try:
+                path, _ = ensure_receipt(order, wait=settings.RECEIPT_RENDER_WAIT_SECONDS)
+            except RenderBusy:
+                return Response(
+                    {"error": "Receipt is being generated, please retry shortly."},
+                    status=503,
+                    headers={"Retry-After": "2"},
+                )
+            response = FileResponse(receipt_storage().open(path, "rb"), content_type="application/pdf")
+            response["Content-Disposition"] = f'inline; filename="order_{order.id}.pdf"'
 
-        filename = f"order_{order.id}.pdf"
-        response = HttpResponse(buffer, content_type="application/pdf")
-        response["Content-Disposition"] = f'inline; filename="{filename}"'
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
         return response
 
 # ─── Payments ──────────────────────────────
@@ -655,64 +656,106 @@ class PaymentViewSet(viewsets.ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-# ─── Quizzes ───────────────────────────────
-class QuizViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Quiz.objects.all()
-    serializer_class = QuizSerializer
+class PaymentWebhookView(APIView):
+    """
+    POST /payments/webhook/  (called by the payment gateway, not by users)
+    Body: one event, or {"events": [...]}. Header X-Gateway-Signature.
+    Events are stored (deduplicated on their id) and applied in the
+    background, so the gateway gets its 200 right away.
+    """
+    authentication_classes = []
     permission_classes = [permissions.AllowAny]
 
+    def post(self, request):
+        secret = settings.PAYMENT_WEBHOOK_SECRET
+        if not secret:
+            return Response({"error": "Webhook not configured."}, status=503)
 
-class QuizSubmitView(APIView):
-    permission_classes = [permissions.IsAuthenticated]
+        body = request.body
+        signature = request.headers.get("X-Gateway-Signature", "")
+        if not verify_signature(body, signature, secret, settings.PAYMENT_WEBHOOK_TOLERANCE):
+            return Response({"error": "Invalid signature."}, status=400)
 
-    def post(self, request, *args, **kwargs):
-        quiz_id = request.data.get("quiz")
-        answers = request.data.get("answers", [])
+        try:
+            data = json.loads(body)
+            events = data["events"] if isinstance(data, dict) and "events" in data else [data]
+            if not isinstance(events, list) or not 0 < len(events) <= MAX_EVENTS_PER_REQUEST:
+                raise InvalidEvent("Expected 1-%d events." % MAX_EVENTS_PER_REQUEST)
+            stored, duplicates = ingest(events)
+        except (ValueError, InvalidEvent) as e:
+            return Response({"error": str(e)}, status=400)
 
-        quiz = get_object_or_404(Quiz, id=quiz_id)
+        return Response({"received": stored, "duplicates": duplicates})
 
-        selected_answers = QuizAnswer.objects.filter(id__in=answers)
-        if not selected_answers.exists():
-            return Response({"error": "No answers provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-        category_counts = Counter(
-            [a.category for a in selected_answers if a.category]
-        )
-        top_category = category_counts.most_common(1)[0][0] if category_counts else None
+# ─── Quizzes ───────────────────────────────
+class QuizViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Public quiz API. Responses come from cached quiz documents (see
+    quiz_engine), versioned per quiz and bumped by the admin quiz endpoints;
+    ETag = version so browsers/CDNs can revalidate with a 304.
+    """
+    queryset = public_quizzes()
+    serializer_class = QuizSerializer
+    permission_classes = [permissions.AllowAny]
+
+    def _document_response(self, request, data, version):
+        etag = quote_etag(version)
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponse(status=304)
+        else:
+            response = Response(data)
+        response["ETag"] = etag
+        response["Cache-Control"] = "public, no-cache"
+        return response
 
-        products_qs = Product.objects.all()
+    def list(self, request, *args, **kwargs):
+        return self._document_response(request, *quiz_list_document())
 
-        # 1) category filter from answers
-        if top_category:
-            products_qs = products_qs.filter(category=top_category)
+    def retrieve(self, request, *args, **kwargs):
+        return self._document_response(request, *quiz_document(kwargs["pk"]))
 
-        # 2) audience filter from quiz -> product.target
-        if quiz.audience == "MEN":
-            products_qs = products_qs.filter(target__in=["MEN", "UNISEX"])
-        elif quiz.audience == "WOMEN":
-            products_qs = products_qs.filter(target__in=["WOMEN", "UNISEX"])
-        elif quiz.audience == "UNISEX":
-            products_qs = products_qs.filter(target="UNISEX")
-        # ANY = no restriction
 
-        # 3) whitelist (tight control)
-        allowed_ids = list(quiz.allowed_products.values_list("id", flat=True))
-        if allowed_ids:
-            products_qs = products_qs.filter(id__in=allowed_ids)
+class QuizSubmitView(APIView):
+    """
+    POST /quiz-submit/ {"quiz": id, "answers": [answer ids]}
+    -> {id, recommended_category, recommended_products, persona, created_at}
+
+    recommended_products are product cards memoized with the compiled quiz:
+    their stock and rating may lag by up to QUIZ_ENGINE_TTL seconds, since
+    checkout stock moves don't recompile quizzes. Treat them as a
+    suggestion; product pages and the cart carry the live stock.
+    WEIGHTED quizzes return top_k products, fewer only if fewer are allowed.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        # scoring is precompiled per quiz (see quiz_engine); answers from
+        # other quizzes are ignored
+        compiled = get_compiled_quiz(request.data.get("quiz"))
+        fingerprint = compiled.fingerprint(request.data.get("answers", []))
+        if not fingerprint:
+            return Response({"error": "No answers provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-        products_qs = products_qs.distinct()
+        rec = compiled.recommend(fingerprint, request)
 
-        # create result row
+        # one row per result: a single INSERT (ranked product ids inline)
         result = QuizResult.objects.create(
             user=request.user,
-            quiz=quiz,
-            recommended_category=top_category or "",
+            quiz=compiled.quiz,
+            recommended_category=rec["recommended_category"],
+            product_ids=rec["product_ids"],
+            answer_ids=list(fingerprint),
         )
-        result.recommended_products.set(products_qs)
 
-        # 🔥 return full result including persona
-        serializer = QuizResultSerializer(result, context={"request": request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # 🔥 return full result including persona (same shape as QuizResultSerializer)
+        return Response({
+            "id": result.id,
+            "recommended_category": rec["recommended_category"],
+            "recommended_products": rec["recommended_products"],
+            "persona": rec["persona"],
+            "created_at": serializers.DateTimeField().to_representation(result.created_at),
+        }, status=status.HTTP_200_OK)
 
 
 # ─── Admin User Management ───────────────────────────────
@@ -782,35 +825,218 @@ class AdminProductMediaViewSet(viewsets.ModelViewSet):
         return self.queryset.filter(product_id=pid) if pid else self.queryset
     
 class AdminOrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all().select_related("user").prefetch_related("items__product")
+    queryset = Order.objects.all().select_related("user", "payment").prefetch_related("items__product")
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAdminUser]
 
     @action(detail=True, methods=["post"])
     def update_status(self, request, pk=None):
         order = self.get_object()
-        new_status = request.data.get("status")
+        try:
+            order = set_status(order, request.data.get("status"), actor=request.user)
+        except TransitionError as e:
+            return Response({"error": str(e)}, status=400)
+        return Response(OrderSerializer(order, context={"request": request}).data)
 
-        valid_statuses = ["TO_PAY", "TO_SHIP", "TO_RECEIVE", "TO_RATE", "COMPLETED", "CANCELLED"]
-        if new_status not in valid_statuses:
-            return Response({"error": "Invalid status"}, status=400)
+    @action(detail=False, methods=["post"], url_path="bulk-transition")
+    def bulk_transition(self, request):
+        """
+        POST /admin/orders/bulk-transition/
+        Body: {"order_ids": [..], "action": "ship" | "deliver" | "complete" | "cancel"}
+        Runs in ONE transaction; orders not in a valid state are reported, not fatal.
+        """
+        serializer = BulkTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated, skipped = apply_transition(
+            serializer.validated_data["order_ids"],
+            serializer.validated_data["action"],
+            actor=request.user,
+        )
+        return Response({
+            "updated": [o.id for o in updated],
+            "skipped": [{"id": oid, "error": reason} for oid, reason in sorted(skipped.items())],
+        })
+
+    @action(detail=True, methods=["get"])
+    def events(self, request, pk=None):
+        order = self.get_object()
+        qs = order.events.select_related("actor")
+        return Response(OrderEventSerializer(qs, many=True).data)
 
-        order.status = new_status
-        order.save()
-        return Response(OrderSerializer(order, context={"request": request}).data)
-    
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         instance.delete()
         return Response({"detail": "Order deleted"}, status=status.HTTP_204_NO_CONTENT)
 
 
+class AdminInvoiceExportView(APIView):
+    """
+    GET /admin/orders/invoices.zip?from=YYYY-MM-DD&to=YYYY-MM-DD&status=COMPLETED,TO_RATE
+    Streams a ZIP of invoice PDFs while it's being built.
+    Poll /admin/orders/invoices-progress/<X-Export-Id>/ for progress
+    (or pass your own ?export_id= to know the id before the download starts).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = InvoiceExportSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        opts = params.validated_data
+
+        qs = export_queryset(opts.get("date_from"), opts.get("date_to"), opts.get("status"))
+        total = qs.count()
+        export_id = opts.get("export_id") or new_export_id()
+
+        label = "_".join(str(opts[k]) for k in ("date_from", "date_to") if opts.get(k)) or "all"
+        response = StreamingHttpResponse(
+            stream_invoices_zip(qs, export_id, total), content_type="application/zip"
+        )
+        response["Content-Disposition"] = f'attachment; filename="invoices_{label}.zip"'
+        response["X-Export-Id"] = export_id
+        response["X-Total-Count"] = str(total)
+        return response
+
+
+class AdminInvoiceExportProgressView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, export_id):
+        progress = get_progress(export_id)
+        if progress is None:
+            return Response({"error": "Unknown export."}, status=404)
+        return Response(progress)
+
+class AdminExportView(APIView):
+    """
+    GET /admin/export/<entity>.<csv|ndjson>?from=&to=&status=..
+    entity: orders | payments | users | reviews (filters per entity in shop/exports.py).
+    Streams rows straight from a DB cursor; works for any table size.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, entity, fmt):
+        if entity not in EXPORTS or fmt not in FORMATS:
+            return Response({"error": "Unknown export."}, status=404)
+
+        names, rows = export_rows(entity, request.query_params)
+        stamp = timezone.now().strftime("%Y%m%d-%H%M")
+        response = StreamingHttpResponse(stream_export(fmt, names, rows), content_type=FORMATS[fmt])
+        response["Content-Disposition"] = f'attachment; filename="{entity}_{stamp}.{fmt}"'
+        return response
+
+class AdminSalesAnalyticsView(APIView):
+    """
+    GET /admin/analytics/sales/?from=YYYY-MM-DD&to=YYYY-MM-DD&group=day|week|month
+        &dimension=total|product|category|target|payment_method&limit=10
+    Reads only the SalesRollup table (default range: last 30 days).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = SalesAnalyticsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        opts = params.validated_data
+
+        date_from, date_to = opts["date_from"], opts["date_to"]
+
+        data = sales_series(
+            date_from, date_to,
+            group=opts["group"], dimension=opts["dimension"], limit=opts.get("limit"),
+        )
+        return Response({
+            "from": date_from,
+            "to": date_to,
+            "group": opts["group"],
+            "dimension": opts["dimension"],
+            **data,
+        })
+
+class AdminQuizAnalyticsView(APIView):
+    """
+    GET /admin/analytics/quizzes/?from=YYYY-MM-DD&to=YYYY-MM-DD&quiz=<id>
+    Quiz funnel per quiz (takers, answer picks, category mix, conversions
+    within QUIZ_CONVERSION_DAYS) from the QuizFunnelRollup table only.
+    Default range: last 30 days.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = QuizAnalyticsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        opts = params.validated_data
+
+        date_from, date_to = opts["date_from"], opts["date_to"]
+
+        quizzes, final_through = quiz_funnel(date_from, date_to, quiz_id=opts.get("quiz"))
+        return Response({
+            "from": date_from,
+            "to": date_to,
+            "conversion_days": settings.QUIZ_CONVERSION_DAYS,
+            "conversions_final_through": final_through,
+            "quizzes": quizzes,
+        })
+
+
+class ReconciliationIssuePagination(CursorPagination):
+    page_size = 100
+    page_size_query_param = "limit"
+    max_page_size = 500
+    ordering = ("id",)
+
+
+class AdminReconciliationViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    GET  /admin/reconciliation/            runs (newest first)
+    POST /admin/reconciliation/            {"repair": false} -> start a run in the background
+    GET  /admin/reconciliation/{id}/       progress + {kind: count} summary
+    GET  /admin/reconciliation/{id}/issues/?kind=amount_mismatch
+    """
+    queryset = ReconciliationRun.objects.select_related("started_by")
+    serializer_class = ReconciliationRunSerializer
+    permission_classes = [IsAdminUser]
+
+    def create(self, request):
+        # a RUNNING row older than that is a crashed worker, not a live run
+        recent = timezone.now() - timedelta(hours=6)
+        if ReconciliationRun.objects.filter(status="RUNNING", started_at__gte=recent).exists():
+            return Response({"error": "A reconciliation run is already in progress."}, status=409)
+        repair = str(request.data.get("repair", "")).lower() in ("1", "true", "yes")
+        run = start_reconciliation(user=request.user, repair=repair)
+        return Response(self.get_serializer(run).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=["get"])
+    def issues(self, request, pk=None):
+        run = self.get_object()
+        qs = run.issues.all()
+        kind = request.query_params.get("kind")
+        if kind:
+            qs = qs.filter(kind=kind)
+        paginator = ReconciliationIssuePagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+        return paginator.get_paginated_response(ReconciliationIssueSerializer(page, many=True).data)
+
 # ─── Admin Quiz Management ───────────────────────────────
 class AdminQuizViewSet(viewsets.ModelViewSet):
     queryset = Quiz.objects.all()
     serializer_class = AdminQuizSerializer
     permission_classes = [permissions.IsAdminUser]
 
+    @action(detail=True, methods=["get", "put"], url_path="document")
+    def document(self, request, pk=None):
+        """
+        GET /admin/quizzes/{id}/document/  whole tree: quiz fields, allowed_products, questions -> answers
+        PUT same shape: with id = update, without id = create, left out = delete;
+            diffed and applied in one transaction (see quiz_builder)
+        """
+        quiz = self.get_object()
+        if request.method == "GET":
+            return Response(quiz_tree(quiz.id))
+
+        params = QuizDocumentSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        changes = save_quiz_tree(quiz.id, params.validated_data)
+        return Response({**quiz_tree(quiz.id), "changes": changes})
+
 
 class AdminQuizQuestionViewSet(viewsets.ModelViewSet):
     queryset = QuizQuestion.objects.all()
@@ -819,7 +1045,7 @@ class AdminQuizQuestionViewSet(viewsets.ModelViewSet):
 
 
 class AdminQuizAnswerViewSet(viewsets.ModelViewSet):
-    queryset = QuizAnswer.objects.all()
+    queryset = QuizAnswer.objects.select_related("question")
     serializer_class = AdminQuizAnswerSerializer
     permission_classes = [permissions.IsAdminUser]
 
@@ -829,9 +1055,9 @@ def AdminCategoryList(request):
     """
     Returns a list of all unique product categories for dropdowns.
     Used by the admin panel when adding/editing products.
+    Served from the category registry (shop/categories.py).
     """
-    cats = list(Product.objects.values_list("category", flat=True).distinct())
-    return Response(sorted(cats))
+    return Response(list(get_categories()))
 
 class ScentPersonaViewSet(viewsets.ModelViewSet):
     """
@@ -1065,11 +1291,18 @@ class AdminPaymentViewSet(viewsets.ModelViewSet):
             )
 
         # --- Apply changes to Payment ---
-        payment.status = new_status
-        payment.method = new_method
-        payment.transaction_id = new_txid
-        payment.amount = new_amount
-        payment.save()
+        # a sale counted under the old method moves to the new one in the rollups
+        regroup = counts_as_sale(payment.order.status) and new_method != payment.method
+        with transaction.atomic():
+            if regroup:
+                record_sales([payment.order_id], -1)
+            payment.status = new_status
+            payment.method = new_method
+            payment.transaction_id = new_txid
+            payment.amount = new_amount
+            payment.save()
+            if regroup:
+                record_sales([payment.order_id])
 
         # --- Sync related Order (non-final only) ---
         order = payment.order
@@ -1077,14 +1310,12 @@ class AdminPaymentViewSet(viewsets.ModelViewSet):
             if new_status == "SUCCESS":
                 # For non-COD successful payments: if order was waiting to be paid, move it forward
                 if payment.method != "COD" and order.status == "TO_PAY":
-                    order.status = "TO_SHIP"
-                    order.save()
+                    apply_transition([order.id], "payment_confirmed", actor=request.user)
 
             elif new_status == "FAILED":
                 # Ensure order is payable again so user can retry
-                if order.status not in ["TO_PAY", "CANCELLED"]:
-                    order.status = "TO_PAY"
-                    order.save()
+                if order.status != "TO_PAY":
+                    apply_transition([order.id], "payment_reopened", actor=request.user)
 
             elif new_status == "CANCELLED":
                 # Intentionally do nothing to order by default.
@@ -1096,6 +1327,8 @@ class AdminPaymentViewSet(viewsets.ModelViewSet):
 
             # PENDING: no auto-change to order
 
+        schedule_receipts([payment.order_id])
+
         # Return updated payment
         serializer = self.get_serializer(payment)
         return Response(serializer.data)
@@ -1106,6 +1339,12 @@ class AdminPaymentViewSet(viewsets.ModelViewSet):
         Does NOT touch the order.
         """
         instance = self.get_object()
-        instance.delete()
+        counted = counts_as_sale(instance.order.status)
+        with transaction.atomic():
+            if counted:
+                record_sales([instance.order_id], -1)
+            instance.delete()
+            if counted:
+                record_sales([instance.order_id])  # now under "NONE"
         return Response({"detail": "Payment deleted"}, status=status.HTTP_204_NO_CONTENT)
 